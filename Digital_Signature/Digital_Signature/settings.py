@@ -49,6 +49,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "signature.middleware.SigningMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "Digital_Signature.urls"
@@ -83,6 +84,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # A file-backed test database, so tests that sign from several
+        # threads wait on SQLite's busy timeout like the real database does.
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
@@ -123,7 +127,106 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Hash uploads while they stream in so identical agreements are stored once.
+FILE_UPLOAD_HANDLERS = [
+    "signature.uploadhandlers.HashingMemoryFileUploadHandler",
+    "signature.uploadhandlers.HashingTemporaryFileUploadHandler",
+]
+
+# 'cold' is the secondary tier finished agreements are moved to by
+# `manage.py archive_agreements`; a local directory here, typically an object
+# store (e.g. django-storages' S3 backend) in production.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    "cold": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": os.path.join(BASE_DIR, 'cold_storage')},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Signing
+
+# 'incremental' appends each signer's stamp to the agreement as a PDF
+# incremental update; 'rewrite' re-writes the whole document per signature.
+SIGNATURE_PDF_WRITE_MODE = 'incremental'
+
+# PDF library used to stamp agreements: 'pypdf2' (the reference engine) or
+# 'pikepdf', which is several times faster on large documents and needs the
+# pikepdf package. See signature/engines/.
+SIGNATURE_PDF_ENGINE = 'pypdf2'
+
+# 'immediate' stamps the agreement on every signing request; 'deferred' stores
+# the signature and composites the signed copy once, when the last borrower
+# signs or when the signed agreement is first requested; 'queued' stores the
+# signature and leaves compositing to `manage.py process_stamping_jobs`.
+SIGNATURE_STAMPING_MODE = 'deferred'
+
+# Worker processes used by process_stamping_jobs.
+SIGNATURE_STAMPING_WORKERS = 2
+
+# Signature pad uploads larger than this are rejected before they are decoded.
+SIGNATURE_MAX_IMAGE_BYTES = 1024 * 1024
+SIGNATURE_MAX_IMAGE_PIXELS = 4000 * 2000
+
+# Text marking where signatures go. Stamps on a page containing it are laid
+# out from its position instead of from the bottom-left corner.
+SIGNATURE_ANCHOR_TEXT = 'Borrower Signature'
+
+# Largest agreement document accepted, in bytes and pages. Larger files go
+# through the chunked upload endpoint (signature/uploads.py), which the
+# upload step's form uses in pieces of SIGNATURE_UPLOAD_CHUNK_BYTES.
+SIGNATURE_MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+SIGNATURE_MAX_UPLOAD_PAGES = 2000
+SIGNATURE_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Longest page range the original document is served in by
+# original_document_pages; the acknowledgement page asks for one page at a
+# time as the borrower scrolls.
+SIGNATURE_MAX_PAGES_PER_REQUEST = 10
+
+# Route the borrower-facing views to signature/async_views.py, for serving
+# over ASGI (e.g. `uvicorn Digital_Signature.asgi:application`). Signing,
+# compositing and page splitting then run on SIGNATURE_ASYNC_WORKERS threads
+# per server process.
+SIGNATURE_ASYNC_VIEWS = False
+SIGNATURE_ASYNC_WORKERS = 4
+
+# Write an agreement's final signed copy linearized ("fast web view"), so
+# the first page shows after its first few kilobytes arrive. Needs the
+# optional pikepdf package (see stamping.linearize()), so it is off unless
+# turned on where pikepdf is installed.
+SIGNATURE_LINEARIZE_FINISHED = False
+
+# Fully signed agreements whose last signature is this old are recompressed
+# and their signed copies moved to STORAGES[SIGNATURE_COLD_STORAGE] by
+# `manage.py archive_agreements`; see signature/lifecycle.py.
+SIGNATURE_COLD_STORAGE = 'cold'
+SIGNATURE_ARCHIVE_AFTER_DAYS = 90
+
+# Threads that record and stamp the agreements of a batch signing (see
+# signature/batch.py), shared by every batch in a server process.
+SIGNATURE_BATCH_WORKERS = 4
+
+# Signing events go to the hash-chained audit log (signature/audit.py)
+# unsealed; each server process chains them in the background every
+# SIGNATURE_AUDIT_SEAL_BATCH events, and `manage.py verify_audit_log` seals
+# the rest and checks the chain from the last checkpoint on.
+SIGNATURE_AUDIT_SEAL_BATCH = 500
+
+# Timing spans and counters for signing, served at /signature/metrics/ in the
+# Prometheus text format and logged as one JSON line per request by the
+# signature.metrics logger. Off, they cost one flag check per span.
+SIGNATURE_METRICS_ENABLED = False
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"signature.metrics": {"handlers": ["console"], "level": "INFO", "propagate": False}},
+}
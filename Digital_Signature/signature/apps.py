@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class SignatureConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "signature"
+
+    def ready(self):
+        from django.conf import settings
+        from . import metrics, signals  # noqa: F401
+        metrics.configure(settings.SIGNATURE_METRICS_ENABLED)
@@ -0,0 +1,12 @@
+# signature/async_urls.py
+#
+# URLconf serving the borrower-facing views from async_views.py whatever
+# SIGNATURE_ASYNC_VIEWS says, so both sets can be run side by side (see
+# `manage.py benchmark_asgi`).
+from django.urls import include, path # type: ignore
+from . import async_views
+from .urls import batch_urlpatterns, signing_urlpatterns
+
+urlpatterns = [
+    path('signature/', include(signing_urlpatterns(async_views) + batch_urlpatterns)),
+]
@@ -0,0 +1,162 @@
+# signature/async_views.py
+#
+# Async versions of the borrower-facing views, routed in place of those in
+# views.py when SIGNATURE_ASYNC_VIEWS is on and the project is served over
+# ASGI (Digital_Signature/asgi.py). Lookups use the async ORM, PDFs are
+# streamed by delivery.aserve_file, and signing, compositing and page
+# splitting run on a bounded thread pool so the event loop keeps serving
+# other borrowers while they work.
+from asgiref.sync import sync_to_async # type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from django.conf import settings # type: ignore
+from django.db import close_old_connections, connection # type: ignore
+from django.http import Http404, HttpResponseBadRequest # type: ignore
+from django.shortcuts import redirect, render # type: ignore
+from django.views import View # type: ignore
+from . import metrics
+from .delivery import aserve_file
+from .images import SignatureImageError
+from .lifecycle import aserve_archived_document, is_final
+from .models import BorrowerSignature, LoanAgreement, StampingJob
+from .pagecache import page_range_path, page_sizes
+from .pages import PAGE_RANGE_RE
+from .signing import record_signature, signed_document, stamping_status
+import asyncio
+import contextvars
+import functools
+import threading
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.SIGNATURE_ASYNC_WORKERS, thread_name_prefix='signing')
+        return _executor
+
+
+def _call_in_worker(func, *args):
+    # Worker threads keep their own database connections, so they are
+    # recycled here the way Django does at request boundaries.
+    close_old_connections()
+    try:
+        with connection.execute_wrapper(metrics.time_query) if metrics.ENABLED else nullcontext():
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_in_worker(func, *args):
+    # The request's context goes along, so its metrics collector still sees
+    # the stages the worker runs.
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _call_in_worker, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+
+
+async def get_borrower(agreement_id, borrower_id):
+    try:
+        return await BorrowerSignature.objects.select_related('agreement').aget(pk=borrower_id, agreement_id=agreement_id)
+    except BorrowerSignature.DoesNotExist:
+        raise Http404
+
+
+async def apage_sizes(agreement):
+    # Without a page index page_sizes() has to read the document.
+    if agreement.page_index is None:
+        return await run_in_worker(page_sizes, agreement)
+    return page_sizes(agreement)
+
+
+class ViewOriginalDocumentView(View):
+    async def get(self, request, agreement_id, borrower_id):
+        borrower = await get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+        context = {
+            'document_url': agreement.document.url,
+            'borrower': borrower,
+            'pages': [
+                {'number': number, 'width': round(width, 2), 'height': round(height, 2)}
+                for number, (width, height) in enumerate(await apage_sizes(agreement), start=1)
+            ],
+        }
+        return render(request, 'original_document.html', context)
+
+    async def post(self, request, agreement_id, borrower_id):
+        if request.POST.get('acknowledge_checkbox'):
+            return redirect('sign_agreement', agreement_id=agreement_id, borrower_id=borrower_id)
+        else:
+            return HttpResponseBadRequest("Please acknowledge the document.")
+
+
+class OriginalDocumentPagesView(View):
+    async def get(self, request, agreement_id, borrower_id, pages):
+        borrower = await get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+        match = PAGE_RANGE_RE.match(pages)
+        if not match:
+            raise Http404
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first or last - first >= settings.SIGNATURE_MAX_PAGES_PER_REQUEST:
+            return HttpResponseBadRequest("Invalid page range.")
+        if last > len(await apage_sizes(agreement)):
+            raise Http404
+        path = await run_in_worker(page_range_path, agreement, first, last)
+        return await aserve_file(request, path, 'application/pdf')
+
+
+class SignAgreementView(View):
+    async def get(self, request, agreement_id, borrower_id):
+        borrower = await get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+        existing_signature = await BorrowerSignature.objects.filter(agreement=agreement, borrower_name=borrower.name).aexists()
+
+        if existing_signature:
+            return render(request, 'already_signed.html', {'agreement': agreement})
+        context = {
+            'agreement': agreement,
+            'borrower': borrower,
+        }
+        return render(request, 'signature/sign_agreement.html', context)
+
+    async def post(self, request, agreement_id, borrower_id):
+        borrower = await get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+
+        signature_data_url = request.POST.get('signature')
+        if signature_data_url:
+            try:
+                await run_in_worker(record_signature, agreement, borrower, signature_data_url, request.META.get('REMOTE_ADDR'))
+            except SignatureImageError as e:
+                return HttpResponseBadRequest(str(e))
+            return redirect('sign_agreement_success', agreement_id=agreement_id, borrower_id=borrower_id)
+
+
+class SignAgreementSuccessView(View):
+    async def get(self, request, agreement_id, borrower_id):
+        borrower = await get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+        status = await sync_to_async(stamping_status)(agreement)
+        return render(request, 'sign_agreement_success.html', {'agreement': agreement, 'borrower': borrower, 'stamping_status': status})
+
+
+class ViewSignedAgreementView(View):
+    async def get(self, request, agreement_id, borrower_id):
+        try:
+            agreement = await LoanAgreement.objects.aget(pk=agreement_id)
+        except LoanAgreement.DoesNotExist:
+            raise Http404
+        if agreement.archived_name:
+            return await aserve_archived_document(request, agreement)
+        status = await sync_to_async(stamping_status)(agreement)
+        if status in (StampingJob.PENDING, StampingJob.RUNNING, StampingJob.FAILED):
+            context = {'agreement': agreement, 'borrower_id': borrower_id, 'stamping_status': status}
+            return render(request, 'stamping_status.html', context, status=500 if status == StampingJob.FAILED else 202)
+        document = await run_in_worker(signed_document, agreement)
+        immutable = await sync_to_async(is_final)(agreement)
+        return await aserve_file(request, document.path, 'application/pdf', immutable=immutable)
@@ -0,0 +1,220 @@
+# signature/audit.py
+#
+# Append-only, hash-chained log of signing events: each signature, each
+# signed copy written, and each recompression by the storage lifecycle job,
+# with the SHA-256 of the agreement's PDF before and after. record() costs
+# one INSERT of an unsealed AuditEntry. seal() chains pending entries in
+# batches: under one lock it reads the head of the chain once, hashes each
+# entry together with the hash before it and writes the batch back in a
+# single bulk update. A process seals in the background every
+# SIGNATURE_AUDIT_SEAL_BATCH entries it records, and `manage.py
+# verify_audit_log` seals whatever is left before verifying. verify()
+# re-hashes the chain from the latest AuditCheckpoint on, so a run only
+# reads the entries added since the one before.
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings # type: ignore
+from django.core.files.storage import default_storage # type: ignore
+from django.db import close_old_connections, connection, transaction # type: ignore
+from .blobs import hash_file
+from .delivery import file_fingerprint
+from .locks import file_lock
+from .models import AuditCheckpoint, AuditEntry, LoanAgreement
+import datetime
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+GENESIS_HASH = '0' * 64
+# The columns an entry's hash covers, in order.
+FIELDS = (
+    'sequence', 'event', 'agreement_id', 'signature_id', 'signer', 'loan_id', 'ip_address', 'timestamp',
+    'document_before', 'document_after', 'prev_hash',
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_unsealed = 0
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audit-seal')
+        return _executor
+
+
+def audit_lock():
+    return file_lock(default_storage.path(os.path.join('locks', 'audit.lock')))
+
+
+def _canonical(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def entry_digest(values):
+    # `values` are an entry's FIELDS, in order.
+    return hashlib.sha256(json.dumps([_canonical(value) for value in values]).encode()).hexdigest()
+
+
+def file_sha256(path):
+    # Read afresh, for verification.
+    with open(path, 'rb') as f:
+        return hash_file(f)
+
+
+def document_sha256(agreement):
+    # The agreement's document as it stands, for logging: free while it is
+    # still the shared blob, whose key is its digest, and otherwise cached
+    # per file version by file_fingerprint(), so signing does not re-read a
+    # document whose digest the previous signature already logged.
+    if agreement.blob_id:
+        return agreement.blob_id
+    return file_fingerprint(agreement.document.path)
+
+
+def current_sha256(agreement):
+    # Digest of the copy the agreement is served from, or None when there is
+    # no signed copy to compare.
+    if agreement.archived_name:
+        return agreement.archived_sha256
+    if settings.SIGNATURE_STAMPING_MODE == 'immediate':
+        return agreement.blob_id or file_sha256(agreement.document.path)
+    if agreement.signed_document:
+        return file_sha256(agreement.signed_document.path)
+    return None
+
+
+def record(event, agreement_id, document_before, document_after='', signature=None):
+    entry = AuditEntry(event=event, agreement_id=agreement_id, document_before=document_before, document_after=document_after)
+    if signature is not None:
+        entry.signature_id = signature.id
+        entry.signer = signature.borrower_name
+        entry.loan_id = signature.loan_id
+        entry.ip_address = signature.ip_address
+        entry.timestamp = signature.timestamp
+    entry.save()
+    _seal_soon()
+    return entry
+
+
+def record_signed_copy(agreement, path):
+    # A signed copy composited from the agreement's document.
+    return record(AuditEntry.COMPOSITED, agreement.id, document_sha256(agreement), file_fingerprint(path))
+
+
+def _seal_soon():
+    global _unsealed
+    with _executor_lock:
+        _unsealed += 1
+        if _unsealed < settings.SIGNATURE_AUDIT_SEAL_BATCH:
+            return
+        _unsealed = 0
+    get_executor().submit(_seal_in_background)
+
+
+def _seal_in_background():
+    close_old_connections()
+    try:
+        seal()
+    finally:
+        close_old_connections()
+
+
+def seal(batch_size=None):
+    # Chains every unsealed entry, oldest first, and returns how many.
+    batch_size = batch_size or settings.SIGNATURE_AUDIT_SEAL_BATCH
+    sealed = 0
+    with audit_lock():
+        head = AuditEntry.objects.exclude(entry_hash='').order_by('-sequence').values_list('sequence', 'entry_hash').first()
+        sequence, prev_hash = head or (0, GENESIS_HASH)
+        while True:
+            pending = list(AuditEntry.objects.filter(entry_hash='').order_by('id')[:batch_size])
+            if not pending:
+                break
+            for entry in pending:
+                sequence += 1
+                entry.sequence = sequence
+                entry.prev_hash = prev_hash
+                entry.entry_hash = prev_hash = entry_digest([getattr(entry, field) for field in FIELDS])
+            _write_seals(pending)
+            sealed += len(pending)
+    return sealed
+
+
+def _write_seals(entries):
+    # One prepared UPDATE run for the whole batch; bulk_update()'s CASE
+    # expressions and per-row querysets cost more than the hashing.
+    table = connection.ops.quote_name(AuditEntry._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET sequence = %s, prev_hash = %s, entry_hash = %s WHERE id = %s',
+            [(entry.sequence, entry.prev_hash, entry.entry_hash, entry.pk) for entry in entries],
+        )
+
+
+def verify(agreement_id=None, full=False):
+    # Re-hashes the chain after the latest checkpoint (from the start with
+    # `full`) and, given an agreement, every entry of that agreement and its
+    # served copy against the last digest logged. Returns
+    # {'checked', 'sequence', 'entry_hash', 'errors'}: the entries re-hashed,
+    # the head of the chain and a list of problems.
+    errors = []
+    checkpoint = None if full else AuditCheckpoint.objects.order_by('-sequence').first()
+    sequence, prev_hash = (checkpoint.sequence, checkpoint.entry_hash) if checkpoint else (0, GENESIS_HASH)
+    if checkpoint and not AuditEntry.objects.filter(sequence=checkpoint.sequence, entry_hash=checkpoint.entry_hash).exists():
+        errors.append(f'#{checkpoint.sequence}: does not match the checkpoint of {checkpoint.created_at:%Y-%m-%d %H:%M}')
+
+    checked = 0
+    rows = AuditEntry.objects.filter(sequence__gt=sequence).order_by('sequence').values_list(*FIELDS, 'entry_hash')
+    for row in rows.iterator(chunk_size=settings.SIGNATURE_AUDIT_SEAL_BATCH):
+        values, stored = row[:-1], row[-1]
+        if values[0] != sequence + 1:
+            errors.append(f'#{sequence + 1}-#{values[0] - 1}: missing')
+        if values[-1] != prev_hash:
+            errors.append(f'#{values[0]}: does not follow the entry before it')
+        if entry_digest(values) != stored:
+            errors.append(f'#{values[0]}: contents do not match its hash')
+        sequence, prev_hash = values[0], stored
+        checked += 1
+
+    if agreement_id is not None:
+        errors += verify_agreement(agreement_id)
+    return {'checked': checked, 'sequence': sequence, 'entry_hash': prev_hash, 'errors': errors}
+
+
+def verify_agreement(agreement_id):
+    errors = []
+    entries = list(AuditEntry.objects.filter(agreement_id=agreement_id).exclude(entry_hash='').order_by('sequence').values_list(*FIELDS, 'entry_hash'))
+    previous = dict(
+        AuditEntry.objects.filter(sequence__in=[values[0] - 1 for values in entries]).values_list('sequence', 'entry_hash')
+    )
+    previous[0] = GENESIS_HASH
+    for row in entries:
+        values, stored = row[:-1], row[-1]
+        if entry_digest(values) != stored:
+            errors.append(f'#{values[0]}: contents do not match its hash')
+        if previous.get(values[0] - 1) != values[-1]:
+            errors.append(f'#{values[0]}: does not follow the entry before it')
+
+    agreement = LoanAgreement.objects.filter(pk=agreement_id).first()
+    if agreement is not None and entries:
+        logged = entries[-1][FIELDS.index('document_after')]
+        current = current_sha256(agreement) if logged else None
+        if current is not None and current != logged:
+            errors.append(f'{agreement_id}: the signed copy does not match the digest logged in #{entries[-1][0]}')
+    return errors
+
+
+def add_checkpoint(result):
+    # Records a verify() result that found no problems.
+    latest = AuditCheckpoint.objects.order_by('-sequence').first()
+    if result['errors'] or not result['sequence'] or (latest and latest.sequence >= result['sequence']):
+        return None
+    return AuditCheckpoint.objects.create(sequence=result['sequence'], entry_hash=result['entry_hash'])
@@ -0,0 +1,140 @@
+# signature/batch.py
+#
+# Batch signing: a borrower with several agreements waiting for them draws
+# one signature and it is recorded on all of them. The drawing is decoded,
+# compacted and encoded once; each agreement then gets a BatchSigningItem
+# and is recorded on a pool of SIGNATURE_BATCH_WORKERS threads, with the
+# item's status tracking its progress for the status page. Compositing is
+# CPU-bound, so the threads hand it to a process pool of the same size, as
+# process_stamping_jobs does. Items left pending or running by a server
+# process that died are settled by settle_stale_items(), which
+# `manage.py process_stamping_jobs` runs on start alongside its stale-job
+# recovery (`--once` settles them and exits).
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings # type: ignore
+from django.db import close_old_connections # type: ignore
+from django.db.models import Exists, OuterRef # type: ignore
+from django.utils import timezone # type: ignore
+from . import audit, metrics
+from .images import encode_png
+from .jobs import submit_composite
+from .locks import agreement_lock
+from .models import BatchSigning, BatchSigningItem, BorrowerSignature, DEFAULT_BORROWER_NAME, LoanAgreement, StampingJob
+from .signing import prepare_signature, record_prepared_signature, signed_document_name, signed_document_path
+import datetime
+import multiprocessing
+import threading
+
+_executor = None
+_process_pool = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.SIGNATURE_BATCH_WORKERS, thread_name_prefix='batch-signing')
+        return _executor
+
+
+def process_context():
+    # Workers come from a fork server rather than being forked from the web
+    # server process, whose other threads may hold locks at fork time, or
+    # are spawned where there is no fork server (Windows).
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def get_process_pool():
+    global _process_pool
+    with _executor_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=settings.SIGNATURE_BATCH_WORKERS, mp_context=process_context())
+        return _process_pool
+
+
+def pending_borrowers(borrower, match=BatchSigning.MATCH_MOBILE_NUMBER):
+    # The borrower's rows, one per agreement, in agreements that have a
+    # document and no signature from them yet. Co-borrowers share a loan ID,
+    # so matching by loan ID also requires the same name.
+    rows = BorrowerSignature.objects.filter(borrower_name=DEFAULT_BORROWER_NAME).exclude(agreement__document='')
+    if match == BatchSigning.MATCH_LOAN_ID:
+        rows = rows.filter(loan_id=borrower.loan_id, name=borrower.name)
+    else:
+        rows = rows.filter(mobile_number=borrower.mobile_number)
+    signed = BorrowerSignature.objects.filter(agreement=OuterRef('agreement'), borrower_name=OuterRef('name'))
+    rows = rows.filter(~Exists(signed)).select_related('agreement').order_by('agreement__uploaded_at', 'agreement_id')
+    pending = {}
+    for row in rows:
+        pending.setdefault(row.agreement_id, row)
+    return list(pending.values())
+
+
+def set_status(item, status, error=''):
+    BatchSigningItem.objects.filter(pk=item.pk).update(status=status, error=error, updated_at=timezone.now())
+
+
+def sign_item(item, signature_image, signature_png, ip_address):
+    # Worker threads keep their own database connections, so they are
+    # recycled here the way Django does at request boundaries.
+    close_old_connections()
+    try:
+        set_status(item, StampingJob.RUNNING)
+        borrower = item.borrower
+        agreement = borrower.agreement
+        try:
+            record_prepared_signature(agreement, borrower, signature_image, signature_png, ip_address, composite=False)
+            if settings.SIGNATURE_STAMPING_MODE == 'deferred' and agreement.is_fully_signed():
+                composite_in_worker(agreement)
+        except Exception as e:
+            set_status(item, StampingJob.FAILED, f"{type(e).__name__}: {e}")
+            raise
+        set_status(item, StampingJob.DONE)
+        metrics.count('batch_agreements_signed')
+    finally:
+        close_old_connections()
+
+
+def composite_in_worker(agreement):
+    with metrics.span('composite'):
+        submit_composite(get_process_pool(), agreement.id).result()
+    with agreement_lock(agreement.id):
+        LoanAgreement.objects.filter(pk=agreement.id).update(signed_document=signed_document_name(agreement))
+        audit.record_signed_copy(agreement, signed_document_path(agreement))
+
+
+def start_batch(borrower, signature_data_url, ip_address, match=BatchSigning.MATCH_MOBILE_NUMBER):
+    # Records the drawing on every pending agreement of the borrower in the
+    # background. Returns the batch and a future per item; an invalid
+    # drawing raises SignatureImageError before anything is recorded.
+    signature_image = prepare_signature(signature_data_url)
+    signature_png = encode_png(signature_image)
+    batch = BatchSigning.objects.create(borrower=borrower, match=match, ip_address=ip_address)
+    items = BatchSigningItem.objects.bulk_create(
+        BatchSigningItem(batch=batch, borrower=row) for row in pending_borrowers(borrower, match)
+    )
+    executor = get_executor()
+    futures = [executor.submit(sign_item, item, signature_image, signature_png, ip_address) for item in items]
+    return batch, futures
+
+
+def settle_stale_items(older_than):
+    # Items not updated for `older_than` seconds that are still pending or
+    # running had their thread die with its process. The drawing went with
+    # it, so an item is done if its signature was recorded (a deferred
+    # composite is then built when the copy is first viewed) and failed
+    # otherwise, leaving the agreement pending for the borrower to sign
+    # again. Returns how many items were settled.
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than)
+    stale = BatchSigningItem.objects.filter(status__in=(StampingJob.PENDING, StampingJob.RUNNING), updated_at__lt=cutoff)
+    signed = BorrowerSignature.objects.filter(agreement=OuterRef('borrower__agreement'), borrower_name=OuterRef('borrower__name'))
+    done = stale.filter(Exists(signed)).update(status=StampingJob.DONE, error='', updated_at=timezone.now())
+    failed = stale.update(status=StampingJob.FAILED, error='Interrupted before the signature was recorded', updated_at=timezone.now())
+    return done + failed
+
+
+def batch_progress(batch):
+    items = list(batch.items.select_related('borrower__agreement').order_by('pk'))
+    finished = sum(item.status in (StampingJob.DONE, StampingJob.FAILED) for item in items)
+    return items, finished == len(items)
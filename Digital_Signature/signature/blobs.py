@@ -0,0 +1,125 @@
+# signature/blobs.py
+#
+# Uploaded agreements are stored once per SHA-256 under blobs/ and shared by
+# every LoanAgreement whose document has those exact bytes. An agreement
+# gets its own copy only when something is about to write into its document
+# (copy-on-write); deferred compositing writes to signed_document instead,
+# so most agreements never diverge from their blob.
+from django.core.files.storage import default_storage # type: ignore
+from django.db.models import F # type: ignore
+from .locks import file_lock
+from .models import DocumentBlob
+import hashlib
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256}.pdf'
+
+
+def blob_lock(sha256):
+    return file_lock(default_storage.path(os.path.join('locks', f'blob-{sha256}.lock')))
+
+
+def hash_file(f):
+    digest = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def _write_blob(path, chunks):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _acquire(sha256, size, write, references):
+    name = blob_name(sha256)
+    with blob_lock(sha256):
+        if not default_storage.exists(name):
+            write(default_storage.path(name))
+        blob, _ = DocumentBlob.objects.get_or_create(sha256=sha256, defaults={'file': name, 'size': size})
+        add_blob_references(sha256, references)
+    blob.refresh_from_db()
+    return blob
+
+
+def acquire_blob(uploaded_file, references=1):
+    # Returns the blob for the file's bytes, writing it only if no agreement
+    # has uploaded them before, and takes `references` references on it.
+    sha256 = getattr(uploaded_file, 'sha256', None) or hash_file(uploaded_file)
+
+    def write(path):
+        uploaded_file.seek(0)
+        _write_blob(path, uploaded_file.chunks())
+    return _acquire(sha256, uploaded_file.size, write, references)
+
+
+def acquire_blob_file(path, sha256, references=1):
+    # acquire_blob() for a complete file under MEDIA_ROOT whose hash is
+    # already known: it is moved into the store rather than copied, or
+    # removed if the store has its bytes already.
+    def write(blob_path):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(path, blob_path)
+    blob = _acquire(sha256, os.path.getsize(path), write, references)
+    if os.path.exists(path):
+        os.unlink(path)
+    return blob
+
+
+def add_blob_references(sha256, count):
+    DocumentBlob.objects.filter(pk=sha256).update(ref_count=F('ref_count') + count)
+
+
+def release_blob(sha256, count=1):
+    with blob_lock(sha256):
+        DocumentBlob.objects.filter(pk=sha256).update(ref_count=F('ref_count') - count)
+        blob = DocumentBlob.objects.filter(pk=sha256, ref_count__lte=0).first()
+        if blob is not None:
+            blob.file.delete(save=False)
+            blob.delete()
+
+
+def attach_document(agreement, uploaded_file):
+    return attach_blob(agreement, acquire_blob(uploaded_file))
+
+
+def attach_blob(agreement, blob):
+    previous = agreement.blob_id
+    agreement.blob = blob
+    agreement.document.name = blob.file.name
+    agreement.save(update_fields=['blob', 'document'])
+    if previous:
+        release_blob(previous)
+    return blob
+
+
+def ensure_private_document(agreement):
+    # Copy-on-write: gives the agreement its own copy of a shared blob before
+    # its document is modified in place.
+    if not agreement.blob_id or agreement.document.name != agreement.blob.file.name:
+        return agreement.document
+    name = f'documents/{agreement.id}.pdf'
+    with agreement.blob.file.open('rb') as source:
+        _write_blob(default_storage.path(name), iter(lambda: source.read(CHUNK_SIZE), b''))
+    previous = agreement.blob_id
+    agreement.blob = None
+    agreement.document.name = name
+    agreement.save(update_fields=['blob', 'document'])
+    release_blob(previous)
+    return agreement.document
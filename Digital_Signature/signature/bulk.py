@@ -0,0 +1,183 @@
+# signature/bulk.py
+#
+# Streams borrower rows from CSV or JSON and creates agreements in batches.
+# Each row has loan_id, name and mobile_number, plus an optional `agreement`
+# key grouping co-borrowers (defaults to loan_id). Rows of one agreement
+# must be contiguous; memory is bounded by the batch size. A file that
+# cannot be read any further (malformed JSON, text that is not UTF-8) stops
+# the import with a file-level error. Agreements read before it are kept;
+# the one being read may be missing borrowers and is dropped.
+from django.conf import settings # type: ignore
+from django.db import transaction # type: ignore
+from PyPDF2.errors import PdfReadError
+from .blobs import acquire_blob, add_blob_references, release_blob
+from .forms import BorrowerDetailForm
+from .models import BorrowerSignature, LoanAgreement
+from .pages import inspect_document
+import csv
+import io
+import json
+
+CHUNK_SIZE = 64 * 1024
+# Longest JSON record read before giving up on the file, in characters.
+MAX_RECORD_CHARS = 1024 * 1024
+MAX_REPORTED_ERRORS = 100
+NOT_AN_OBJECT = {'record': [{'message': 'Expected an object with loan_id, name and mobile_number.', 'code': 'invalid'}]}
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.agreements = 0
+        self.borrowers = 0
+        self.error_count = 0
+        self.errors = []
+        # Why the file could not be read to the end, if it could not.
+        self.file_error = ''
+
+    def add_error(self, record, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((record, errors))
+
+
+def iter_csv(text):
+    yield from csv.DictReader(text)
+
+
+def iter_json(text):
+    # Accepts a top-level array or whitespace-separated objects (JSON Lines)
+    # without loading the whole document.
+    decoder = json.JSONDecoder()
+    buffer = text.read(CHUNK_SIZE)
+    pos = 0
+    in_array = buffer.lstrip().startswith('[')
+    if in_array:
+        pos = buffer.index('[') + 1
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buffer):
+            more = text.read(CHUNK_SIZE)
+            if not more:
+                return
+            buffer, pos = more, 0
+            continue
+        if in_array and buffer[pos] == ']':
+            return
+        try:
+            row, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if len(buffer) - pos > MAX_RECORD_CHARS:
+                raise BulkImportError(f'A record is longer than {MAX_RECORD_CHARS} characters or is not valid JSON.')
+            more = text.read(CHUNK_SIZE)
+            if not more:
+                raise BulkImportError(f'Invalid JSON: {e.msg}.')
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield row
+        pos = end
+
+
+def iter_rows(f, fmt='auto', name=''):
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    if fmt == 'auto':
+        fmt = 'json' if name.lower().endswith(('.json', '.jsonl')) else 'csv'
+    return iter_csv(text) if fmt == 'csv' else iter_json(text)
+
+
+def iter_groups(rows):
+    group_key, group = None, []
+    for record, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            # Rejected on its own, without taking a group down with it.
+            if group:
+                yield group
+            yield [(record, row)]
+            group_key, group = None, []
+            continue
+        key = str(row.get('agreement') or row.get('loan_id') or '')
+        if group and key != group_key:
+            yield group
+            group = []
+        group_key = key
+        group.append((record, row))
+    if group:
+        yield group
+
+
+def _flush(batch, document, blob, page_index, result):
+    # Returns the shared blob. It is acquired with the first batch, so an
+    # import that creates no agreement stores nothing.
+    agreements = [LoanAgreement(borrower=borrowers[0].name, page_index=page_index) for borrowers in batch]
+    acquired = 0
+    if document is not None and blob is None:
+        blob = acquire_blob(document, references=len(agreements))
+        acquired = len(agreements)
+    if blob is not None:
+        for agreement in agreements:
+            agreement.blob = blob
+            agreement.document.name = blob.file.name
+    borrowers = []
+    for agreement, group in zip(agreements, batch):
+        for borrower in group:
+            borrower.agreement = agreement
+            borrowers.append(borrower)
+    try:
+        with transaction.atomic():
+            LoanAgreement.objects.bulk_create(agreements)
+            BorrowerSignature.objects.bulk_create(borrowers)
+            if blob is not None and not acquired:
+                add_blob_references(blob.sha256, len(agreements))
+    except BaseException:
+        if acquired:
+            release_blob(blob.sha256, acquired)
+        raise
+    result.agreements += len(agreements)
+    result.borrowers += len(borrowers)
+    return blob
+
+
+def import_agreements(rows, document=None, batch_size=500):
+    result = ImportResult()
+    page_index = None
+    if document is not None:
+        # Every imported agreement shares the document, so it is indexed once.
+        try:
+            page_index, _ = inspect_document(document, anchor=settings.SIGNATURE_ANCHOR_TEXT, max_pages=settings.SIGNATURE_MAX_UPLOAD_PAGES)
+        except (ValueError, PdfReadError) as e:
+            result.file_error = f'The agreement document cannot be used: {e}'
+            return result
+        document.seek(0)
+    blob = None
+    batch, batch_rows = [], 0
+    record = 0
+    try:
+        for group in iter_groups(rows):
+            borrowers = []
+            for record, row in group:
+                if not isinstance(row, dict):
+                    result.add_error(record, NOT_AN_OBJECT)
+                    continue
+                form = BorrowerDetailForm(data={field: row.get(field) for field in BorrowerDetailForm.base_fields})
+                if form.is_valid():
+                    borrowers.append(BorrowerSignature(**form.cleaned_data))
+                else:
+                    result.add_error(record, form.errors.get_json_data())
+            # An agreement with any invalid borrower is skipped as a whole.
+            if len(borrowers) != len(group):
+                continue
+            batch.append(borrowers)
+            batch_rows += len(borrowers)
+            if batch_rows >= batch_size:
+                blob = _flush(batch, document, blob, page_index, result)
+                batch, batch_rows = [], 0
+    except (BulkImportError, UnicodeDecodeError, csv.Error) as e:
+        reason = 'The file is not UTF-8 text.' if isinstance(e, UnicodeDecodeError) else str(e)
+        result.file_error = f"Stopped {f'after record {record}' if record else 'before the first record'}: {reason}"
+    if batch:
+        _flush(batch, document, blob, page_index, result)
+    return result
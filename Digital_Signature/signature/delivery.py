@@ -0,0 +1,187 @@
+# signature/delivery.py
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse # type: ignore
+from django.utils.cache import get_conditional_response # type: ignore
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag # type: ignore
+import asyncio
+import functools
+import hashlib
+import os
+import re
+import threading
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+# Kept for finished agreements, which never change again.
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def file_fingerprint(path, stat=None):
+    # SHA-256 of the file, cached per (path, size, mtime) so each version of
+    # a document is hashed once per process.
+    stat = stat or os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _fingerprints_lock:
+        fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        fingerprint = digest.hexdigest()
+        with _fingerprints_lock:
+            for stale in [k for k in _fingerprints if k[0] == path]:
+                del _fingerprints[stale]
+            _fingerprints[key] = fingerprint
+    return fingerprint
+
+
+def parse_range(header, size):
+    # Returns (start, end) inclusive for a single satisfiable byte range,
+    # None to serve the whole file, or False if the range is unsatisfiable.
+    # Multi-range requests are answered with the whole file.
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_file(open_file, start, length):
+    with open_file() as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _read_range(path, start, length):
+    return _read_file(functools.partial(open, path, 'rb'), start, length)
+
+
+async def _aread_file(open_file, start, length):
+    # _read_file for async views: every read runs in a thread, so the event
+    # loop never blocks on the disk or the storage backend.
+    f = await asyncio.to_thread(open_file)
+    try:
+        await asyncio.to_thread(f.seek, start)
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def _aread_range(path, start, length):
+    return _aread_file(functools.partial(open, path, 'rb'), start, length)
+
+
+def serve_file(request, path, content_type, immutable=False, stream=None):
+    # stream(path, start, length) yields the bytes to send; by default the
+    # whole file goes out as a FileResponse and ranges through _read_range.
+    stat = os.stat(path)
+    whole = functools.partial(open, path, 'rb') if stream is None else None
+    stream = functools.partial(stream or _read_range, path)
+    return _serve(request, stat.st_size, file_fingerprint(path, stat), int(stat.st_mtime), os.path.basename(path),
+                  content_type, immutable, stream, whole)
+
+
+def serve_stored_file(request, storage, name, content_type, fingerprint, last_modified, immutable=False, stream=None):
+    # serve_file for a file held by a Django storage backend, which need not
+    # be on local disk. Its fingerprint and modification time are supplied
+    # by the caller instead of read from the file.
+    # stream(storage, name, start, length) defaults to reading ranges
+    # through storage.open().
+    stream = functools.partial(stream or _read_stored_range, storage, name)
+    return _serve(request, storage.size(name), fingerprint, int(last_modified), os.path.basename(name),
+                  content_type, immutable, stream)
+
+
+def _read_stored_range(storage, name, start, length):
+    return _read_file(functools.partial(storage.open, name, 'rb'), start, length)
+
+
+def _aread_stored_range(storage, name, start, length):
+    return _aread_file(functools.partial(storage.open, name, 'rb'), start, length)
+
+
+def _serve(request, size, fingerprint, last_modified, filename, content_type, immutable, stream, whole=None):
+    # stream(start, length) yields a byte range; whole() opens the entire
+    # file for a FileResponse, or is None to stream it instead.
+    etag = quote_etag(fingerprint)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response.headers.setdefault(header, value)
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and _if_range_passes(request.headers.get('If-Range'), etag, last_modified):
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416, headers=headers)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None and whole is not None:
+        response = FileResponse(whole(), content_type=content_type, headers=headers)
+        return response
+    if byte_range is None:
+        response = StreamingHttpResponse(stream(0, size), content_type=content_type, headers=headers)
+        response.headers['Content-Length'] = str(size)
+        response.headers['Content-Disposition'] = content_disposition_header(False, filename)
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(stream(start, length), status=206, content_type=content_type, headers=headers)
+    response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.headers['Content-Length'] = str(length)
+    return response
+
+
+def _if_range_passes(if_range, etag, last_modified):
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and last_modified <= since
+
+
+async def aserve_file(request, path, content_type, immutable=False):
+    # serve_file for async views. Stat, fingerprint and headers are worked
+    # out in a thread; the body is streamed by _aread_range.
+    return await asyncio.to_thread(serve_file, request, path, content_type, immutable, _aread_range)
+
+
+async def aserve_stored_file(request, storage, name, content_type, fingerprint, last_modified, immutable=False):
+    return await asyncio.to_thread(
+        serve_stored_file, request, storage, name, content_type, fingerprint, last_modified, immutable, _aread_stored_range,
+    )
@@ -0,0 +1,37 @@
+# signature/engines/__init__.py
+#
+# The PDF library that stamps agreements, chosen by name with
+# SIGNATURE_PDF_ENGINE. 'pypdf2' is the reference implementation; 'pikepdf'
+# parses and writes with qpdf and needs the optional pikepdf package. Every
+# engine places the same shared form XObjects with the same matrices, so
+# their output looks the same (see EngineConformanceTests).
+from importlib import import_module
+
+DEFAULT_ENGINE = 'pypdf2'
+ENGINES = {
+    'pypdf2': ('.pypdf2', 'PyPDF2Engine'),
+    'pikepdf': ('.pikepdf', 'PikepdfEngine'),
+}
+
+_engines = {}
+
+
+def get_engine(name=DEFAULT_ENGINE):
+    if name not in _engines:
+        if name not in ENGINES:
+            raise ValueError(f"Unknown PDF engine: {name!r}")
+        module_name, class_name = ENGINES[name]
+        _engines[name] = getattr(import_module(module_name, __name__), class_name)()
+    return _engines[name]
+
+
+def available_engines():
+    # Names of the engines whose libraries are installed.
+    names = []
+    for name in ENGINES:
+        try:
+            get_engine(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,35 @@
+# signature/engines/base.py
+
+
+class Document:
+    # A PDF opened by an engine. stamp() places stamps on its pages in
+    # memory; save() then writes the whole document to a file object, or
+    # save_incremental() appends only what changed to the file it was opened
+    # from and returns the number of bytes appended.
+    def stamp(self, stamps, page_indexes=None, page_index=None):
+        raise NotImplementedError
+
+    def save(self, f):
+        raise NotImplementedError
+
+    def save_incremental(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Engine:
+    name = None
+
+    def open(self, pdf_path, incremental=False):
+        # incremental says which of save() and save_incremental() the
+        # document will be saved with, for engines that prepare them
+        # differently.
+        raise NotImplementedError
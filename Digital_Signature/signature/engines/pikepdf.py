@@ -0,0 +1,205 @@
+# signature/engines/pikepdf.py
+#
+# Engine backed by pikepdf (qpdf), which parses and writes in C++. Stamps
+# go on as the same shared form XObjects the reference engine uses, placed
+# by signature/placement.py. qpdf cannot write incremental updates itself,
+# so save_incremental() serializes the new and changed objects and appends
+# them with signature/incremental.py's cross-reference writer. The stamper
+# records the objects it creates, so an update never walks the rest of the
+# document.
+from pikepdf import Array, Dictionary, Name, Stream
+import pikepdf
+import io
+import zlib
+
+from .. import metrics
+from ..incremental import append_update, previous_xref, write_xref
+from ..placement import TEXT_DEPTH, format_matrix, slot_origin, stamp_matrix
+from .base import Document, Engine
+
+LETTER = [0, 0, 612, 792]
+
+
+def inherited(page, key):
+    # Page attributes a page may inherit from its /Pages ancestors.
+    node = page
+    while node is not None:
+        if key in node:
+            return node[key]
+        node = node.get('/Parent')
+    return None
+
+
+def page_entry(page):
+    box = inherited(page.obj, '/MediaBox')
+    rotation = inherited(page.obj, '/Rotate')
+    return {
+        'mediabox': [float(value) for value in (box if box is not None else LETTER)],
+        'rotation': int(rotation or 0) % 360,
+        'anchors': [],
+    }
+
+
+def content_objects(page):
+    contents = page.obj.get('/Contents')
+    if contents is None:
+        return []
+    if isinstance(contents, Array):
+        return list(contents)
+    return [contents]
+
+
+class PikepdfStamper:
+    # pikepdf counterpart of xobjects.PageStamper.
+    def __init__(self, pdf, stamps):
+        self.pdf = pdf
+        self.stamps = stamps
+        self._forms = {}
+        self._draws = {}
+        self._push = None
+        # Every stream created here; whatever else is new hangs off them.
+        self.created = []
+
+    def _form(self, index):
+        if index not in self._forms:
+            stamp = self.stamps[index]
+            with pikepdf.open(io.BytesIO(stamp.overlay_pdf)) as overlay:
+                page = overlay.pages[0]
+                content = b''.join(stream.read_bytes() for stream in content_objects(page))
+                resources = self.pdf.copy_foreign(overlay.make_indirect(page.obj.Resources))
+            self._forms[index] = self._new(Stream(
+                self.pdf, zlib.compress(content),
+                Type=Name.XObject, Subtype=Name.Form, Filter=Name.FlateDecode,
+                BBox=Array([0, 0, stamp.width, stamp.height]), Resources=resources,
+            ))
+        return self._forms[index]
+
+    def _new(self, stream):
+        self.created.append(stream)
+        return stream
+
+    def _draw(self, placements):
+        if placements not in self._draws:
+            operators = ['Q\n']
+            for name, matrix in placements:
+                operators.append(f'q {format_matrix(matrix)} cm {name} Do Q\n')
+            self._draws[placements] = self._new(Stream(self.pdf, ''.join(operators).encode('ascii')))
+        return self._draws[placements]
+
+    def _push_stream(self):
+        if self._push is None:
+            self._push = self._new(Stream(self.pdf, b'q\n'))
+        return self._push
+
+    def stamp(self, page, entry=None):
+        if entry is None:
+            entry = page_entry(page)
+        resources = inherited(page.obj, '/Resources')
+        resources = Dictionary(resources) if resources is not None else Dictionary()
+        xobjects = Dictionary(resources.XObject) if '/XObject' in resources else Dictionary()
+
+        placements = []
+        suffix = 0
+        for index, stamp in enumerate(self.stamps):
+            while f'/DSStamp{suffix}' in xobjects:
+                suffix += 1
+            name = f'/DSStamp{suffix}'
+            xobjects[name] = self._form(index)
+            origin_x, origin_y = slot_origin(entry)
+            placements.append((name, stamp_matrix(entry, origin_x + stamp.x_position, origin_y + stamp.y_position - TEXT_DEPTH)))
+        resources.XObject = xobjects
+
+        page.obj.Resources = resources
+        page.obj.Contents = Array([self._push_stream()] + content_objects(page) + [self._draw(tuple(placements))])
+        metrics.count('pages_stamped')
+
+
+def indirect_objects(roots):
+    # The indirect objects reachable from roots, roots included, each once.
+    found = {}
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if not isinstance(obj, pikepdf.Object):
+            # Numbers and booleans come back as Python values.
+            continue
+        if obj.is_indirect:
+            if obj.objgen in found:
+                continue
+            found[obj.objgen] = obj
+        if isinstance(obj, Stream):
+            stack.extend(obj.stream_dict.values())
+        elif isinstance(obj, Dictionary):
+            stack.extend(obj.values())
+        elif isinstance(obj, Array):
+            stack.extend(obj)
+    return list(found.values())
+
+
+def serialize(obj):
+    if isinstance(obj, Stream):
+        data = obj.read_raw_bytes()
+        obj.stream_dict.Length = len(data)
+        return obj.stream_dict.unparse() + b'\nstream\n' + data + b'\nendstream'
+    return obj.unparse(resolved=True)
+
+
+class PikepdfDocument(Document):
+    def __init__(self, pdf_path, incremental):
+        self.pdf_path = pdf_path
+        if incremental:
+            self.prev_startxref, self.xref_stream = previous_xref(pdf_path)
+        self.pdf = pikepdf.open(pdf_path)
+        if incremental and self.pdf.is_encrypted:
+            self.pdf.close()
+            raise ValueError('incremental stamping of encrypted documents is not supported')
+        self._changed = []
+        self._created = []
+
+    def stamp(self, stamps, page_indexes=None, page_index=None):
+        stamper = PikepdfStamper(self.pdf, stamps)
+        pages = self.pdf.pages
+        if page_indexes is None:
+            page_indexes = range(len(pages))
+        for index in page_indexes:
+            page = pages[index]
+            stamper.stamp(page, page_index[index] if page_index else None)
+            self._changed.append(page.obj)
+        self._created += stamper.created
+
+    def save(self, f):
+        self.pdf.save(f)
+
+    def save_incremental(self):
+        if not self._changed:
+            return 0
+        # The stamps' streams and what they reference (the images and fonts
+        # copied from the overlays) are the only new objects. qpdf keeps the
+        # file's object numbers, gaps and all, and numbers new objects past
+        # both the highest of them and the trailer's /Size.
+        new = indirect_objects(self._created)
+        size = max([int(self.pdf.trailer.get('/Size', 0))] + [obj.objgen[0] + 1 for obj in new])
+        objects = self._changed + new
+        trailer = {key: self.pdf.trailer[key].unparse() for key in ('/Root', '/Info', '/ID') if key in self.pdf.trailer}
+
+        def write(f):
+            f.write(b'\n')
+            offsets = {}
+            for obj in objects:
+                number, generation = obj.objgen
+                offsets[number] = (f.tell(), generation)
+                f.write(b'%d %d obj\n' % (number, generation))
+                f.write(serialize(obj))
+                f.write(b'\nendobj\n')
+            write_xref(f, offsets, trailer, size, self.prev_startxref, self.xref_stream)
+        return append_update(self.pdf_path, write)
+
+    def close(self):
+        self.pdf.close()
+
+
+class PikepdfEngine(Engine):
+    name = 'pikepdf'
+
+    def open(self, pdf_path, incremental=False):
+        return PikepdfDocument(pdf_path, incremental)
@@ -0,0 +1,54 @@
+# signature/engines/pypdf2.py
+#
+# The reference engine: pure-Python parsing and writing with PyPDF2.
+# Incremental updates are built by signature/incremental.py.
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import NameObject
+from ..incremental import prepare_update, write_update
+from ..xobjects import PageStamper
+from .base import Document, Engine
+
+
+def stamped_writer(pdf_path, stamps, page_indexes=None, page_index=None):
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    stamper = PageStamper(stamps, writer._add_object, lambda obj: obj.clone(writer))
+    selected = set(range(len(reader.pages)) if page_indexes is None else page_indexes)
+    for index, page in enumerate(reader.pages):
+        # Unselected pages are copied with their content streams untouched.
+        page = writer.add_page(page)
+        if index in selected:
+            entry = page_index[index] if page_index else None
+            page[NameObject('/Resources')], page[NameObject('/Contents')] = stamper.stamp(page, entry)
+    return writer
+
+
+class PyPDF2Document(Document):
+    def __init__(self, pdf_path, incremental):
+        self.pdf_path = pdf_path
+        self.incremental = incremental
+        self._update = None
+        self._writer = None
+
+    def stamp(self, stamps, page_indexes=None, page_index=None):
+        if self.incremental:
+            self._update = prepare_update(self.pdf_path, stamps, page_indexes, page_index)
+        else:
+            self._writer = stamped_writer(self.pdf_path, stamps, page_indexes, page_index)
+
+    def save(self, f):
+        if self._writer is None:
+            self._writer = stamped_writer(self.pdf_path, [], page_indexes=[])
+        self._writer.write(f)
+
+    def save_incremental(self):
+        if self._update is None:
+            return 0
+        return write_update(self.pdf_path, self._update)
+
+
+class PyPDF2Engine(Engine):
+    name = 'pypdf2'
+
+    def open(self, pdf_path, incremental=False):
+        return PyPDF2Document(pdf_path, incremental)
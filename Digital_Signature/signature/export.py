@@ -0,0 +1,48 @@
+# signature/export.py
+from django.urls import reverse # type: ignore
+from .models import BorrowerSignature, DEFAULT_BORROWER_NAME
+import csv
+import json
+import uuid
+
+EXPORT_FIELDS = ['agreement', 'borrower', 'loan_id', 'mobile_number', 'link']
+ITERATOR_CHUNK_SIZE = 2000
+
+# Placeholder ids used to reverse the signing URL once per export; each row
+# then only substitutes its own ids into the template.
+_AGREEMENT_PLACEHOLDER = uuid.UUID(int=1)
+_BORROWER_PLACEHOLDER = uuid.UUID(int=2)
+
+
+def iter_signing_links(request, agreement_ids=()):
+    template = request.build_absolute_uri(reverse('view_original_document', args=[_AGREEMENT_PLACEHOLDER, _BORROWER_PLACEHOLDER]))
+    borrowers = BorrowerSignature.objects.filter(borrower_name=DEFAULT_BORROWER_NAME)
+    if agreement_ids:
+        borrowers = borrowers.filter(agreement_id__in=agreement_ids)
+    rows = borrowers.order_by('agreement_id', 'id').values_list('agreement_id', 'id', 'name', 'loan_id', 'mobile_number')
+    for agreement_id, borrower_id, name, loan_id, mobile_number in rows.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        link = template.replace(str(_AGREEMENT_PLACEHOLDER), str(agreement_id)).replace(str(_BORROWER_PLACEHOLDER), str(borrower_id))
+        yield str(agreement_id), name, loan_id, mobile_number, link
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': stream_csv,
+    'jsonl': stream_jsonl,
+}
@@ -1,7 +1,11 @@
 # signature/forms.py
 
 from django import forms # type: ignore
-from .models import LoanAgreement
+from django.conf import settings # type: ignore
+from .models import LoanAgreement, UploadSession
+from .pages import STAMP_ALL, STAMP_ANCHOR, STAMP_PAGE_LIST, parse_page_list
+from .uploads import UploadError, check_pdf_file
+import re
 from django.forms import formset_factory # type: ignore
 
 class NumberOfBorrowersForm(forms.Form):
@@ -14,10 +18,76 @@ class BorrowerDetailForm(forms.Form):
     
 BorrowerDetailFormSet = formset_factory(BorrowerDetailForm, extra=1)
     
-class LoanAgreementForm(forms.ModelForm):
+class StampPagesFormMixin:
+    # Page-selection fields shared by the upload forms.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['stamp_pages'].required = False
+
+    def clean(self):
+        cleaned_data = super().clean()
+        policy = cleaned_data['stamp_pages'] = cleaned_data.get('stamp_pages') or STAMP_ALL
+        value = cleaned_data.get('stamp_pages_value', '')
+        if policy in (STAMP_PAGE_LIST, STAMP_ANCHOR) and not value.strip():
+            self.add_error('stamp_pages_value', 'This policy needs a page list or phrase.')
+        elif policy == STAMP_PAGE_LIST:
+            try:
+                # The page count is not known yet; the upload limit bounds it.
+                parse_page_list(value, settings.SIGNATURE_MAX_UPLOAD_PAGES)
+            except ValueError as e:
+                self.add_error('stamp_pages_value', str(e))
+        return cleaned_data
+
+
+def clean_pdf_document(document):
+    # Size and header/trailer checks for an uploaded agreement document.
+    if document.size > settings.SIGNATURE_MAX_UPLOAD_BYTES:
+        raise forms.ValidationError(f'The document is larger than {settings.SIGNATURE_MAX_UPLOAD_BYTES} bytes.')
+    try:
+        check_pdf_file(document)
+    except UploadError as e:
+        raise forms.ValidationError(str(e))
+    return document
+
+
+class LoanAgreementForm(StampPagesFormMixin, forms.ModelForm):
     class Meta:
         model = LoanAgreement
-        fields = ['document']
+        fields = ['document', 'stamp_pages', 'stamp_pages_value']
+        labels = {'stamp_pages': 'Stamp signatures on', 'stamp_pages_value': 'Pages or anchor phrase'}
+        help_texts = {'stamp_pages_value': 'For listed pages, e.g. "1, 3, 5-7"; for anchors, a phrase such as "Borrower Signature".'}
+
+    def clean_document(self):
+        return clean_pdf_document(self.cleaned_data['document'])
+
+
+class UploadSessionForm(StampPagesFormMixin, forms.ModelForm):
+    # Opens a chunked upload; see signature/uploads.py.
+    class Meta:
+        model = UploadSession
+        fields = ['size', 'sha256', 'stamp_pages', 'stamp_pages_value']
+
+    def clean_size(self):
+        size = self.cleaned_data['size']
+        if size < 1 or size > settings.SIGNATURE_MAX_UPLOAD_BYTES:
+            raise forms.ValidationError(f'Uploads must be between 1 and {settings.SIGNATURE_MAX_UPLOAD_BYTES} bytes.')
+        return size
+
+    def clean_sha256(self):
+        sha256 = self.cleaned_data['sha256'].lower()
+        if sha256 and not re.fullmatch(r'[0-9a-f]{64}', sha256):
+            raise forms.ValidationError('Expected a hex SHA-256 digest.')
+        return sha256
+
+class BulkImportForm(forms.Form):
+    FORMAT_CHOICES = [('auto', 'Detect from file name'), ('csv', 'CSV'), ('json', 'JSON / JSON Lines')]
+    file = forms.FileField(label='Borrowers file')
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, initial='auto')
+    document = forms.FileField(label='Agreement document', required=False)
+
+    def clean_document(self):
+        document = self.cleaned_data['document']
+        return clean_pdf_document(document) if document else document
 
 # class SignatureForm(forms.Form):
 #     lender = forms.CharField(max_length=100)
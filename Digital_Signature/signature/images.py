@@ -0,0 +1,79 @@
+# signature/images.py
+#
+# Turns the signature pad's canvas export into the compact image that is
+# stored and stamped: cropped to the ink, greyscale ink with an alpha channel
+# instead of an opaque white background, and no larger than the stamp is
+# printed.
+from PIL import Image
+import base64
+import io
+
+SIGNATURE_DPI = 150
+# Canvas pixels at least this light are background.
+BACKGROUND_LEVEL = 240
+ALPHA_TABLE = [0 if level >= BACKGROUND_LEVEL else 255 - level for level in range(256)]
+# Four coverage levels keep an anti-aliased edge and compress several times
+# better than the full 256.
+COVERAGE_TABLE = [round(level / 85) * 85 for level in range(256)]
+
+
+class SignatureImageError(ValueError):
+    pass
+
+
+def read_data_url(signature_data_url, max_bytes):
+    header, separator, payload = signature_data_url.partition(',')
+    if not separator or not header.startswith('data:image/') or not header.endswith(';base64'):
+        raise SignatureImageError('signature is not a base64 image data URL')
+    # Four base64 characters carry three bytes, so the decoded size is known
+    # before decoding anything.
+    if len(payload) // 4 * 3 > max_bytes:
+        raise SignatureImageError('signature image is too large')
+    try:
+        return base64.b64decode(payload, validate=True)
+    except ValueError:
+        # binascii.Error, or a payload that is not ASCII at all.
+        raise SignatureImageError('signature is not valid base64')
+
+
+def open_image(data, max_pixels):
+    # Image.open only parses the header, so the dimensions are checked before
+    # any pixel data is decompressed.
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if width * height > max_pixels:
+            raise SignatureImageError('signature image has too many pixels')
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        raise SignatureImageError('signature is not a readable image')
+    return image
+
+
+def print_size(width, height, dpi=SIGNATURE_DPI):
+    return round(width * dpi / 72), round(height * dpi / 72)
+
+
+def compact_signature(image, width, height, dpi=SIGNATURE_DPI):
+    # width and height are the printed size of the stamp in points.
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        background = Image.new('RGBA', image.size, 'white')
+        background.alpha_composite(image.convert('RGBA'))
+        image = background
+    alpha = image.convert('L').point(ALPHA_TABLE)
+    bbox = alpha.getbbox()
+    if bbox is None:
+        raise SignatureImageError('signature is empty')
+    alpha = alpha.crop(bbox)
+    alpha.thumbnail(print_size(width, height, dpi), Image.LANCZOS)
+    alpha = alpha.point(COVERAGE_TABLE)
+    # Black ink whose coverage is carried by the alpha channel.
+    compact = Image.new('LA', alpha.size, 0)
+    compact.putalpha(alpha)
+    return compact
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
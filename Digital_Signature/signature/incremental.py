@@ -0,0 +1,193 @@
+# signature/incremental.py
+#
+# Appends signer stamps to an existing PDF as an incremental update
+# (ISO 32000-1, 7.5.6): the original bytes are left untouched and only the
+# new stamp objects, the changed page dictionaries and a new cross-reference
+# section are written after the last %%EOF. IncrementalUpdate and
+# prepare_update() are the PyPDF2 engine's; the file and cross-reference
+# handling is shared with the other engines (see signature/engines/).
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+from .xobjects import PageStamper
+import io
+import os
+import re
+import struct
+
+STARTXREF_RE = re.compile(rb'startxref\s+(\d+)\s*%%EOF', re.S)
+
+
+def find_startxref(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - 2048))
+    matches = STARTXREF_RE.findall(f.read())
+    if not matches:
+        raise ValueError('startxref not found')
+    return int(matches[-1])
+
+
+class IncrementalUpdate:
+    def __init__(self, reader):
+        self.reader = reader
+        self.next_number = self._document_size(reader)
+        self.objects = {}
+        self._imported = {}
+
+    @staticmethod
+    def _document_size(reader):
+        # PyPDF2 does not copy /Size out of cross-reference streams, so fall
+        # back to the highest object number it has seen.
+        numbers = [n for table in reader.xref.values() for n in table]
+        numbers.extend(reader.xref_objStm)
+        return max([int(reader.trailer.get('/Size', 0))] + [n + 1 for n in numbers])
+
+    def add(self, obj):
+        ref = IndirectObject(self.next_number, 0, self.reader)
+        self.objects[self.next_number] = (0, obj)
+        self.next_number += 1
+        return ref
+
+    def replace(self, ref, obj):
+        self.objects[ref.idnum] = (ref.generation, obj)
+
+    def import_object(self, obj):
+        # Deep-copies an object graph from another document (e.g. a reportlab
+        # overlay), renumbering its indirect objects into this update.
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum, obj.generation)
+            if key not in self._imported:
+                self._imported[key] = ref = IndirectObject(self.next_number, 0, self.reader)
+                self.next_number += 1
+                self.objects[ref.idnum] = (0, self.import_object(obj.get_object()))
+            return self._imported[key]
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            for key, value in obj.items():
+                copy[NameObject(key)] = self.import_object(value)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({NameObject(k): self.import_object(v) for k, v in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.import_object(v) for v in obj)
+        return obj
+
+    def write(self, f, prev_startxref, xref_stream=False):
+        f.seek(0, os.SEEK_END)
+        f.write(b'\n')
+        offsets = {}
+        for number in sorted(self.objects):
+            generation, obj = self.objects[number]
+            offsets[number] = (f.tell(), generation)
+            f.write(b'%d %d obj\n' % (number, generation))
+            obj.write_to_stream(f, None)
+            f.write(b'\nendobj\n')
+
+        trailer = {}
+        for key in ('/Root', '/Info', '/ID'):
+            if key in self.reader.trailer:
+                value = io.BytesIO()
+                self.reader.trailer.raw_get(key).write_to_stream(value, None)
+                trailer[key] = value.getvalue()
+        write_xref(f, offsets, trailer, self.next_number, prev_startxref, xref_stream)
+
+
+def _subsections(offsets):
+    numbers = sorted(offsets)
+    start = previous = numbers[0]
+    for n in numbers[1:]:
+        if n != previous + 1:
+            yield start, previous - start + 1
+            start = n
+        previous = n
+    yield start, previous - start + 1
+
+
+def write_xref(f, offsets, trailer, size, prev_startxref, xref_stream=False):
+    # Writes the cross-reference section and trailer closing an update whose
+    # objects are already in f. offsets maps object number to (offset,
+    # generation); trailer maps the keys carried over from the previous
+    # trailer (/Root, /Info, /ID) to their serialized values; size is the
+    # first object number the update left unused.
+    entries = b''.join(b'%s %s ' % (key.encode('ascii'), value) for key, value in trailer.items())
+    startxref = f.tell()
+    if xref_stream:
+        # The previous section is an xref stream, so keep using one; the
+        # stream describes itself as the last object.
+        number = size
+        offsets = dict(offsets)
+        offsets[number] = (startxref, 0)
+        index = []
+        rows = []
+        for first, count in _subsections(offsets):
+            index.append(b'%d %d' % (first, count))
+            for n in range(first, first + count):
+                offset, generation = offsets[n]
+                rows.append(struct.pack('>BIH', 1, offset, generation))
+        data = b''.join(rows)
+        f.write(b'%d 0 obj\n' % number)
+        f.write(b'<< %s/Prev %d /Size %d /Type /XRef /W [ 1 4 2 ] /Index [ %s ] /Length %d >>\nstream\n' % (
+            entries, prev_startxref, number + 1, b' '.join(index), len(data)))
+        f.write(data)
+        f.write(b'\nendstream\nendobj\n')
+    else:
+        f.write(b'xref\n')
+        for first, count in _subsections(offsets):
+            f.write(b'%d %d\n' % (first, count))
+            for n in range(first, first + count):
+                offset, generation = offsets[n]
+                f.write(b'%010d %05d n\r\n' % (offset, generation))
+        f.write(b'trailer\n<< %s/Prev %d /Size %d >>\n' % (entries, prev_startxref, size))
+    f.write(b'startxref\n%d\n%%%%EOF\n' % startxref)
+
+
+def previous_xref(pdf_path):
+    # (offset of the last cross-reference section, whether it is a stream).
+    with open(pdf_path, 'rb') as f:
+        prev_startxref = find_startxref(f)
+        f.seek(prev_startxref)
+        return prev_startxref, not f.read(4).startswith(b'xref')
+
+
+def append_update(pdf_path, write):
+    # Calls write(f) with pdf_path open at its end and returns the number of
+    # bytes it appended. A failed write is truncated away again.
+    with open(pdf_path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        original_size = f.tell()
+        try:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(original_size)
+            raise
+        return f.tell() - original_size
+
+
+def prepare_update(pdf_path, stamps, page_indexes=None, page_index=None):
+    # Builds the update in memory; write_update() appends it.
+    prev_startxref, xref_stream = previous_xref(pdf_path)
+    reader = PdfReader(pdf_path)
+    if reader.is_encrypted:
+        raise ValueError('incremental stamping of encrypted documents is not supported')
+
+    update = IncrementalUpdate(reader)
+    update.prev_startxref = prev_startxref
+    update.xref_stream = xref_stream
+    stamper = PageStamper(stamps, update.add, update.import_object)
+    pages = reader.pages
+    if page_indexes is None:
+        page_indexes = range(len(pages))
+    for index in page_indexes:
+        page = pages[index]
+        new_page = DictionaryObject(page)
+        entry = page_index[index] if page_index else None
+        new_page[NameObject('/Resources')], new_page[NameObject('/Contents')] = stamper.stamp(page, entry)
+        update.replace(page.indirect_reference, new_page)
+    return update
+
+
+def write_update(pdf_path, update):
+    return append_update(pdf_path, lambda f: update.write(f, update.prev_startxref, xref_stream=update.xref_stream))
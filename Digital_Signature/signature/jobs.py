@@ -0,0 +1,98 @@
+# signature/jobs.py
+from django.conf import settings # type: ignore
+from django.db.models import Exists, OuterRef # type: ignore
+from django.utils import timezone # type: ignore
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from . import audit
+from .locks import agreement_lock, agreement_lock_path
+from .models import LoanAgreement, StampingJob
+from .signing import linearize_finished, signed_document_name, signed_document_path, stamp_specs
+from .stamping import composite_pdf
+import datetime
+import time
+
+
+def requeue_stale_jobs(older_than):
+    # Jobs left running by a worker that died go back on the queue.
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than)
+    return StampingJob.objects.filter(status=StampingJob.RUNNING, updated_at__lt=cutoff).update(status=StampingJob.PENDING)
+
+
+def claim_jobs(limit, exclude_agreements=()):
+    # All pending jobs of an agreement are claimed together, since a single
+    # composite covers every signature recorded so far.
+    pending = StampingJob.objects.filter(status=StampingJob.PENDING).exclude(agreement_id__in=exclude_agreements)
+    agreement_ids = []
+    for agreement_id in pending.order_by('created_at').values_list('agreement_id', flat=True)[:limit * 10]:
+        if len(agreement_ids) == limit:
+            break
+        if agreement_id not in agreement_ids:
+            agreement_ids.append(agreement_id)
+
+    claimed = {}
+    for agreement_id in agreement_ids:
+        job_ids = [
+            job_id for job_id in pending.filter(agreement_id=agreement_id).values_list('id', flat=True)
+            if StampingJob.objects.filter(pk=job_id, status=StampingJob.PENDING).update(status=StampingJob.RUNNING, updated_at=timezone.now())
+        ]
+        if job_ids:
+            claimed[agreement_id] = job_ids
+    return claimed
+
+
+def submit_composite(executor, agreement_id):
+    agreement = LoanAgreement.objects.get(pk=agreement_id)
+    return executor.submit(
+        composite_pdf,
+        agreement.document.path,
+        signed_document_path(agreement),
+        stamp_specs(agreement),
+        settings.SIGNATURE_PDF_WRITE_MODE,
+        agreement_lock_path(agreement_id),
+        agreement.stamp_page_indexes,
+        agreement.page_index,
+        settings.SIGNATURE_PDF_ENGINE,
+        linearize_finished(agreement),
+    )
+
+
+def finish_jobs(agreement_id, job_ids, error=None):
+    jobs = StampingJob.objects.filter(pk__in=job_ids)
+    if error is not None:
+        jobs.update(status=StampingJob.FAILED, error=f"{type(error).__name__}: {error}", updated_at=timezone.now())
+        return
+    with agreement_lock(agreement_id):
+        jobs.update(status=StampingJob.DONE, error='', updated_at=timezone.now())
+        # A signature recorded while this composite ran has its own pending
+        # job, so don't publish a copy that is already out of date.
+        newer = StampingJob.objects.filter(agreement=OuterRef('pk'), status=StampingJob.PENDING)
+        agreement = LoanAgreement.objects.filter(pk=agreement_id).filter(~Exists(newer)).first()
+        if agreement is not None:
+            LoanAgreement.objects.filter(pk=agreement_id).update(signed_document=signed_document_name(agreement))
+            audit.record_signed_copy(agreement, signed_document_path(agreement))
+
+
+def run_stamping_worker(workers, once=False, poll_interval=1.0, log=None):
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            busy = [agreement_id for agreement_id, _ in in_flight.values()]
+            for agreement_id, job_ids in claim_jobs(workers - len(in_flight), busy).items():
+                try:
+                    in_flight[submit_composite(executor, agreement_id)] = (agreement_id, job_ids)
+                except Exception as e:
+                    finish_jobs(agreement_id, job_ids, e)
+
+            if not in_flight:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                agreement_id, job_ids = in_flight.pop(future)
+                error = future.exception()
+                finish_jobs(agreement_id, job_ids, error)
+                if log:
+                    log(f"{agreement_id}: {len(job_ids)} job(s) {'failed: ' + str(error) if error else 'done'}")
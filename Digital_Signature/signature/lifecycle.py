@@ -0,0 +1,167 @@
+# signature/lifecycle.py
+#
+# Storage lifecycle for finished agreements, run by `manage.py
+# archive_agreements`. Once every borrower has signed and the last signature
+# is old enough, the signed copy is recompressed losslessly (Flate on every
+# stream, objects packed into object streams; lossy images are left as they
+# are, and the copy stays linearized) and moved to the cold storage tier,
+# STORAGES[SIGNATURE_COLD_STORAGE], freeing local disk. Agreements stamped in place ('immediate' mode) have no
+# separate signed copy: their document is recompressed where it is and stays
+# hot, since the acknowledgement views read it too, so a hot copy is only
+# served as immutable once it has been through here (is_final()). Archived
+# copies are served from the cold tier by serve_archived_document().
+from django.conf import settings # type: ignore
+from django.core.files import File # type: ignore
+from django.core.files.storage import storages # type: ignore
+from django.db.models import Max, Q # type: ignore
+from django.utils import timezone # type: ignore
+from . import audit, metrics
+from .blobs import hash_file
+from .delivery import aserve_stored_file, serve_stored_file
+from .locks import agreement_lock
+from .models import AuditEntry, DEFAULT_BORROWER_NAME, LoanAgreement, StampingJob
+from .pagecache import discard_document_pages
+from .signing import signed_document, stamping_status
+import datetime
+import os
+import tempfile
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+
+def cold_storage():
+    return storages[settings.SIGNATURE_COLD_STORAGE]
+
+
+def archived_name(agreement):
+    return f'signed_documents/{agreement.id}.pdf'
+
+
+def recompress(pdf_path, output_path):
+    # Writes a losslessly recompressed copy of the PDF and returns True, or
+    # False without pikepdf, which does the rewriting.
+    if pikepdf is None:
+        return False
+    with metrics.span('recompress'), pikepdf.open(pdf_path) as pdf:
+        pdf.save(output_path, compress_streams=True, recompress_flate=True, object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                 linearize=settings.SIGNATURE_LINEARIZE_FINISHED)
+    return True
+
+
+def compacted_copy(pdf_path):
+    # Path of a recompressed temporary copy when it is smaller than the
+    # file, or None. The caller removes the copy.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pdf_path), suffix='.pdf.tmp')
+    os.close(fd)
+    try:
+        if recompress(pdf_path, tmp_path) and os.path.getsize(tmp_path) < os.path.getsize(pdf_path):
+            return tmp_path
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    os.unlink(tmp_path)
+    return None
+
+
+def archive_candidates(older_than):
+    # Agreements not yet processed whose last signature is older than
+    # `older_than`; whether every borrower has signed is checked per
+    # agreement.
+    cutoff = timezone.now() - older_than
+    signed = ~Q(borrowersignature__borrower_name=DEFAULT_BORROWER_NAME)
+    return (
+        LoanAgreement.objects.filter(compacted_at__isnull=True).exclude(document='')
+        .annotate(last_signed=Max('borrowersignature__timestamp', filter=signed))
+        .filter(last_signed__lt=cutoff)
+        .order_by('last_signed')
+    )
+
+
+def archive_agreement(agreement, move=True):
+    # Returns (bytes before, bytes after, moved to the cold tier), or None
+    # if the agreement is not finished.
+    if not agreement.is_fully_signed() or stamping_status(agreement) in (StampingJob.PENDING, StampingJob.RUNNING):
+        return None
+    # Composited outside the lock, which signed_document() takes itself.
+    source = signed_document(agreement)
+    with agreement_lock(agreement.id):
+        agreement.refresh_from_db()
+        if agreement.compacted_at:
+            return None
+        in_place = source.name == agreement.document.name
+        if in_place and agreement.blob_id:
+            # Still the shared, unstamped upload.
+            return None
+        # Its split pages go too; any range asked for again is split afresh.
+        discard_document_pages(agreement)
+        path = source.path
+        before = os.path.getsize(path)
+        before_sha256 = audit.file_sha256(path)
+        compacted = compacted_copy(path)
+        if in_place or not move:
+            if compacted:
+                os.replace(compacted, path)
+                audit.record(AuditEntry.COMPACTED, agreement.id, before_sha256, audit.file_sha256(path))
+            agreement.compacted_at = timezone.now()
+            agreement.save(update_fields=['compacted_at'])
+            return before, os.path.getsize(path), False
+
+        try:
+            with open(compacted or path, 'rb') as f:
+                sha256 = hash_file(f)
+                with metrics.span('archive'):
+                    name = cold_storage().save(archived_name(agreement), File(f))
+            after = os.path.getsize(compacted or path)
+        finally:
+            if compacted:
+                os.unlink(compacted)
+        agreement.compacted_at = timezone.now()
+        agreement.archived_name = name
+        agreement.archived_sha256 = sha256
+        agreement.save(update_fields=['compacted_at', 'archived_name', 'archived_sha256'])
+        audit.record(AuditEntry.COMPACTED, agreement.id, before_sha256, sha256)
+        agreement.signed_document.delete(save=False)
+        agreement.signed_document = None
+        agreement.save(update_fields=['signed_document'])
+    return before, after, True
+
+
+def archive_agreements(older_than=None, move=True, limit=None, log=None):
+    if older_than is None:
+        older_than = datetime.timedelta(days=settings.SIGNATURE_ARCHIVE_AFTER_DAYS)
+    totals = {'agreements': 0, 'moved': 0, 'bytes_before': 0, 'bytes_after': 0}
+    candidates = archive_candidates(older_than)
+    if limit is not None:
+        candidates = candidates[:limit]
+    for agreement in candidates.iterator():
+        result = archive_agreement(agreement, move=move)
+        if result is None:
+            continue
+        before, after, moved = result
+        totals['agreements'] += 1
+        totals['moved'] += moved
+        totals['bytes_before'] += before
+        totals['bytes_after'] += after
+        if log:
+            log(f"{agreement.id}: {before} -> {after} bytes{', moved to cold storage' if moved else ''}")
+    return totals
+
+
+def is_final(agreement):
+    # Whether the hot signed copy can be cached as immutable: a finished
+    # agreement's copy is still recompressed in place by archive_agreement(),
+    # and only stops changing once that has run.
+    return agreement.compacted_at is not None and agreement.is_fully_signed()
+
+
+def serve_archived_document(request, agreement):
+    return serve_stored_file(request, cold_storage(), agreement.archived_name, 'application/pdf',
+                             agreement.archived_sha256, agreement.compacted_at.timestamp(), immutable=True)
+
+
+async def aserve_archived_document(request, agreement):
+    return await aserve_stored_file(request, cold_storage(), agreement.archived_name, 'application/pdf',
+                                    agreement.archived_sha256, agreement.compacted_at.timestamp(), immutable=True)
@@ -0,0 +1,139 @@
+# signature/loadtools.py
+#
+# Pieces shared by the load-generating commands (`manage.py benchmark_asgi`
+# and `manage.py load_test`): in-process WSGI and ASGI request drivers that
+# throttle each response to a client's bandwidth, the Response they return,
+# and latency bookkeeping.
+from http.cookies import SimpleCookie
+import asyncio
+import io
+import sys
+import threading
+import time
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = {name.lower(): value for name, value in headers}
+        self.body = body
+        self.cookies = SimpleCookie()
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                self.cookies.load(value)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self, seconds, status):
+        with self.lock:
+            self.in_flight -= 1
+            self.latencies.append(seconds)
+            if status is None or status >= 400:
+                self.errors += 1
+
+
+def wsgi_request(app, method, path, body, headers, bandwidth):
+    path, _, query_string = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'localhost',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        key = name.upper().replace('-', '_')
+        environ[key if key == 'CONTENT_TYPE' else f'HTTP_{key}'] = value
+    started = []
+
+    def start_response(status, response_headers, exc_info=None):
+        started.append((int(status.split()[0]), response_headers))
+
+    result = app(environ, start_response)
+    chunks = []
+    try:
+        for chunk in result:
+            # A sync server's thread is held while the borrower's
+            # connection drains the response.
+            time.sleep(len(chunk) / bandwidth)
+            chunks.append(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    status, response_headers = started[0]
+    return Response(status, response_headers, b''.join(chunks))
+
+
+async def asgi_request(app, method, path, body, headers, bandwidth):
+    path, _, query_string = path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'localhost')] + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    request_sent = False
+    done = asyncio.Event()
+    started = {}
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            started['status'] = message['status']
+            started['headers'] = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in message.get('headers', [])]
+        elif message['type'] == 'http.response.body':
+            chunk = message.get('body', b'')
+            await asyncio.sleep(len(chunk) / bandwidth)
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                done.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    return Response(started['status'], started['headers'], b''.join(chunks))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
@@ -0,0 +1,42 @@
+# signature/locks.py
+from contextlib import contextmanager
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(lock_path):
+    # Exclusive advisory lock held for the duration of the block. Every
+    # acquisition opens its own descriptor, so it serializes threads of one
+    # process as well as separate processes.
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def agreement_lock_path(agreement_id):
+    from django.conf import settings # type: ignore
+    return os.path.join(settings.MEDIA_ROOT, 'locks', f'{agreement_id}.lock')
+
+
+def agreement_lock(agreement_id):
+    # Serializes slot allocation and PDF writes for one agreement; different
+    # agreements use different lock files and never wait on each other.
+    return file_lock(agreement_lock_path(agreement_id))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import datetime
+
+from signature.lifecycle import archive_agreements, pikepdf
+
+
+class Command(BaseCommand):
+    help = 'Recompress fully signed agreements and move their signed copies to the cold storage tier.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, default=settings.SIGNATURE_ARCHIVE_AFTER_DAYS,
+                            help='Only agreements whose last signature is at least this old.')
+        parser.add_argument('--no-move', dest='move', action='store_false', help='Recompress in place without moving to cold storage.')
+        parser.add_argument('--limit', type=int, help='Process at most this many agreements.')
+
+    def handle(self, *args, **options):
+        if pikepdf is None:
+            self.stderr.write('pikepdf is not installed; documents are moved without recompressing them.')
+        totals = archive_agreements(
+            older_than=datetime.timedelta(days=options['older_than_days']),
+            move=options['move'],
+            limit=options['limit'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(
+            f"Processed {totals['agreements']} agreement(s), moved {totals['moved']} to cold storage, "
+            f"{totals['bytes_before']} -> {totals['bytes_after']} bytes"
+        )
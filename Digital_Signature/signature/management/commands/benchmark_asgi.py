@@ -0,0 +1,202 @@
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import asyncio
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+from signature.bulk import import_agreements
+from signature.loadtools import Stats, asgi_request, percentile, wsgi_request
+from signature.models import BorrowerSignature, DEFAULT_BORROWER_NAME
+from signature.synthetic import make_agreement_pdf, make_signature_data_url
+
+SERVERS = ('wsgi', 'asgi')
+URLCONFS = {'wsgi': settings.ROOT_URLCONF, 'asgi': 'signature.async_urls'}
+
+
+def borrower_flow(borrower, signature_data_url):
+    # The requests one borrower makes, from reading the agreement to
+    # downloading it signed. A generator of (method, path, body, headers)
+    # that is sent each Response, so the WSGI and ASGI drivers run exactly
+    # the same flow.
+    args = [borrower.agreement_id, borrower.id]
+    yield 'GET', reverse('view_original_document', args=args), b'', {}
+    yield 'GET', reverse('original_document_pages', args=args + ['1']), b'', {}
+    response = yield 'GET', reverse('sign_agreement', args=args), b'', {}
+    token = response.cookies['csrftoken'].value if 'csrftoken' in response.cookies else ''
+    yield 'POST', reverse('sign_agreement', args=args), urlencode({'signature': signature_data_url}).encode(), {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Cookie': f'csrftoken={token}',
+        'X-CSRFToken': token,
+    }
+    yield 'GET', reverse('sign_agreement_success', args=args), b'', {}
+    yield 'GET', reverse('view_signed_agreement', args=args), b'', {}
+
+
+def run_wsgi(borrowers, data_urls, threads, bandwidth, stats):
+    # One server process with `threads` request threads, as under
+    # `gunicorn --threads`, and one client thread per borrower.
+    app = WSGIHandler()
+    server_threads = threading.BoundedSemaphore(threads)
+
+    def request(step):
+        # Latency includes the wait for a free server thread.
+        started = time.perf_counter()
+        status = None
+        with server_threads:
+            stats.started()
+            try:
+                response = wsgi_request(app, *step, bandwidth)
+                status = response.status
+                return response
+            finally:
+                stats.finished(time.perf_counter() - started, status)
+
+    def client(borrower, data_url):
+        flow = borrower_flow(borrower, data_url)
+        response = None
+        try:
+            while True:
+                response = request(flow.send(response))
+        except StopIteration:
+            pass
+
+    with ThreadPoolExecutor(max_workers=len(borrowers)) as clients:
+        for future in [clients.submit(client, borrower, data_url) for borrower, data_url in zip(borrowers, data_urls)]:
+            future.result()
+
+
+def run_asgi(borrowers, data_urls, bandwidth, stats):
+    # One event loop serving every borrower at once.
+    app = ASGIHandler()
+
+    async def request(step):
+        stats.started()
+        started = time.perf_counter()
+        status = None
+        try:
+            response = await asgi_request(app, *step, bandwidth)
+            status = response.status
+            return response
+        finally:
+            stats.finished(time.perf_counter() - started, status)
+
+    async def client(borrower, data_url):
+        flow = borrower_flow(borrower, data_url)
+        response = None
+        try:
+            while True:
+                response = await request(flow.send(response))
+        except StopIteration:
+            pass
+
+    async def main():
+        await asyncio.gather(*(client(borrower, data_url) for borrower, data_url in zip(borrowers, data_urls)))
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = 'Compare the sync signing views under WSGI with the async ones under ASGI, driven in-process by concurrent borrowers on slow links.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--borrowers', type=int, default=50, help='Borrowers signing at the same time.')
+        parser.add_argument('--signers', type=int, default=2, help='Borrowers per agreement.')
+        parser.add_argument('--pages', type=int, default=10)
+        parser.add_argument('--threads', type=int, default=4, help='Request threads of the WSGI server process.')
+        parser.add_argument('--bandwidth', type=float, default=256, help="Each borrower's download speed in KiB/s.")
+        parser.add_argument('--server', choices=SERVERS, nargs='+', default=list(SERVERS))
+        parser.add_argument('--json', dest='json_path', help="Write results as JSON to this file ('-' for stdout).")
+        parser.add_argument('--current-database', action='store_true',
+                            help='Run against the configured database instead of a throwaway copy.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(MEDIA_ROOT=tmpdir):
+            if options['current_database']:
+                results = self.run(options)
+            else:
+                # A file database, so concurrent writers contend as they
+                # would in production.
+                connection.settings_dict['TEST'] = dict(connection.settings_dict.get('TEST') or {}, NAME=os.path.join(tmpdir, 'benchmark.sqlite3'))
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    results = self.run(options)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.report(results['servers'])
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run(self, options):
+        document = make_agreement_pdf(options['pages'])
+        data_urls = [make_signature_data_url(seed=seed) for seed in range(options['borrowers'])]
+        bandwidth = options['bandwidth'] * 1024
+        servers = []
+        for server in options['server']:
+            borrowers = self.create_borrowers(server, options['borrowers'], options['signers'], document)
+            stats = Stats()
+            started = time.perf_counter()
+            with override_settings(ROOT_URLCONF=URLCONFS[server]):
+                if server == 'wsgi':
+                    run_wsgi(borrowers, data_urls, options['threads'], bandwidth, stats)
+                else:
+                    run_asgi(borrowers, data_urls, bandwidth, stats)
+            elapsed = time.perf_counter() - started
+            signed = BorrowerSignature.objects.filter(
+                agreement__in={borrower.agreement_id for borrower in borrowers},
+            ).exclude(borrower_name=DEFAULT_BORROWER_NAME).count()
+            servers.append({
+                'server': server,
+                'requests': len(stats.latencies),
+                'errors': stats.errors,
+                'signed': signed,
+                'seconds': round(elapsed, 3),
+                'requests_per_second': round(len(stats.latencies) / elapsed, 1),
+                'p50_ms': round(percentile(stats.latencies, 0.5) * 1000, 1),
+                'p95_ms': round(percentile(stats.latencies, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(stats.latencies, 0.99) * 1000, 1),
+                'peak_in_flight': stats.peak_in_flight,
+            })
+        return {
+            'created_at': timezone.now().isoformat(),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+            'options': {name: options[name] for name in ('borrowers', 'signers', 'pages', 'threads', 'bandwidth')},
+            'stamping_mode': settings.SIGNATURE_STAMPING_MODE,
+            'async_workers': settings.SIGNATURE_ASYNC_WORKERS,
+            'servers': servers,
+        }
+
+    def create_borrowers(self, server, num_borrowers, signers, document):
+        rows = [
+            {'agreement': f'{server}-{i // signers}', 'loan_id': f'{server.upper()}-{i // signers}', 'name': f'Borrower {i}', 'mobile_number': f'9{i:09d}'}
+            for i in range(num_borrowers)
+        ]
+        import_agreements(rows, document=SimpleUploadedFile('agreement.pdf', document, content_type='application/pdf'))
+        return list(BorrowerSignature.objects.filter(loan_id__startswith=f'{server.upper()}-', borrower_name=DEFAULT_BORROWER_NAME).order_by('mobile_number'))
+
+    def report(self, servers):
+        self.stdout.write(
+            f"{'server':<6} {'requests':>8} {'errors':>6} {'signed':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'in flight':>9}"
+        )
+        for case in servers:
+            self.stdout.write(
+                f"{case['server']:<6} {case['requests']:>8} {case['errors']:>6} {case['signed']:>6} {case['requests_per_second']:>8.1f} "
+                f"{case['p50_ms']:>8.1f} {case['p95_ms']:>8.1f} {case['p99_ms']:>8.1f} {case['peak_in_flight']:>9}"
+            )
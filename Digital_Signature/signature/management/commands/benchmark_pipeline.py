@@ -0,0 +1,195 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from reportlab.lib import pagesizes
+import PyPDF2
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+from signature.engines import available_engines, get_engine
+from signature.pages import inspect_document
+from signature.signing import prepare_signature
+from signature.stamping import SignatureStamp, stamp_lines
+from signature.synthetic import make_agreement_pdf, make_signature_data_url
+from signature.placement import HORIZONTAL_SPACING, SIGNATURES_PER_ROW, VERTICAL_SPACING, X_OFFSET, Y_OFFSET
+
+STAGES = ('decode', 'render', 'merge', 'write')
+PAGE_SIZES = {'letter': pagesizes.letter, 'a4': pagesizes.A4, 'legal': pagesizes.legal}
+
+
+def run_pipeline(pdf_path, data_urls, mode, page_index, engine, timings):
+    # One composite of every signer onto a fresh copy of the agreement,
+    # timed stage by stage into timings.
+    def stage(name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        timings[name] = (time.perf_counter() - started) * 1000
+        return result
+
+    images = stage('decode', lambda: [prepare_signature(data_url) for data_url in data_urls])
+
+    def render():
+        stamps = []
+        for slot, image in enumerate(images):
+            x_position = X_OFFSET + (slot % SIGNATURES_PER_ROW) * HORIZONTAL_SPACING
+            y_position = Y_OFFSET + (slot // SIGNATURES_PER_ROW) * VERTICAL_SPACING
+            stamp = SignatureStamp(image, x_position, y_position, stamp_lines(f'LOAN-{slot}', '10.0.0.1', timezone.now()))
+            # The overlay is rendered lazily; force it so it is timed here.
+            stamp.overlay_pdf
+            stamps.append(stamp)
+        return stamps
+    stamps = stage('render', render)
+
+    def merge():
+        document = engine.open(pdf_path, incremental=mode == 'incremental')
+        document.stamp(stamps, None, page_index)
+        return document
+    document = stage('merge', merge)
+
+    def write():
+        if mode == 'incremental':
+            document.save_incremental()
+        else:
+            with open(pdf_path + '.out', 'wb') as output_pdf:
+                document.save(output_pdf)
+            os.replace(pdf_path + '.out', pdf_path)
+    try:
+        stage('write', write)
+    finally:
+        document.close()
+
+
+def change(case, previous, key):
+    if not previous.get(key):
+        return '-'
+    return f"{(case[key] - previous[key]) / previous[key] * 100:+.1f}%"
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the signing pipeline stage by stage on synthetic agreements and signatures.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--signers', type=int, nargs='+', default=[1, 3, 6])
+        parser.add_argument('--pagesize', choices=sorted(PAGE_SIZES), nargs='+', default=['letter'])
+        parser.add_argument('--mode', choices=['incremental', 'rewrite'], nargs='+', default=['incremental', 'rewrite'])
+        parser.add_argument('--engine', nargs='+', help='PDF engines to compare (default: every installed engine).')
+        parser.add_argument('--scan-dpi', type=int, help='Make every page a scanned image at this resolution.')
+        parser.add_argument('--canvas', default='600x200', help='Signature pad size in pixels, WIDTHxHEIGHT.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--json', dest='json_path', help="Write results as JSON to this file ('-' for stdout).")
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        try:
+            canvas_width, canvas_height = (int(value) for value in options['canvas'].lower().split('x'))
+        except ValueError:
+            raise CommandError('--canvas must look like 600x200')
+        engines = options['engine'] or available_engines()
+        for name in engines:
+            try:
+                get_engine(name)
+            except (ImportError, ValueError) as e:
+                raise CommandError(f'PDF engine {name!r} is unavailable: {e}')
+
+        cases = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for pagesize in options['pagesize']:
+                for num_pages in options['pages']:
+                    document = make_agreement_pdf(num_pages, pagesize=PAGE_SIZES[pagesize], scan_dpi=options['scan_dpi'])
+                    source_path = os.path.join(tmpdir, 'source.pdf')
+                    with open(source_path, 'wb') as f:
+                        f.write(document)
+                    page_index, _ = inspect_document(source_path)
+                    for num_signers in options['signers']:
+                        data_urls = [make_signature_data_url(canvas_width, canvas_height, seed=seed) for seed in range(num_signers)]
+                        for engine in engines:
+                            for mode in options['mode']:
+                                cases.append(self.measure(tmpdir, document, data_urls, mode, page_index, get_engine(engine), options['repeat'], {
+                                    'engine': engine, 'mode': mode, 'pages': num_pages, 'pagesize': pagesize, 'signers': num_signers,
+                                }))
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'pypdf2': PyPDF2.__version__,
+                'pikepdf': pikepdf.__version__ if pikepdf else None,
+            },
+            'canvas': [canvas_width, canvas_height],
+            'scan_dpi': options['scan_dpi'],
+            'repeat': options['repeat'],
+            'cases': cases,
+        }
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.report(cases, self.load_baseline(options['compare']) if options['compare'] else None)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def measure(self, tmpdir, document, data_urls, mode, page_index, engine, repeat, case):
+        pdf_path = os.path.join(tmpdir, 'agreement.pdf')
+        runs = []
+        for _ in range(repeat):
+            with open(pdf_path, 'wb') as f:
+                f.write(document)
+            timings = {}
+            run_pipeline(pdf_path, data_urls, mode, page_index, engine, timings)
+            runs.append(timings)
+        output_bytes = os.path.getsize(pdf_path)
+
+        # A separate run under tracemalloc, which would skew the timings.
+        with open(pdf_path, 'wb') as f:
+            f.write(document)
+        tracemalloc.start()
+        try:
+            run_pipeline(pdf_path, data_urls, mode, page_index, engine, {})
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        stages = {name: round(statistics.median(run[name] for run in runs), 3) for name in STAGES}
+        return dict(
+            case,
+            stages_ms=stages,
+            total_ms=round(statistics.median(sum(run.values()) for run in runs), 3),
+            peak_kib=round(peak / 1024, 1),
+            input_bytes=len(document),
+            output_bytes=output_bytes,
+        )
+
+    def load_baseline(self, path):
+        with open(path) as f:
+            return {self.case_key(case): case for case in json.load(f)['cases']}
+
+    @staticmethod
+    def case_key(case):
+        # Results from before engines were selectable were all PyPDF2's.
+        return case.get('engine', 'pypdf2'), case['mode'], case['pages'], case['pagesize'], case['signers']
+
+    def report(self, cases, baseline):
+        header = f"{'engine':<8} {'mode':<12} {'size':<7} {'pages':>5} {'signers':>7} " + ' '.join(f"{name + ' ms':>10}" for name in STAGES)
+        header += f" {'total ms':>10} {'peak KiB':>10} {'output B':>10}"
+        if baseline is not None:
+            header += f" {'vs total':>9} {'vs peak':>8} {'vs size':>8}"
+        self.stdout.write(header)
+        for case in cases:
+            line = f"{case['engine']:<8} {case['mode']:<12} {case['pagesize']:<7} {case['pages']:>5} {case['signers']:>7} "
+            line += ' '.join(f"{case['stages_ms'][name]:>10.1f}" for name in STAGES)
+            line += f" {case['total_ms']:>10.1f} {case['peak_kib']:>10.1f} {case['output_bytes']:>10}"
+            if baseline is not None:
+                previous = baseline.get(self.case_key(case), {})
+                line += f" {change(case, previous, 'total_ms'):>9} {change(case, previous, 'peak_kib'):>8} {change(case, previous, 'output_bytes'):>8}"
+            self.stdout.write(line)
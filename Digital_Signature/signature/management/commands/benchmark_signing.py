@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from PIL import Image
+from types import SimpleNamespace
+import base64
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from signature.synthetic import make_agreement_pdf, make_signature_data_url
+from signature.signing import add_signature, prepare_signature
+
+
+def legacy_add_signature(pdf_path, signature_data_url, loan_id, signature_instance, ip_address, timestamp):
+    # The per-page implementation add_signature used before the stamp engine,
+    # kept here as the baseline for comparison.
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+
+    signature_data = base64.b64decode(signature_data_url.split(',')[1])
+    signature_image = Image.open(io.BytesIO(signature_data))
+
+    current_date = timezone.now().date().strftime('%Y-%m-%d')
+    current_time = timezone.now().time().strftime('%H:%M:%S')
+
+    for page_num in range(len(reader.pages)):
+        page = reader.pages[page_num]
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=letter)
+        signature_image = signature_image.resize((80, 90))
+        can.drawImage(ImageReader(signature_image), signature_instance.x_position, signature_instance.y_position + 10, width=80, height=90)
+        text_y_position = signature_instance.y_position + 20
+        can.drawString(signature_instance.x_position, text_y_position - 10, f"{loan_id}")
+        can.drawString(signature_instance.x_position, text_y_position - 20, f"{ip_address}")
+        can.drawString(signature_instance.x_position, text_y_position - 30, f"{current_date}")
+        can.drawString(signature_instance.x_position, text_y_position - 40, f"{current_time}")
+        can.save()
+
+        packet.seek(0)
+        overlay_pdf = PdfReader(packet)
+        overlay_page = overlay_pdf.pages[0]
+        page.merge_page(overlay_page)
+        writer.add_page(page)
+
+    with open(pdf_path, 'wb') as output_pdf:
+        writer.write(output_pdf)
+
+
+def add_signature_with_mode(mode):
+    def run(pdf_path, signature_data_url, *args):
+        with override_settings(SIGNATURE_PDF_WRITE_MODE=mode):
+            add_signature(pdf_path, prepare_signature(signature_data_url), *args)
+    return run
+
+
+IMPLEMENTATIONS = {
+    'legacy': legacy_add_signature,
+    'rewrite': add_signature_with_mode('rewrite'),
+    'incremental': add_signature_with_mode('incremental'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure add_signature latency against synthetic agreements of increasing page count.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 20, 40, 80])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--implementation', choices=sorted(IMPLEMENTATIONS), nargs='+', default=['legacy', 'rewrite', 'incremental'])
+
+    def handle(self, *args, **options):
+        signature_data_url = make_signature_data_url()
+        signature_instance = SimpleNamespace(x_position=25, y_position=25)
+
+        self.stdout.write(f"{'pages':>6} " + ' '.join(f"{name + ' ms':>12}" for name in options['implementation']))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for num_pages in options['pages']:
+                document = make_agreement_pdf(num_pages)
+                row = []
+                for name in options['implementation']:
+                    timings = []
+                    for run in range(options['repeat']):
+                        pdf_path = os.path.join(tmpdir, f"{name}-{num_pages}-{run}.pdf")
+                        with open(pdf_path, 'wb') as f:
+                            f.write(document)
+                        started = time.perf_counter()
+                        IMPLEMENTATIONS[name](pdf_path, signature_data_url, 'LOAN-1', signature_instance, '127.0.0.1', timezone.now())
+                        timings.append((time.perf_counter() - started) * 1000)
+                    row.append(statistics.median(timings))
+                self.stdout.write(f"{num_pages:>6} " + ' '.join(f"{ms:>12.1f}" for ms in row))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+
+from signature.blobs import acquire_blob
+from signature.locks import agreement_lock
+from signature.models import LoanAgreement
+
+
+class Command(BaseCommand):
+    help = 'Move existing agreement documents into content-addressed blob storage, dropping duplicate copies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-files', action='store_true', help='Leave the old per-agreement files in place.')
+
+    def handle(self, *args, **options):
+        moved = reclaimed = 0
+        agreements = LoanAgreement.objects.filter(blob__isnull=True).exclude(document='')
+        for agreement in agreements.iterator():
+            with agreement_lock(agreement.id):
+                agreement.refresh_from_db()
+                old_name = agreement.document.name
+                if agreement.blob_id or not default_storage.exists(old_name):
+                    continue
+                with agreement.document.open('rb') as document:
+                    blob = acquire_blob(document)
+                agreement.blob = blob
+                agreement.document.name = blob.file.name
+                agreement.save(update_fields=['blob', 'document'])
+                if old_name != blob.file.name and not options['keep_files']:
+                    reclaimed += default_storage.size(old_name)
+                    default_storage.delete(old_name)
+                moved += 1
+        self.stdout.write(f"Moved {moved} agreement(s) into blob storage, reclaimed {reclaimed} bytes")
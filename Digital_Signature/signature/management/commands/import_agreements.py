@@ -0,0 +1,34 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from signature.bulk import import_agreements, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Import agreements and borrowers from a CSV or JSON file in batched bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['auto', 'csv', 'json'], default='auto')
+        parser.add_argument('--document', help='Agreement PDF to attach to every imported agreement.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        document = None
+        try:
+            with open(options['path'], 'rb') as f:
+                if options['document']:
+                    document = File(open(options['document'], 'rb'))
+                rows = iter_rows(f, options['format'], options['path'])
+                result = import_agreements(rows, document=document, batch_size=options['batch_size'])
+        except OSError as e:
+            raise CommandError(e)
+        finally:
+            if document is not None:
+                document.close()
+
+        for record, errors in result.errors:
+            self.stderr.write(f"Record {record}: {errors}")
+        if result.file_error:
+            self.stderr.write(result.file_error)
+        self.stdout.write(f"Imported {result.agreements} agreements with {result.borrowers} borrowers; {result.error_count} rows rejected")
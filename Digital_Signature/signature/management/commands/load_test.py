@@ -0,0 +1,366 @@
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from PyPDF2 import PdfReader
+from urllib.parse import urlencode, urlsplit
+import io
+import json
+import os
+import platform
+import queue
+import re
+import tempfile
+import threading
+import time
+
+from signature.jobs import run_stamping_worker
+from signature.loadtools import Response, Stats, percentile, wsgi_request
+from signature.synthetic import make_agreement_pdf, make_signature_data_url
+
+LINK_RE = re.compile(r'view_original_document/([0-9a-f-]{36})/([0-9a-f-]{36})/')
+AGREEMENT_ID_RE = re.compile(r'agreement_id=([0-9a-f-]{36})')
+# Writes that took longer than this were almost certainly waiting for
+# SQLite's database lock.
+SLOW_WRITE_SECONDS = 0.1
+
+
+def form_headers(token):
+    return {'Content-Type': 'application/x-www-form-urlencoded', 'Cookie': f'csrftoken={token}', 'X-CSRFToken': token}
+
+
+def csrf_token(response, token=''):
+    return response.cookies['csrftoken'].value if 'csrftoken' in response.cookies else token
+
+
+def lender_flow(lender, number, signers, document):
+    # The requests a lender makes through loan_process to set up one
+    # agreement, following each redirect as a browser would. A generator of
+    # (step, method, path, body, headers) that is sent each Response and
+    # returns the agreement's signing links as (agreement_id, borrower_id).
+    url = reverse('loan_process')
+    response = yield 'loan_process', 'GET', url, b'', {}
+    token = csrf_token(response)
+    body = urlencode({'step': 'number_of_borrowers', 'num_borrowers': signers}).encode()
+    response = yield 'number_of_borrowers', 'POST', url, body, form_headers(token)
+    yield 'loan_process', 'GET', response.headers['location'], b'', {}
+
+    fields = {'step': 'borrower_details', 'num_borrowers': signers, 'form-TOTAL_FORMS': signers, 'form-INITIAL_FORMS': 0}
+    for i in range(signers):
+        fields.update({
+            f'form-{i}-loan_id': f'LOAD-{lender}-{number}',
+            f'form-{i}-name': f'Borrower {i}',
+            f'form-{i}-mobile_number': f'9{lender:04d}{number:03d}{i:02d}',
+        })
+    response = yield 'borrower_details', 'POST', url, urlencode(fields).encode(), form_headers(token)
+    agreement_id = AGREEMENT_ID_RE.search(response.headers['location']).group(1)
+    yield 'loan_process', 'GET', response.headers['location'], b'', {}
+
+    body = encode_multipart(BOUNDARY, {
+        'step': 'upload_agreement',
+        'agreement_id': agreement_id,
+        'stamp_pages': 'all',
+        'document': SimpleUploadedFile('agreement.pdf', document, content_type='application/pdf'),
+    })
+    headers = dict(form_headers(token), **{'Content-Type': MULTIPART_CONTENT})
+    response = yield 'upload_agreement', 'POST', url, body, headers
+    response = yield 'loan_process', 'GET', response.headers['location'], b'', {}
+    return [link for link in LINK_RE.findall(response.body.decode()) if link[0] == agreement_id]
+
+
+def borrower_flow(agreement_id, borrower_id, signature_data_url):
+    # A borrower reading, acknowledging and signing the agreement, then
+    # downloading it. Returns True once the signature is accepted.
+    args = [agreement_id, borrower_id]
+    response = yield 'view_original_document', 'GET', reverse('view_original_document', args=args), b'', {}
+    token = csrf_token(response)
+    yield 'original_document_pages', 'GET', reverse('original_document_pages', args=args + ['1']), b'', {}
+    body = urlencode({'acknowledge_checkbox': 'on'}).encode()
+    response = yield 'acknowledge', 'POST', reverse('view_original_document', args=args), body, form_headers(token)
+    response = yield 'sign_agreement', 'GET', response.headers['location'], b'', {}
+    token = csrf_token(response, token)
+    body = urlencode({'signature': signature_data_url}).encode()
+    response = yield 'sign', 'POST', reverse('sign_agreement', args=args), body, form_headers(token)
+    yield 'sign_agreement_success', 'GET', reverse('sign_agreement_success', args=args), b'', {}
+    yield 'view_signed_agreement', 'GET', reverse('view_signed_agreement', args=args), b'', {}
+    return True
+
+
+class LockProbe:
+    # Database execute wrapper timing every statement that is not a SELECT.
+    # Under SQLite a write blocked by another connection waits for the lock,
+    # up to the busy timeout, inside the statement, then fails with
+    # "database is locked".
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = []
+        self.lock_errors = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if 'locked' in str(e):
+                with self.lock:
+                    self.lock_errors += 1
+            raise
+        finally:
+            with self.lock:
+                self.writes.append(time.perf_counter() - started)
+
+    def summary(self):
+        with self.lock:
+            writes = list(self.writes)
+        return {
+            'write_statements': len(writes),
+            'write_p50_ms': round(percentile(writes, 0.5) * 1000, 1) if writes else 0.0,
+            'write_p99_ms': round(percentile(writes, 0.99) * 1000, 1) if writes else 0.0,
+            'write_max_ms': round(max(writes, default=0) * 1000, 1),
+            'slow_writes': sum(seconds >= SLOW_WRITE_SECONDS for seconds in writes),
+            'lock_errors': self.lock_errors,
+        }
+
+
+class InProcessClient:
+    # Requests go straight to a WSGI handler in this process.
+    def __init__(self, probe=None):
+        self.app = WSGIHandler()
+        self.probe = probe
+
+    def request(self, method, path, body, headers):
+        if self.probe is None:
+            return wsgi_request(self.app, method, path, body, headers, float('inf'))
+        with connection.execute_wrapper(self.probe):
+            return wsgi_request(self.app, method, path, body, headers, float('inf'))
+
+
+class HTTPClient:
+    # Requests go to a server at base_url, one connection each.
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def request(self, method, path, body, headers):
+        conn = HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body or None, headers=headers)
+            response = conn.getresponse()
+            return Response(response.status, response.getheaders(), response.read())
+        finally:
+            conn.close()
+
+
+def run_flow(client, flow, overall, steps):
+    # Drives a flow to the end and returns its result, or None once a
+    # request fails.
+    response = None
+    try:
+        while True:
+            step, method, path, body, headers = flow.send(response)
+            stats = steps.setdefault(step, Stats())
+            overall.started()
+            stats.started()
+            started = time.perf_counter()
+            response = None
+            try:
+                response = client.request(method, path, body, headers)
+            except OSError:
+                pass
+            finally:
+                seconds = time.perf_counter() - started
+                status = response.status if response is not None else None
+                overall.finished(seconds, status)
+                stats.finished(seconds, status)
+            if status is None or status >= 400:
+                flow.close()
+                return None
+    except StopIteration as stop:
+        return stop.value
+
+
+def stamp_counts(content):
+    # Signature stamps on each page of a signed copy.
+    return [
+        sum(name.startswith('/DSStamp') for name in page['/Resources'].get('/XObject', {}))
+        for page in PdfReader(io.BytesIO(content)).pages
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Load-test the lender and borrower flows: concurrent lenders set up agreements through loan_process while '
+            'concurrent borrowers acknowledge and sign them, then every signed copy is checked for its stamps.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lenders', type=int, default=5, help='Lenders creating agreements at the same time.')
+        parser.add_argument('--agreements', type=int, default=4, help='Agreements each lender creates.')
+        parser.add_argument('--signers', type=int, default=2, help='Borrowers per agreement.')
+        parser.add_argument('--borrowers', type=int, default=20, help='Borrowers signing at the same time.')
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument('--url', help='Drive a running server (e.g. http://127.0.0.1:8000) instead of the app in-process.')
+        parser.add_argument('--no-verify', dest='verify', action='store_false', help='Skip checking the signed copies.')
+        parser.add_argument('--json', dest='json_path', help="Write results as JSON to this file ('-' for stdout).")
+        parser.add_argument('--current-database', action='store_true',
+                            help='Run in-process against the configured database instead of a throwaway copy.')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            results = self.run(options, HTTPClient(options['url']), None)
+        else:
+            with tempfile.TemporaryDirectory() as tmpdir, override_settings(MEDIA_ROOT=tmpdir):
+                if options['current_database']:
+                    results = self.run_in_process(options)
+                else:
+                    # A file database, so concurrent writers contend as they
+                    # would in production.
+                    connection.settings_dict['TEST'] = dict(connection.settings_dict.get('TEST') or {}, NAME=os.path.join(tmpdir, 'load_test.sqlite3'))
+                    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                    try:
+                        results = self.run_in_process(options)
+                    finally:
+                        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+            if options['json_path']:
+                with open(options['json_path'], 'w') as f:
+                    json.dump(results, f, indent=2)
+        if results['stamp_check']['problems']:
+            raise CommandError(f"{len(results['stamp_check']['problems'])} signed agreement(s) failed the stamp check")
+
+    def run_in_process(self, options):
+        probe = LockProbe()
+        return self.run(options, InProcessClient(probe), probe)
+
+    def run(self, options, client, probe):
+        document = make_agreement_pdf(options['pages'])
+        overall, steps = Stats(), {}
+        links = queue.Queue()
+        agreements = {}
+        signed = {}
+        lock = threading.Lock()
+
+        def lender(number):
+            for i in range(options['agreements']):
+                result = run_flow(client, lender_flow(number, i, options['signers'], document), overall, steps)
+                if result:
+                    with lock:
+                        agreements[result[0][0]] = result
+                    for link in result:
+                        links.put(link)
+
+        def borrower(number):
+            data_url = make_signature_data_url(seed=number)
+            while (link := links.get()) is not None:
+                if run_flow(client, borrower_flow(*link, data_url), overall, steps):
+                    with lock:
+                        signed[link[0]] = signed.get(link[0], 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['lenders'] + options['borrowers']) as pool:
+            borrowers = [pool.submit(borrower, i) for i in range(options['borrowers'])]
+            try:
+                for future in [pool.submit(lender, i) for i in range(options['lenders'])]:
+                    future.result()
+            finally:
+                for _ in borrowers:
+                    links.put(None)
+            for future in borrowers:
+                future.result()
+        elapsed = time.perf_counter() - started
+        database = probe.summary() if probe else None
+
+        stamp_check = {'checked': 0, 'problems': []}
+        if options['verify']:
+            if not options['url'] and settings.SIGNATURE_STAMPING_MODE == 'queued':
+                run_stamping_worker(settings.SIGNATURE_STAMPING_WORKERS, once=True)
+            stamp_check = self.check_stamps(InProcessClient() if probe else client, agreements, signed, options['pages'])
+
+        latencies = overall.latencies
+        return {
+            'created_at': timezone.now().isoformat(),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+            'options': {name: options[name] for name in ('lenders', 'agreements', 'signers', 'borrowers', 'pages')},
+            'target': options['url'] or 'in-process',
+            'stamping_mode': settings.SIGNATURE_STAMPING_MODE if not options['url'] else None,
+            'seconds': round(elapsed, 3),
+            'requests': len(latencies),
+            'errors': overall.errors,
+            'error_rate': round(overall.errors / len(latencies), 4) if latencies else 0.0,
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else 0.0,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else 0.0,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else 0.0,
+            'max_ms': round(max(latencies, default=0) * 1000, 1),
+            'peak_in_flight': overall.peak_in_flight,
+            'agreements': len(agreements),
+            'signatures': sum(signed.values()),
+            'steps': [
+                {
+                    'step': step,
+                    'requests': len(stats.latencies),
+                    'errors': stats.errors,
+                    'p50_ms': round(percentile(stats.latencies, 0.5) * 1000, 1),
+                    'p95_ms': round(percentile(stats.latencies, 0.95) * 1000, 1),
+                    'p99_ms': round(percentile(stats.latencies, 0.99) * 1000, 1),
+                }
+                for step, stats in steps.items()
+            ],
+            'database': database,
+            'stamp_check': stamp_check,
+        }
+
+    def check_stamps(self, client, agreements, signed, pages):
+        # Every page of each agreement's signed copy should carry one stamp
+        # per accepted signature.
+        problems = []
+        for agreement_id, links in agreements.items():
+            expected = signed.get(agreement_id, 0)
+            try:
+                response = client.request('GET', reverse('view_signed_agreement', args=links[0]), b'', {})
+            except OSError as e:
+                problems.append(f'{agreement_id}: {e}')
+                continue
+            if response.status != 200:
+                problems.append(f'{agreement_id}: HTTP {response.status}')
+                continue
+            counts = stamp_counts(response.body)
+            if counts != [expected] * pages:
+                problems.append(f'{agreement_id}: expected {expected} stamp(s) on each of {pages} pages, found {counts}')
+        return {'checked': len(agreements), 'problems': problems}
+
+    def report(self, results):
+        self.stdout.write(
+            f"{results['target']}: {results['requests']} requests in {results['seconds']:.1f}s, {results['requests_per_second']:.1f} req/s, "
+            f"{results['errors']} errors ({results['error_rate']:.2%}), {results['agreements']} agreements, {results['signatures']} signatures"
+        )
+        self.stdout.write(f"{'step':<24} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for step in results['steps']:
+            self.stdout.write(
+                f"{step['step']:<24} {step['requests']:>8} {step['errors']:>6} {step['p50_ms']:>8.1f} {step['p95_ms']:>8.1f} {step['p99_ms']:>8.1f}"
+            )
+        self.stdout.write(
+            f"{'all':<24} {results['requests']:>8} {results['errors']:>6} {results['p50_ms']:>8.1f} {results['p95_ms']:>8.1f} {results['p99_ms']:>8.1f}"
+        )
+        database = results['database']
+        if database:
+            self.stdout.write(
+                f"database: {database['write_statements']} writes, p50 {database['write_p50_ms']:.1f} ms, p99 {database['write_p99_ms']:.1f} ms, "
+                f"max {database['write_max_ms']:.1f} ms, {database['slow_writes']} over {SLOW_WRITE_SECONDS * 1000:.0f} ms, "
+                f"{database['lock_errors']} 'database is locked' errors"
+            )
+        stamp_check = results['stamp_check']
+        self.stdout.write(f"stamp check: {stamp_check['checked'] - len(stamp_check['problems'])}/{stamp_check['checked']} signed agreements correct")
+        for problem in stamp_check['problems']:
+            self.stderr.write(problem)
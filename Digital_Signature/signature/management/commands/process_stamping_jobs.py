@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from signature.batch import settle_stale_items
+from signature.jobs import requeue_stale_jobs, run_stamping_worker
+
+
+class Command(BaseCommand):
+    help = 'Drain the stamping job queue, compositing signed agreements in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.SIGNATURE_STAMPING_WORKERS)
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Requeue jobs left running, and settle batch signing items left unfinished, for this many seconds.')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+        settled = settle_stale_items(options['stale_after'])
+        if settled:
+            self.stdout.write(f"Settled {settled} stale batch signing item(s)")
+        run_stamping_worker(
+            options['workers'],
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            log=self.stdout.write,
+        )
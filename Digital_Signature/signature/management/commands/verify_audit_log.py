@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from signature.audit import add_checkpoint, seal, verify
+
+
+class Command(BaseCommand):
+    help = 'Seal pending audit log entries, then verify the hash chain from the last checkpoint on and record a new checkpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agreement', help="Also verify this agreement's entries and its signed copy.")
+        parser.add_argument('--full', action='store_true', help='Verify the whole chain, ignoring checkpoints.')
+        parser.add_argument('--no-checkpoint', dest='checkpoint', action='store_false', help='Do not record a checkpoint.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        sealed = seal()
+        result = verify(agreement_id=options['agreement'], full=options['full'])
+        elapsed = time.perf_counter() - started
+        for error in result['errors']:
+            self.stderr.write(error)
+        if result['errors']:
+            raise CommandError(f"{len(result['errors'])} problem(s) in the audit log")
+        if options['checkpoint']:
+            add_checkpoint(result)
+        self.stdout.write(
+            f"Sealed {sealed} and verified {result['checked']} entr{'y' if result['checked'] == 1 else 'ies'} in {elapsed:.1f}s; "
+            f"head #{result['sequence']} {result['entry_hash']}"
+        )
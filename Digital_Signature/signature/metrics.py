@@ -0,0 +1,158 @@
+# signature/metrics.py
+#
+# Process-local timing spans and counters for the signing hot path, exposed
+# in the Prometheus text format by MetricsView and summarised per request by
+# SigningMetricsMiddleware. Django-free, so the stamping code can use it
+# too. Until configure(True) is called span() hands back a shared no-op
+# context manager and count() returns at once.
+from contextlib import contextmanager, nullcontext
+import contextvars
+import threading
+import time
+
+ENABLED = False
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HELP = {
+    'signature_stage_seconds': ('histogram', 'Time spent in each signing stage.'),
+    'signature_request_seconds': ('histogram', 'Time spent handling each signing view.'),
+    'signature_pages_stamped_total': ('counter', 'Pages that had stamps placed on them.'),
+    'signature_bytes_written_total': ('counter', 'Bytes of PDF written by stamping.'),
+    'signature_db_queries_total': ('counter', 'Database queries run while handling requests.'),
+}
+
+_NULL_SPAN = nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_request = contextvars.ContextVar('signature_metrics_request', default=None)
+
+
+def configure(enabled):
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        buckets = histogram[0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+def increment(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class RequestMetrics:
+    # What one request spent, for its structured log line.
+    def __init__(self):
+        self.stages_ms = {}
+        self.counters = {}
+
+    def add_stage(self, stage, seconds):
+        self.stages_ms[stage] = self.stages_ms.get(stage, 0.0) + seconds * 1000
+
+    def add_count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+def start_request():
+    collector = RequestMetrics()
+    return collector, _request.set(collector)
+
+
+def finish_request(token):
+    _request.reset(token)
+
+
+def record_stage(stage, seconds):
+    observe('signature_stage_seconds', seconds, stage=stage)
+    collector = _request.get()
+    if collector is not None:
+        collector.add_stage(stage, seconds)
+
+
+@contextmanager
+def _span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def span(stage):
+    if not ENABLED:
+        return _NULL_SPAN
+    return _span(stage)
+
+
+def count(name, value=1):
+    if not ENABLED:
+        return
+    increment(f'signature_{name}_total', value)
+    collector = _request.get()
+    if collector is not None:
+        collector.add_count(name, value)
+
+
+def time_query(execute, sql, params, many, context):
+    # connection.execute_wrapper() hook.
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_stage('db', time.perf_counter() - started)
+        count('db_queries')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    with _lock:
+        histograms = {key: (list(value[0]), value[1], value[2]) for key, value in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    names = sorted({name for name, _ in histograms} | {name for name, _ in counters})
+    for name in names:
+        kind, help_text = HELP.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), (buckets, total, samples) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, bucket in zip(BUCKETS, buckets):
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {bucket}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {samples}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {samples}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
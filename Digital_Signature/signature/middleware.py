@@ -0,0 +1,68 @@
+# signature/middleware.py
+from django.conf import settings # type: ignore
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction # type: ignore
+from django.core.exceptions import MiddlewareNotUsed # type: ignore
+from django.db import connection # type: ignore
+from . import metrics
+import json
+import logging
+import time
+
+logger = logging.getLogger('signature.metrics')
+
+
+class SigningMetricsMiddleware:
+    # Times every request, with the signing stages and DB queries it ran,
+    # and logs one JSON line per request. Removed from the middleware chain
+    # entirely when SIGNATURE_METRICS_ENABLED is off.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SIGNATURE_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        collector, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.time_query):
+                response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.log(request, response, collector, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # Queries are timed by the async views' workers; those the async ORM
+        # runs on Django's own thread are not.
+        collector, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.log(request, response, collector, time.perf_counter() - started)
+        return response
+
+    def log(self, request, response, collector, elapsed):
+        view = request.resolver_match.url_name if request.resolver_match else None
+        if view == 'metrics':
+            # Scrapes would otherwise dominate the log.
+            return
+        metrics.observe('signature_request_seconds', elapsed, view=view or 'unmatched', method=request.method)
+        logger.info(json.dumps({
+            'event': 'request',
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'stages_ms': {stage: round(ms, 3) for stage, ms in collector.stages_ms.items()},
+            'counters': collector.counters,
+        }, sort_keys=True))
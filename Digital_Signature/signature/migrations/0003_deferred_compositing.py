@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("signature", "0002_borrowersignature_borrower_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrowersignature",
+            name="signature_image",
+            field=models.FileField(blank=True, null=True, upload_to="signatures/"),
+        ),
+        migrations.AddField(
+            model_name="loanagreement",
+            name="signed_document",
+            field=models.FileField(
+                blank=True, null=True, upload_to="signed_documents/"
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("signature", "0005_documentblob"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowersignature",
+            index=models.Index(
+                fields=["agreement", "borrower_name"], name="sig_agreement_borrower_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stampingjob",
+            index=models.Index(
+                fields=["agreement", "created_at"], name="job_agreement_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stampingjob",
+            index=models.Index(
+                fields=["status", "created_at"], name="job_status_created_idx"
+            ),
+        ),
+    ]
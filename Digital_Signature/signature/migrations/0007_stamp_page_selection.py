@@ -0,0 +1,37 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("signature", "0006_signing_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loanagreement",
+            name="stamp_page_indexes",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="loanagreement",
+            name="stamp_pages",
+            field=models.CharField(
+                choices=[
+                    ("all", "Every page"),
+                    ("last", "Last page"),
+                    ("first_last", "First and last page"),
+                    ("pages", "Listed pages"),
+                    ("anchor", "Pages containing a phrase"),
+                ],
+                default="all",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="loanagreement",
+            name="stamp_pages_value",
+            field=models.CharField(blank=True, max_length=200),
+        ),
+    ]
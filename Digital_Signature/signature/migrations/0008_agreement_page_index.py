@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("signature", "0007_stamp_page_selection"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loanagreement",
+            name="page_index",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
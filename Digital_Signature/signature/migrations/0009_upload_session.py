@@ -0,0 +1,56 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:31
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signature", "0008_agreement_page_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("size", models.BigIntegerField()),
+                ("received", models.BigIntegerField(default=0)),
+                ("sha256", models.CharField(blank=True, max_length=64)),
+                (
+                    "stamp_pages",
+                    models.CharField(
+                        choices=[
+                            ("all", "Every page"),
+                            ("last", "Last page"),
+                            ("first_last", "First and last page"),
+                            ("pages", "Listed pages"),
+                            ("anchor", "Pages containing a phrase"),
+                        ],
+                        default="all",
+                        max_length=10,
+                    ),
+                ),
+                ("stamp_pages_value", models.CharField(blank=True, max_length=200)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "agreement",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="signature.loanagreement",
+                    ),
+                ),
+            ],
+        ),
+    ]
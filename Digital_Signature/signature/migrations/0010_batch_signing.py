@@ -0,0 +1,110 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:34
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signature", "0009_upload_session"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BatchSigning",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "match",
+                    models.CharField(
+                        choices=[
+                            ("mobile_number", "Mobile number"),
+                            ("loan_id", "Loan ID"),
+                        ],
+                        default="mobile_number",
+                        max_length=20,
+                    ),
+                ),
+                ("ip_address", models.GenericIPAddressField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="BatchSigningItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="borrowersignature",
+            index=models.Index(
+                fields=["mobile_number", "borrower_name"],
+                name="sig_mobile_borrower_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowersignature",
+            index=models.Index(
+                fields=["loan_id", "borrower_name"], name="sig_loan_borrower_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="batchsigning",
+            name="borrower",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                to="signature.borrowersignature",
+            ),
+        ),
+        migrations.AddField(
+            model_name="batchsigningitem",
+            name="batch",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="items",
+                to="signature.batchsigning",
+            ),
+        ),
+        migrations.AddField(
+            model_name="batchsigningitem",
+            name="borrower",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="signature.borrowersignature",
+            ),
+        ),
+    ]
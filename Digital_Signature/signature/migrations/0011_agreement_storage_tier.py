@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signature", "0010_batch_signing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loanagreement",
+            name="archived_name",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="loanagreement",
+            name="archived_sha256",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="loanagreement",
+            name="compacted_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signature", "0011_agreement_storage_tier"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sequence", models.BigIntegerField()),
+                ("entry_hash", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="AuditEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "sequence",
+                    models.BigIntegerField(blank=True, null=True, unique=True),
+                ),
+                (
+                    "event",
+                    models.CharField(
+                        choices=[
+                            ("signed", "Signed"),
+                            ("composited", "Signed copy written"),
+                            ("compacted", "Signed copy recompressed"),
+                        ],
+                        max_length=12,
+                    ),
+                ),
+                ("agreement_id", models.UUIDField(db_index=True)),
+                ("signature_id", models.UUIDField(blank=True, null=True)),
+                ("signer", models.CharField(blank=True, max_length=100)),
+                ("loan_id", models.CharField(blank=True, max_length=100)),
+                ("ip_address", models.GenericIPAddressField(blank=True, null=True)),
+                ("timestamp", models.DateTimeField(default=django.utils.timezone.now)),
+                ("document_before", models.CharField(blank=True, max_length=64)),
+                ("document_after", models.CharField(blank=True, max_length=64)),
+                ("prev_hash", models.CharField(blank=True, max_length=64)),
+                ("entry_hash", models.CharField(blank=True, max_length=64)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["entry_hash", "id"], name="audit_unsealed_idx")
+                ],
+            },
+        ),
+    ]
@@ -3,16 +3,67 @@ from django.db import models # type: ignore
 import datetime
 import uuid
 from django.utils import timezone # type: ignore
+from .pages import STAMP_ALL, STAMP_PAGES_CHOICES
+
+# Borrower rows are created with the default borrower_name; rows created when
+# a borrower signs carry that borrower's name instead.
+DEFAULT_BORROWER_NAME = 'Default Borrower'
+
+class DocumentBlob(models.Model):
+    # One stored copy of an uploaded agreement, shared by every LoanAgreement
+    # whose document has the same bytes; see signature/blobs.py.
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
 
 class LoanAgreement(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     borrower = models.CharField(max_length=100)
     document = models.FileField(upload_to='documents/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Set while document still points at the shared blob.
+    blob = models.ForeignKey(DocumentBlob, on_delete=models.PROTECT, null=True, blank=True)
+    # Composited copy of document with every recorded signature; cleared
+    # whenever a new signature arrives.
+    signed_document = models.FileField(upload_to='signed_documents/', null=True, blank=True)
+    # Which pages carry the signature stamps; see signature/pages.py.
+    # stamp_pages_value holds the page list or anchor phrase, and
+    # stamp_page_indexes the pages it resolved to when the document was
+    # uploaded (null for every page).
+    stamp_pages = models.CharField(max_length=10, choices=STAMP_PAGES_CHOICES, default=STAMP_ALL)
+    stamp_pages_value = models.CharField(max_length=200, blank=True)
+    stamp_page_indexes = models.JSONField(null=True, blank=True)
+    # Per-page mediabox, rotation and signature anchor positions, read once
+    # at upload so placing a stamp never re-scans the document.
+    page_index = models.JSONField(null=True, blank=True)
+    # Set by the storage lifecycle job (signature/lifecycle.py) once the
+    # signed copy has been recompressed. archived_name is the copy's name in
+    # the cold storage tier when it was moved there, and archived_sha256 its
+    # digest.
+    compacted_at = models.DateTimeField(null=True, blank=True)
+    archived_name = models.CharField(max_length=255, blank=True)
+    archived_sha256 = models.CharField(max_length=64, blank=True)
 
     def __str__(self):
         return  self.borrower
 
+    def borrowers(self):
+        return self.borrowersignature_set.filter(borrower_name=DEFAULT_BORROWER_NAME)
+
+    def signatures(self):
+        return self.borrowersignature_set.exclude(borrower_name=DEFAULT_BORROWER_NAME)
+
+    def is_fully_signed(self):
+        names = set(self.borrowers().values_list('name', flat=True))
+        signed = set(self.signatures().values_list('borrower_name', flat=True))
+        return bool(names) and names <= signed
+
     
 class BorrowerSignature(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -21,13 +72,157 @@ class BorrowerSignature(models.Model):
     name = models.CharField(max_length=100)
     mobile_number = models.CharField(max_length=15)
     #borrower = models.ForeignKey(Borrower, on_delete=models.CASCADE)
-    borrower_name = models.CharField(max_length=100, default='Default Borrower')
+    borrower_name = models.CharField(max_length=100, default=DEFAULT_BORROWER_NAME)
     signed_at = models.DateTimeField(auto_now_add=True)
     signed_document = models.FileField(upload_to='signed_documents/', null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
     x_position = models.IntegerField(default=100)
     y_position = models.IntegerField(default=50)
+    signature_image = models.FileField(upload_to='signatures/', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # "Has this borrower signed?" and the per-agreement borrower and
+            # signature lists.
+            models.Index(fields=['agreement', 'borrower_name'], name='sig_agreement_borrower_idx'),
+            # A borrower's rows across agreements, for batch signing.
+            models.Index(fields=['mobile_number', 'borrower_name'], name='sig_mobile_borrower_idx'),
+            models.Index(fields=['loan_id', 'borrower_name'], name='sig_loan_borrower_idx'),
+        ]
+
     def __str__(self):
         return f"Signature of {self.name} on {self.signed_at}"
-    
\ No newline at end of file
+    
+
+class StampingJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    agreement = models.ForeignKey(LoanAgreement, on_delete=models.CASCADE)
+    signature = models.ForeignKey(BorrowerSignature, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Latest job for an agreement, and the oldest pending jobs.
+            models.Index(fields=['agreement', 'created_at'], name='job_agreement_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stamping job for {self.agreement_id} ({self.status})"
+
+
+class UploadSession(models.Model):
+    # A chunked, resumable upload of an agreement's document; see
+    # signature/uploads.py. `received` bytes of `size` are in the partial
+    # file so far, and `sha256` is the digest the client declared, if any.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    agreement = models.ForeignKey(LoanAgreement, on_delete=models.CASCADE)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    stamp_pages = models.CharField(max_length=10, choices=STAMP_PAGES_CHOICES, default=STAMP_ALL)
+    stamp_pages_value = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} for {self.agreement_id} ({self.received}/{self.size} bytes)"
+
+
+class BatchSigning(models.Model):
+    # One drawing signed onto every agreement still waiting for the borrower,
+    # found by mobile number or by loan ID; see signature/batch.py.
+    MATCH_MOBILE_NUMBER = 'mobile_number'
+    MATCH_LOAN_ID = 'loan_id'
+    MATCH_CHOICES = [
+        (MATCH_MOBILE_NUMBER, 'Mobile number'),
+        (MATCH_LOAN_ID, 'Loan ID'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # The row whose signing link the batch was started from.
+    borrower = models.ForeignKey(BorrowerSignature, on_delete=models.CASCADE)
+    match = models.CharField(max_length=20, choices=MATCH_CHOICES, default=MATCH_MOBILE_NUMBER)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Batch signing by {self.borrower_id}"
+
+
+class BatchSigningItem(models.Model):
+    # Progress of one agreement in a batch, with StampingJob's statuses.
+    batch = models.ForeignKey(BatchSigning, on_delete=models.CASCADE, related_name='items')
+    borrower = models.ForeignKey(BorrowerSignature, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=10, choices=StampingJob.STATUS_CHOICES, default=StampingJob.PENDING)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.batch_id}: {self.borrower_id} ({self.status})"
+
+
+class AuditEntry(models.Model):
+    # One event in the signing audit log; see signature/audit.py. Rows are
+    # inserted unsealed and sealed in batches, in insertion order, which sets
+    # `sequence`, `prev_hash` (the entry before it in the chain) and
+    # `entry_hash`; sealed rows are never changed. The agreement and
+    # signature are plain IDs so the log outlives them.
+    SIGNED = 'signed'
+    COMPOSITED = 'composited'
+    COMPACTED = 'compacted'
+    EVENT_CHOICES = [
+        (SIGNED, 'Signed'),
+        (COMPOSITED, 'Signed copy written'),
+        (COMPACTED, 'Signed copy recompressed'),
+    ]
+
+    sequence = models.BigIntegerField(null=True, blank=True, unique=True)
+    event = models.CharField(max_length=12, choices=EVENT_CHOICES)
+    agreement_id = models.UUIDField(db_index=True)
+    signature_id = models.UUIDField(null=True, blank=True)
+    signer = models.CharField(max_length=100, blank=True)
+    loan_id = models.CharField(max_length=100, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # SHA-256 of the agreement's PDF before and after the event; blank after
+    # when the event writes no PDF (a deferred signature).
+    document_before = models.CharField(max_length=64, blank=True)
+    document_after = models.CharField(max_length=64, blank=True)
+    prev_hash = models.CharField(max_length=64, blank=True)
+    entry_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [
+            # Unsealed entries, oldest first.
+            models.Index(fields=['entry_hash', 'id'], name='audit_unsealed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} on {self.agreement_id} (#{self.sequence})"
+
+
+class AuditCheckpoint(models.Model):
+    # The audit log was verified up to and including `sequence`, whose
+    # entry_hash was `entry_hash`. Verification resumes after the latest.
+    sequence = models.BigIntegerField()
+    entry_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Audit log verified to #{self.sequence}"
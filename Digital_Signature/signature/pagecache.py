@@ -0,0 +1,89 @@
+# signature/pagecache.py
+#
+# Single pages and short page ranges of an agreement's document as small
+# standalone PDFs, so the acknowledgement view can show the first page
+# without the borrower downloading the whole agreement. A range is split out
+# the first time it is asked for and kept under page_cache/, keyed by the
+# fingerprint of the document's bytes; a document that changes gets a new
+# fingerprint and so never serves stale pages. A version's ranges are
+# discarded when it stops being served: when a shared blob is deleted, and
+# when an agreement's own copy is deleted, stamped in place or archived.
+from django.core.files.storage import default_storage # type: ignore
+from PyPDF2 import PdfReader, PdfWriter
+from . import metrics
+from .blobs import _write_blob, blob_name
+from .delivery import file_fingerprint
+from .locks import file_lock
+from .placement import page_entry, visual_size
+import io
+import os
+import shutil
+
+
+def document_fingerprint(agreement, path):
+    # A document that still is its blob is already named by its hash.
+    if agreement.blob_id and agreement.document.name == blob_name(agreement.blob_id):
+        return agreement.blob_id
+    return file_fingerprint(path)
+
+
+def page_sizes(agreement):
+    # Upright (width, height) of every page, from the page index when the
+    # agreement has one.
+    entries = agreement.page_index
+    if entries is None:
+        entries = [page_entry(page) for page in PdfReader(agreement.document.path).pages]
+    return [visual_size(entry) for entry in entries]
+
+
+def page_range_dir(fingerprint):
+    return os.path.join('page_cache', fingerprint[:2], fingerprint)
+
+
+def page_range_name(fingerprint, first, last):
+    return os.path.join(page_range_dir(fingerprint), f'{first}-{last}.pdf')
+
+
+def pages_lock(fingerprint):
+    return file_lock(default_storage.path(os.path.join('locks', f'pages-{fingerprint}.lock')))
+
+
+def split_pages(path, first, last):
+    # Pages first to last, counted from 1, as a PDF of their own.
+    reader = PdfReader(path)
+    writer = PdfWriter()
+    for index in range(first - 1, last):
+        writer.add_page(reader.pages[index])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def page_range_path(agreement, first, last):
+    # Path of the cached PDF for pages first to last, splitting it out of
+    # the document if this is the first request for them.
+    path = agreement.document.path
+    fingerprint = document_fingerprint(agreement, path)
+    cached = default_storage.path(page_range_name(fingerprint, first, last))
+    if os.path.exists(cached):
+        return cached
+    with pages_lock(fingerprint):
+        if not os.path.exists(cached):
+            with metrics.span('split'):
+                content = split_pages(path, first, last)
+            _write_blob(cached, [content])
+    return cached
+
+
+def discard_pages(fingerprint):
+    with pages_lock(fingerprint):
+        shutil.rmtree(default_storage.path(page_range_dir(fingerprint)), ignore_errors=True)
+
+
+def discard_document_pages(agreement):
+    # Ranges split from the agreement's own copy of its document. A shared
+    # blob's ranges serve other agreements too and go with the blob.
+    if agreement.blob_id and agreement.document.name == blob_name(agreement.blob_id):
+        return
+    if agreement.document and os.path.exists(agreement.document.path):
+        discard_pages(file_fingerprint(agreement.document.path))
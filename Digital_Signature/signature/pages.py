@@ -0,0 +1,107 @@
+# signature/pages.py
+#
+# Reads an uploaded agreement once and records what stamping needs from it:
+# the page index (each page's mediabox, rotation and signature anchor
+# positions) and the 0-based indexes of the pages the agreement's
+# page-selection policy picks, None meaning every page.
+from PyPDF2 import PdfReader
+from .placement import page_entry
+import re
+
+STAMP_ALL = 'all'
+STAMP_LAST = 'last'
+STAMP_FIRST_LAST = 'first_last'
+STAMP_PAGE_LIST = 'pages'
+STAMP_ANCHOR = 'anchor'
+STAMP_PAGES_CHOICES = [
+    (STAMP_ALL, 'Every page'),
+    (STAMP_LAST, 'Last page'),
+    (STAMP_FIRST_LAST, 'First and last page'),
+    (STAMP_PAGE_LIST, 'Listed pages'),
+    (STAMP_ANCHOR, 'Pages containing a phrase'),
+]
+
+PAGE_RANGE_RE = re.compile(r'^(\d+)(?:-(\d+))?$')
+SHOW_TEXT_OPERATORS = (b'Tj', b'TJ', b"'", b'"')
+
+
+def parse_page_list(value, num_pages=None):
+    # "1, 3, 5-7" -> [1, 3, 5, 6, 7], page numbers counted from 1. Ranges are
+    # checked against num_pages before they are expanded.
+    numbers = set()
+    for part in value.split(','):
+        match = PAGE_RANGE_RE.match(part.strip())
+        if not match:
+            raise ValueError(f"Invalid page or page range: {part.strip()!r}")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid page or page range: {part.strip()!r}")
+        if num_pages is not None and last > num_pages:
+            raise ValueError(f"Page {last} is out of range 1-{num_pages}")
+        numbers.update(range(first, last + 1))
+    return sorted(numbers)
+
+
+def normalize_text(text):
+    return ' '.join(text.split()).casefold()
+
+
+def shown_text(operator, operands):
+    # Only simple fonts are decoded; text in composite fonts is not found.
+    strings = operands[0] if operator == b'TJ' else operands[-1:]
+    return ''.join(string.decode('latin-1') if isinstance(string, bytes) else str(string)
+                   for string in strings if isinstance(string, (bytes, str)))
+
+
+def index_page(page, anchor):
+    anchors = []
+    phrase = normalize_text(anchor)
+
+    def visit(operator, operands, cm, tm):
+        if phrase and operator in SHOW_TEXT_OPERATORS and phrase in normalize_text(shown_text(operator, operands)):
+            x, y = tm[4], tm[5]
+            anchors.append((round(x * cm[0] + y * cm[2] + cm[4], 2), round(x * cm[1] + y * cm[3] + cm[5], 2)))
+
+    text = page.extract_text(visitor_operand_before=visit)
+    return page_entry(page, anchors), text
+
+
+def select_pages(texts, policy, value=''):
+    num_pages = len(texts)
+    if policy == STAMP_ALL:
+        return None
+    if policy == STAMP_LAST:
+        return [num_pages - 1]
+    if policy == STAMP_FIRST_LAST:
+        return sorted({0, num_pages - 1})
+    if policy == STAMP_PAGE_LIST:
+        numbers = parse_page_list(value, num_pages)
+        return [number - 1 for number in numbers]
+    if policy == STAMP_ANCHOR:
+        phrase = normalize_text(value)
+        if not phrase:
+            raise ValueError('An anchor phrase is required')
+        indexes = [index for index, text in enumerate(texts) if phrase in normalize_text(text)]
+        if not indexes:
+            raise ValueError(f"No page contains {value!r}")
+        return indexes
+    raise ValueError(f"Unknown page selection policy: {policy!r}")
+
+
+def inspect_document(pdf_file, policy=STAMP_ALL, value='', anchor='', max_pages=None):
+    # Returns (page_index, stamp_page_indexes). The page count comes from
+    # the page tree, so an oversized document is refused before any page is
+    # read.
+    pages = PdfReader(pdf_file).pages
+    if not len(pages):
+        raise ValueError('The document has no pages')
+    if max_pages is not None and len(pages) > max_pages:
+        raise ValueError(f"The document has {len(pages)} pages, at most {max_pages} are accepted")
+    page_index = []
+    texts = []
+    for page in pages:
+        entry, text = index_page(page, anchor)
+        page_index.append(entry)
+        texts.append(text)
+    return page_index, select_pages(texts, policy, value)
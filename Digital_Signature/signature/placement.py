@@ -0,0 +1,79 @@
+# signature/placement.py
+#
+# Where a stamp lands on a page, worked out from the agreement's page index
+# (see signature/pages.py) rather than from the page itself. Slot positions
+# are offsets in the page's upright, as-displayed coordinates from the
+# bottom-left corner, or from the page's signature anchor when it has one;
+# stamp_matrix() turns them into the `cm` that draws the stamp upright on a
+# page of any size, origin or /Rotate.
+
+SIGNATURES_PER_ROW = 5
+HORIZONTAL_SPACING = 120
+VERTICAL_SPACING = 120
+X_OFFSET = 25
+Y_OFFSET = 25
+# Room below a slot's y position for the stamp's text lines.
+TEXT_DEPTH = 30
+# Distance from an anchor's baseline to the bottom of the first row of stamps.
+ANCHOR_GAP = 14
+
+
+def page_entry(page, anchors=()):
+    box = page.mediabox
+    return {
+        'mediabox': [float(box.left), float(box.bottom), float(box.right), float(box.top)],
+        'rotation': page.rotation % 360,
+        'anchors': [list(anchor) for anchor in anchors],
+    }
+
+
+def visual_size(entry):
+    left, bottom, right, top = entry['mediabox']
+    if entry['rotation'] in (90, 270):
+        return top - bottom, right - left
+    return right - left, top - bottom
+
+
+def to_visual(entry, x, y):
+    left, bottom, right, top = entry['mediabox']
+    return {
+        0: (x - left, y - bottom),
+        90: (y - bottom, right - x),
+        180: (right - x, top - y),
+        270: (top - y, x - left),
+    }[entry['rotation']]
+
+
+def slot_origin(entry):
+    # Visual point that slot positions are measured from: the bottom-left
+    # corner, or a point that puts the first row just above the anchor.
+    if not entry['anchors']:
+        return 0, 0
+    x, y = to_visual(entry, *entry['anchors'][0])
+    return x - X_OFFSET, y + ANCHOR_GAP + TEXT_DEPTH - Y_OFFSET
+
+
+def slots_per_row(entries, stamp_width):
+    # As many slots as fit across the narrowest page, capped at the
+    # original five.
+    per_row = SIGNATURES_PER_ROW
+    for entry in entries:
+        width = visual_size(entry)[0] - slot_origin(entry)[0]
+        per_row = min(per_row, int((width - X_OFFSET - stamp_width) // HORIZONTAL_SPACING) + 1)
+    return max(per_row, 1)
+
+
+def stamp_matrix(entry, x, y):
+    # cm operands that draw a stamp upright with its bottom-left corner at
+    # visual point (x, y).
+    left, bottom, right, top = entry['mediabox']
+    return {
+        0: (1, 0, 0, 1, left + x, bottom + y),
+        90: (0, 1, -1, 0, right - y, bottom + x),
+        180: (-1, 0, 0, -1, right - x, top - y),
+        270: (0, -1, 1, 0, left + y, top - x),
+    }[entry['rotation']]
+
+
+def format_matrix(matrix):
+    return ' '.join(f'{value:.3f}'.rstrip('0').rstrip('.') for value in matrix)
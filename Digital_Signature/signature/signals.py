@@ -0,0 +1,29 @@
+# signature/signals.py
+from django.db.models.signals import post_delete # type: ignore
+from django.dispatch import receiver # type: ignore
+from .blobs import release_blob
+from .lifecycle import cold_storage
+from .models import DocumentBlob, LoanAgreement
+from .pagecache import discard_document_pages, discard_pages
+
+
+@receiver(post_delete, sender=LoanAgreement)
+def release_agreement_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_delete, sender=LoanAgreement)
+def delete_archived_document(sender, instance, **kwargs):
+    if instance.archived_name:
+        cold_storage().delete(instance.archived_name)
+
+
+@receiver(post_delete, sender=LoanAgreement)
+def delete_document_pages(sender, instance, **kwargs):
+    discard_document_pages(instance)
+
+
+@receiver(post_delete, sender=DocumentBlob)
+def delete_blob_pages(sender, instance, **kwargs):
+    discard_pages(instance.sha256)
@@ -0,0 +1,178 @@
+# signature/signing.py
+from django.conf import settings # type: ignore
+from django.core.files.base import ContentFile # type: ignore
+from django.core.files.storage import default_storage # type: ignore
+from django.utils import timezone # type: ignore
+from . import audit, metrics
+from .blobs import ensure_private_document
+from .images import compact_signature, encode_png, open_image, read_data_url
+from .locks import agreement_lock
+from .models import AuditEntry, BorrowerSignature, StampingJob
+from .pagecache import discard_document_pages
+from .placement import HORIZONTAL_SPACING, VERTICAL_SPACING, X_OFFSET, Y_OFFSET, slots_per_row
+from .stamping import SIGNATURE_HEIGHT, SIGNATURE_WIDTH, SignatureStamp, composite_pdf, linearize, stamp_document, stamp_lines
+import os
+
+def stamped_entries(agreement):
+    if not agreement.page_index:
+        return []
+    if agreement.stamp_page_indexes is None:
+        return agreement.page_index
+    return [agreement.page_index[index] for index in agreement.stamp_page_indexes]
+
+
+def signature_slot(agreement):
+    signatures = BorrowerSignature.objects.filter(agreement=agreement).count()
+    per_row = slots_per_row(stamped_entries(agreement), SIGNATURE_WIDTH)
+    x_position = X_OFFSET + (signatures % per_row) * HORIZONTAL_SPACING
+    y_position = Y_OFFSET + (signatures // per_row) * VERTICAL_SPACING
+    return x_position, y_position
+
+
+def prepare_signature(signature_data_url):
+    # Rejects oversized payloads before decoding them and returns the
+    # compact image that is stored and stamped.
+    with metrics.span('decode'):
+        data = read_data_url(signature_data_url, settings.SIGNATURE_MAX_IMAGE_BYTES)
+        image = open_image(data, settings.SIGNATURE_MAX_IMAGE_PIXELS)
+        return compact_signature(image, SIGNATURE_WIDTH, SIGNATURE_HEIGHT)
+
+
+def add_signature(pdf_path, signature_image, loan_id, signature_instance, ip_address, timestamp, page_indexes=None, page_index=None):
+    stamp = SignatureStamp(
+        signature_image,
+        signature_instance.x_position,
+        signature_instance.y_position,
+        stamp_lines(loan_id, ip_address, timestamp),
+    )
+    stamp_document(pdf_path, [stamp], mode=settings.SIGNATURE_PDF_WRITE_MODE, page_indexes=page_indexes, page_index=page_index,
+                   engine=settings.SIGNATURE_PDF_ENGINE)
+
+
+def stamped_signatures(agreement):
+    # Signatures that still have to be stamped onto agreement.document.
+    # Signatures recorded before compositing was deferred have no stored
+    # image; they were burned into the document when they were made.
+    return agreement.signatures().filter(signature_image__isnull=False).exclude(signature_image='')
+
+
+def stamp_specs(agreement):
+    signatures = stamped_signatures(agreement).order_by('timestamp')
+    return [
+        (signature.signature_image.path, signature.x_position, signature.y_position,
+         stamp_lines(signature.loan_id, signature.ip_address, signature.timestamp))
+        for signature in signatures
+    ]
+
+
+def signed_document_name(agreement):
+    return f'signed_documents/{agreement.id}.pdf'
+
+
+def invalidate_signed_document(agreement):
+    if agreement.signed_document:
+        agreement.signed_document.delete(save=False)
+        agreement.signed_document = None
+        agreement.save(update_fields=['signed_document'])
+
+
+def signed_document_path(agreement):
+    output_path = default_storage.path(signed_document_name(agreement))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    return output_path
+
+
+def linearize_finished(agreement):
+    # Whether the composite being built is the agreement's final one.
+    return settings.SIGNATURE_LINEARIZE_FINISHED and agreement.is_fully_signed()
+
+
+def composite_agreement(agreement, finished=None):
+    # Builds the signed copy from the untouched original in one pass, with
+    # every recorded signature stamped at once. finished says whether every
+    # borrower has signed, if the caller already knows.
+    if finished is None:
+        finished = agreement.is_fully_signed()
+    composite_pdf(
+        agreement.document.path, signed_document_path(agreement), stamp_specs(agreement), settings.SIGNATURE_PDF_WRITE_MODE,
+        page_indexes=agreement.stamp_page_indexes, page_index=agreement.page_index, engine=settings.SIGNATURE_PDF_ENGINE,
+        linearized=finished and settings.SIGNATURE_LINEARIZE_FINISHED,
+    )
+    agreement.signed_document.name = signed_document_name(agreement)
+    agreement.save(update_fields=['signed_document'])
+    audit.record_signed_copy(agreement, agreement.signed_document.path)
+    return agreement.signed_document
+
+
+def signed_document(agreement):
+    if settings.SIGNATURE_STAMPING_MODE == 'immediate':
+        return agreement.document
+    if agreement.signed_document:
+        return agreement.signed_document
+    if not stamped_signatures(agreement).exists():
+        return agreement.document
+    with agreement_lock(agreement.id):
+        agreement.refresh_from_db(fields=['signed_document'])
+        if agreement.signed_document:
+            return agreement.signed_document
+        return composite_agreement(agreement)
+
+
+def stamping_status(agreement):
+    # None when nothing is queued for the agreement, otherwise the status of
+    # its most recent stamping job.
+    if settings.SIGNATURE_STAMPING_MODE != 'queued':
+        return None
+    job = StampingJob.objects.filter(agreement=agreement).order_by('-created_at').first()
+    return job.status if job else None
+
+
+def record_signature(agreement, borrower, signature_data_url, ip_address):
+    signature_image = prepare_signature(signature_data_url)
+    return record_prepared_signature(agreement, borrower, signature_image, encode_png(signature_image), ip_address)
+
+
+def record_prepared_signature(agreement, borrower, signature_image, signature_png, ip_address, composite=True):
+    # record_signature() for a drawing already decoded by prepare_signature(),
+    # so one drawing can be recorded on several agreements. With composite
+    # False the last signature of a deferred agreement leaves compositing to
+    # the caller.
+    with agreement_lock(agreement.id):
+        # A resubmitted form must not take a second slot.
+        existing = agreement.signatures().filter(borrower_name=borrower.name).first()
+        if existing is not None:
+            return existing
+
+        x_position, y_position = signature_slot(agreement)
+        signature_instance = BorrowerSignature(
+            agreement=agreement,
+            borrower_name=borrower.name,
+            loan_id=borrower.loan_id,
+            x_position=x_position,
+            y_position=y_position,
+            ip_address=ip_address,
+            timestamp=timezone.now(),
+        )
+        signature_instance.signature_image.save(f'{signature_instance.id}.png', ContentFile(signature_png), save=False)
+        signature_instance.save()
+
+        document_before = audit.document_sha256(agreement)
+        if settings.SIGNATURE_STAMPING_MODE == 'immediate':
+            # The version about to be stamped over is not shown again.
+            discard_document_pages(agreement)
+            document = ensure_private_document(agreement)
+            add_signature(document.path, signature_image, borrower.loan_id, signature_instance, ip_address, signature_instance.timestamp,
+                          agreement.stamp_page_indexes, agreement.page_index)
+            if linearize_finished(agreement):
+                linearize(document.path)
+            audit.record(AuditEntry.SIGNED, agreement.id, document_before, audit.file_fingerprint(document.path), signature_instance)
+            return signature_instance
+
+        # Nothing is written yet; the signed copy gets its own entry.
+        audit.record(AuditEntry.SIGNED, agreement.id, document_before, signature=signature_instance)
+        invalidate_signed_document(agreement)
+        if settings.SIGNATURE_STAMPING_MODE == 'queued':
+            StampingJob.objects.create(agreement=agreement, signature=signature_instance)
+        elif composite and agreement.is_fully_signed():
+            composite_agreement(agreement, finished=True)
+        return signature_instance
@@ -0,0 +1,185 @@
+# signature/stamping.py
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from PIL import Image
+from . import metrics
+from .images import compact_signature
+from .engines import DEFAULT_ENGINE, get_engine
+from .locks import file_lock
+from .placement import TEXT_DEPTH
+from contextlib import nullcontext
+import io
+import logging
+import math
+import os
+import shutil
+import tempfile
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+SIGNATURE_WIDTH = 80
+SIGNATURE_HEIGHT = 90
+FONT_NAME = 'Helvetica'
+FONT_SIZE = 12
+
+logger = logging.getLogger(__name__)
+_warned_no_pikepdf = False
+
+
+def load_signature(image_path):
+    with open(image_path, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+    return image
+
+
+def stamp_lines(loan_id, ip_address, timestamp):
+    return [loan_id, ip_address, timestamp.date().strftime('%Y-%m-%d'), timestamp.time().strftime('%H:%M:%S')]
+
+
+class SignatureStamp:
+    # One signer's stamp, drawn once with its origin at the bottom-left of
+    # the stamp rather than of the page; x_position and y_position are its
+    # slot, which signature/placement.py maps onto each page.
+    def __init__(self, signature_image, x_position, y_position, lines):
+        if signature_image.mode != 'LA':
+            # Signatures stored before preprocessing are full canvas exports.
+            signature_image = compact_signature(signature_image, SIGNATURE_WIDTH, SIGNATURE_HEIGHT)
+        self.image = ImageReader(signature_image)
+        self.lines = [str(line) for line in lines]
+        self.x_position = x_position
+        self.y_position = y_position
+        self.width = math.ceil(max([SIGNATURE_WIDTH] + [stringWidth(line, FONT_NAME, FONT_SIZE) for line in self.lines]))
+        self.height = TEXT_DEPTH + 10 + SIGNATURE_HEIGHT
+        self._overlay_pdf = None
+        self._overlay = None
+
+    @property
+    def overlay_pdf(self):
+        # The stamp as a one-page PDF of its own, for the engines to import.
+        if self._overlay_pdf is None:
+            with metrics.span('render'):
+                self._overlay_pdf = self._render()
+        return self._overlay_pdf
+
+    @property
+    def overlay(self):
+        if self._overlay is None:
+            overlay_pdf = self.overlay_pdf
+            with metrics.span('render'):
+                self._overlay = PdfReader(io.BytesIO(overlay_pdf)).pages[0]
+        return self._overlay
+
+    def _render(self):
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=(self.width, self.height))
+        can.setFont(FONT_NAME, FONT_SIZE)
+        can.drawImage(self.image, 0, TEXT_DEPTH + 10, width=SIGNATURE_WIDTH, height=SIGNATURE_HEIGHT,
+                      mask='auto', preserveAspectRatio=True, anchor='c')
+        text_y_position = TEXT_DEPTH + 20
+        for line_number, line in enumerate(self.lines, start=1):
+            can.drawString(0, text_y_position - 10 * line_number, line)
+        can.save()
+        return packet.getvalue()
+
+
+def _replace_atomically(pdf_path, write):
+    # Write next to the destination and swap it in so readers never see a
+    # half-written agreement.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pdf_path), suffix='.pdf.tmp')
+    try:
+        with os.fdopen(fd, 'w+b') as output_pdf:
+            write(output_pdf, tmp_path)
+            output_pdf.flush()
+            os.fsync(output_pdf.fileno())
+        os.replace(tmp_path, pdf_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def rewrite_with_stamps(engine, pdf_path, stamps, output_path, page_indexes=None, page_index=None):
+    with engine.open(pdf_path) as document:
+        with metrics.span('merge'):
+            document.stamp(stamps, page_indexes, page_index)
+
+        def write(output_pdf, tmp_path):
+            with metrics.span('write'):
+                document.save(output_pdf)
+            metrics.count('bytes_written', output_pdf.tell())
+        _replace_atomically(output_path, write)
+
+
+def append_stamps(engine, pdf_path, stamps, page_indexes=None, page_index=None):
+    with engine.open(pdf_path, incremental=True) as document:
+        with metrics.span('merge'):
+            document.stamp(stamps, page_indexes, page_index)
+        with metrics.span('write'):
+            written = document.save_incremental()
+    metrics.count('bytes_written', written)
+
+
+def append_stamps_to_copy(engine, pdf_path, stamps, output_path, page_indexes=None, page_index=None):
+    def write(output_pdf, tmp_path):
+        with metrics.span('write'), open(pdf_path, 'rb') as source:
+            shutil.copyfileobj(source, output_pdf)
+        metrics.count('bytes_written', output_pdf.tell())
+        output_pdf.flush()
+        append_stamps(engine, tmp_path, stamps, page_indexes, page_index)
+    _replace_atomically(output_path, write)
+
+
+def stamp_document(pdf_path, stamps, mode='rewrite', output_path=None, page_indexes=None, page_index=None, engine=DEFAULT_ENGINE):
+    # Applies every stamp in a single pass. Without output_path the
+    # agreement is stamped in place; without page_indexes every page is.
+    # page_index is the agreement's upload-time page index, if it has one;
+    # engine names the PDF library to use (see signature/engines/).
+    engine = get_engine(engine)
+    if mode == 'incremental':
+        if output_path is None or output_path == pdf_path:
+            append_stamps(engine, pdf_path, stamps, page_indexes, page_index)
+        else:
+            append_stamps_to_copy(engine, pdf_path, stamps, output_path, page_indexes, page_index)
+    elif mode == 'rewrite':
+        rewrite_with_stamps(engine, pdf_path, stamps, output_path or pdf_path, page_indexes, page_index)
+    else:
+        raise ValueError(f"Unknown PDF write mode: {mode!r}")
+
+
+def linearize(pdf_path):
+    # Rewrites a finished agreement linearized ("fast web view"): page one's
+    # objects and the hint tables come first, so a viewer fetching byte
+    # ranges can show it before the rest of the file arrives. Needs pikepdf;
+    # returns False, leaving the file as it is, without it.
+    global _warned_no_pikepdf
+    if pikepdf is None:
+        if not _warned_no_pikepdf:
+            _warned_no_pikepdf = True
+            logger.warning('SIGNATURE_LINEARIZE_FINISHED is on but pikepdf is not installed; signed copies are not linearized')
+        return False
+
+    def write(output_pdf, tmp_path):
+        with metrics.span('linearize'), pikepdf.open(pdf_path) as pdf:
+            pdf.save(output_pdf, linearize=True)
+    _replace_atomically(pdf_path, write)
+    return True
+
+
+def composite_pdf(pdf_path, output_path, stamp_specs, mode='rewrite', lock_path=None, page_indexes=None, page_index=None, engine=DEFAULT_ENGINE,
+                  linearized=False):
+    # Django-free entry point so it can run in a worker process. Each spec
+    # is (image_path, x_position, y_position, lines). linearized is set for
+    # the composite of a finished agreement.
+    stamps = [SignatureStamp(load_signature(image_path), x_position, y_position, lines)
+              for image_path, x_position, y_position, lines in stamp_specs]
+    with file_lock(lock_path) if lock_path else nullcontext():
+        stamp_document(pdf_path, stamps, mode=mode, output_path=output_path,
+                       page_indexes=page_indexes, page_index=page_index, engine=engine)
+        if linearized:
+            linearize(output_path)
+    return output_path
@@ -0,0 +1,56 @@
+# signature/synthetic.py
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from PIL import Image, ImageDraw
+import io
+import base64
+import random
+
+
+def make_scan(width, height, dpi, seed):
+    # A greyscale page image with paper noise and dark bars for lines of
+    # text, about the size a scanner produces.
+    size = (round(width * dpi / 72), round(height * dpi / 72))
+    image = Image.blend(Image.new('L', size, 255), Image.effect_noise(size, 24), 0.15)
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(seed)
+    line_height = dpi // 5
+    for top in range(dpi, size[1] - dpi, line_height):
+        draw.rectangle([dpi, top, dpi + rng.randint(size[0] // 2, size[0] - 2 * dpi), top + line_height // 3], fill=40)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=75)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+
+def make_agreement_pdf(num_pages, pagesize=letter, anchor_text=None, scan_dpi=None):
+    # anchor_text, if given, is written on the last page at (72, 200). With
+    # scan_dpi every page is an image instead, like a scanned agreement.
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=pagesize)
+    width, height = pagesize
+    for page_num in range(num_pages):
+        can.setFont('Helvetica', 10)
+        if scan_dpi:
+            can.drawImage(make_scan(width, height, scan_dpi, page_num), 0, 0, width=width, height=height)
+        else:
+            for line in range(40):
+                can.drawString(72, height - 72 - line * 14, f"Clause {page_num + 1}.{line + 1}: the borrower agrees to the terms set out herein.")
+        can.drawString(width - 120, 36, f"Page {page_num + 1} of {num_pages}")
+        if anchor_text and page_num == num_pages - 1:
+            can.drawString(72, 200, anchor_text)
+        can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def make_signature_data_url(width=600, height=200, strokes=12, seed=0):
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    points = [(rng.randint(width // 6, width * 5 // 6), rng.randint(height // 4, height * 3 // 4)) for _ in range(strokes)]
+    draw.line(points, fill='black', width=3)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
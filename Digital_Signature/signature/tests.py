@@ -1,3 +1,1474 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageFile
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2._page import PageObject
+from reportlab.lib.pagesizes import A4
+from unittest import mock, skipUnless
+import base64
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 
-# Create your tests here.
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+from . import audit, metrics
+from .engines import available_engines
+from .forms import LoanAgreementForm
+from .batch import pending_borrowers, process_context, start_batch
+from .blobs import attach_document
+from .bulk import import_agreements, iter_rows
+from .images import SIGNATURE_DPI, print_size
+from .lifecycle import archive_agreement
+from .pages import inspect_document, parse_page_list
+from .placement import stamp_matrix, to_visual
+from .locks import agreement_lock
+from .models import AuditCheckpoint, AuditEntry, BatchSigning, BatchSigningItem, BorrowerSignature, DocumentBlob, LoanAgreement, StampingJob, UploadSession
+from .signing import prepare_signature, record_prepared_signature, record_signature, signed_document, stamp_specs
+from .stamping import SIGNATURE_HEIGHT, SIGNATURE_WIDTH, SignatureStamp, composite_pdf, stamp_document
+from .synthetic import make_agreement_pdf, make_signature_data_url
+from . import uploads
+
+
+def create_agreement(num_borrowers, num_pages=3):
+    agreement = LoanAgreement.objects.create()
+    agreement.document.save('agreement.pdf', ContentFile(make_agreement_pdf(num_pages)))
+    for i in range(num_borrowers):
+        BorrowerSignature.objects.create(agreement=agreement, loan_id=f'LOAN-{i}', name=f'Borrower {i}', mobile_number=f'90000000{i:02d}')
+    return agreement
+
+
+def page_content(page):
+    contents = page['/Contents'].get_object()
+    streams = contents if isinstance(contents, list) else [contents]
+    return b''.join(stream.get_object().get_data() for stream in streams)
+
+
+def stamp_names(pdf_path):
+    # Synthetic agreements have no XObjects of their own, so every XObject on
+    # a page belongs to a signer's stamp.
+    return [sorted(page['/Resources'].get('/XObject', {})) for page in PdfReader(pdf_path).pages]
+
+
+class SignatureTestCase(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class AgreementLockTests(SignatureTestCase):
+    def test_lock_serializes_one_agreement_only(self):
+        acquired = {}
+
+        def acquire(agreement_id):
+            with agreement_lock(agreement_id):
+                acquired[agreement_id] = time.monotonic()
+
+        with agreement_lock('a'):
+            held_at = time.monotonic()
+            same = threading.Thread(target=acquire, args=('a',))
+            other = threading.Thread(target=acquire, args=('b',))
+            same.start()
+            other.start()
+            other.join(timeout=5)
+            self.assertIn('b', acquired)
+            self.assertNotIn('a', acquired)
+            time.sleep(0.2)
+        same.join(timeout=5)
+        self.assertGreaterEqual(acquired['a'] - held_at, 0.2)
+
+
+class ConcurrentSigningTests(SignatureTestCase):
+    num_agreements = 10
+    borrowers_per_agreement = 5
+
+    def sign_concurrently(self, workers=16):
+        agreements = [create_agreement(self.borrowers_per_agreement) for _ in range(self.num_agreements)]
+        tasks = [(agreement, borrower) for agreement in agreements for borrower in agreement.borrowers()]
+        # Every borrower submits twice, as if they double-clicked.
+        tasks = tasks * 2
+        random.Random(0).shuffle(tasks)
+
+        def sign(task):
+            agreement, borrower = task
+            try:
+                return record_signature(agreement, borrower, make_signature_data_url(seed=hash(borrower.name)), '10.0.0.1')
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(sign, tasks))
+        return agreements, len(tasks) / (time.monotonic() - started)
+
+    def assert_signed(self, agreement, pdf_path):
+        signatures = agreement.signatures()
+        self.assertEqual(signatures.count(), self.borrowers_per_agreement)
+        slots = set(signatures.values_list('x_position', 'y_position'))
+        self.assertEqual(len(slots), self.borrowers_per_agreement)
+        for names in stamp_names(pdf_path):
+            self.assertEqual(len(names), self.borrowers_per_agreement)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate', SIGNATURE_PDF_WRITE_MODE='incremental')
+    def test_immediate_incremental(self):
+        agreements, throughput = self.sign_concurrently()
+        for agreement in agreements:
+            self.assert_signed(agreement, agreement.document.path)
+        self.assertGreater(throughput, 1)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate', SIGNATURE_PDF_WRITE_MODE='rewrite')
+    def test_immediate_rewrite(self):
+        agreements, throughput = self.sign_concurrently()
+        for agreement in agreements:
+            self.assert_signed(agreement, agreement.document.path)
+        self.assertGreater(throughput, 1)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred', SIGNATURE_PDF_WRITE_MODE='incremental')
+    def test_deferred(self):
+        agreements, throughput = self.sign_concurrently()
+        for agreement in agreements:
+            agreement.refresh_from_db()
+            self.assert_signed(agreement, signed_document(agreement).path)
+            self.assertEqual(stamp_names(agreement.document.path)[0], [])
+        self.assertGreater(throughput, 1)
+
+
+class SigningModeTests(SignatureTestCase):
+    def sign_all(self, agreement, after_each=None):
+        for i, borrower in enumerate(agreement.borrowers()):
+            record_signature(agreement, borrower, make_signature_data_url(seed=i), '10.0.0.1')
+            if after_each:
+                after_each()
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate', SIGNATURE_PDF_WRITE_MODE='incremental', SIGNATURE_LINEARIZE_FINISHED=False)
+    def test_incremental_saves_append_to_the_original_bytes(self):
+        agreement = create_agreement(3)
+        versions = []
+
+        def snapshot():
+            agreement.refresh_from_db()
+            with open(agreement.document.path, 'rb') as f:
+                versions.append(f.read())
+
+        snapshot()
+        self.sign_all(agreement, snapshot)
+        for before, after in zip(versions, versions[1:]):
+            self.assertGreater(len(after), len(before))
+            self.assertTrue(after.startswith(before))
+            self.assertIn(b'/Prev %d' % int(re.findall(rb'startxref\s+(\d+)', before)[-1]), after[len(before):])
+        self.assertEqual(stamp_names(agreement.document.path), [['/DSStamp0', '/DSStamp1', '/DSStamp2']] * 3)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_deferred_composites_once_after_the_last_signer(self):
+        agreement = create_agreement(3)
+        with open(agreement.document.path, 'rb') as f:
+            original = f.read()
+        calls = []
+        with mock.patch('signature.signing.composite_pdf', wraps=composite_pdf) as composite:
+            self.sign_all(agreement, lambda: calls.append(composite.call_count))
+        self.assertEqual(calls, [0, 0, 1])
+
+        agreement.refresh_from_db()
+        self.assertEqual(composite.call_args.args[2], stamp_specs(agreement))
+        self.assertEqual(stamp_names(agreement.signed_document.path), [['/DSStamp0', '/DSStamp1', '/DSStamp2']] * 3)
+        with open(agreement.document.path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_legacy_signatures_are_already_in_the_document(self):
+        # Signed before compositing was deferred: stamped into the document
+        # in place, with no stored image.
+        agreement = create_agreement(2)
+        legacy, borrower = agreement.borrowers()
+        with override_settings(SIGNATURE_STAMPING_MODE='immediate', SIGNATURE_LINEARIZE_FINISHED=False):
+            record_signature(agreement, legacy, make_signature_data_url(), '10.0.0.1')
+        signature = agreement.signatures().get()
+        signature.signature_image.delete(save=False)
+        BorrowerSignature.objects.filter(pk=signature.pk).update(signature_image=None)
+        args = [agreement.id, legacy.id]
+
+        response = self.client.get(reverse('view_signed_agreement', args=args))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stamp_names(io.BytesIO(b''.join(response.streaming_content))), [['/DSStamp0']] * 3)
+
+        record_signature(agreement, borrower, make_signature_data_url(seed=1), '10.0.0.2')
+        agreement.refresh_from_db()
+        response = self.client.get(reverse('view_signed_agreement', args=args))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(stamp_specs(agreement)), 1)
+        self.assertEqual([len(names) for names in stamp_names(agreement.signed_document.path)], [2] * 3)
+
+
+@override_settings(SIGNATURE_STAMPING_MODE='deferred')
+class SignedAgreementDeliveryTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(2)
+        self.borrowers = list(self.agreement.borrowers())
+        record_signature(self.agreement, self.borrowers[0], make_signature_data_url(), '10.0.0.1')
+        self.url = reverse('view_signed_agreement', args=[self.agreement.id, self.borrowers[0].id])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        record_signature(self.agreement, self.borrowers[1], make_signature_data_url(seed=1), '10.0.0.2')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # Finished, but the lifecycle job may still recompress it in place.
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        self.agreement.refresh_from_db()
+        archive_agreement(self.agreement, move=False)
+        response = self.client.get(self.url)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_byte_ranges(self):
+        body = b''.join(self.client.get(self.url).streaming_content)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-99/{len(body)}')
+        self.assertEqual(b''.join(response.streaming_content), body[:100])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-50')
+        self.assertEqual(b''.join(response.streaming_content), body[-50:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(body)}-')
+        self.assertEqual(response.status_code, 416)
+
+
+class DocumentBlobTests(SignatureTestCase):
+    def upload(self, agreement, content):
+        return self.client.post(reverse('loan_process'), {
+            'step': 'upload_agreement',
+            'agreement_id': agreement.id,
+            'document': SimpleUploadedFile('agreement.pdf', content, content_type='application/pdf'),
+        })
+
+    def test_identical_uploads_share_one_blob(self):
+        content = make_agreement_pdf(2)
+        first, second = LoanAgreement.objects.create(), LoanAgreement.objects.create()
+        self.upload(first, content)
+        self.upload(second, content)
+        first.refresh_from_db()
+        second.refresh_from_db()
+
+        blob = DocumentBlob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(first.document.name, second.document.name)
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        second.delete()
+        self.assertFalse(DocumentBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate')
+    def test_signing_in_place_copies_on_write(self):
+        content = make_agreement_pdf(2)
+        first, second = create_agreement(1), create_agreement(1)
+        self.upload(first, content)
+        self.upload(second, content)
+        first.refresh_from_db()
+
+        record_signature(first, first.borrowers().get(), make_signature_data_url(), '10.0.0.1')
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNone(first.blob)
+        self.assertEqual(len(stamp_names(first.document.path)[0]), 1)
+        self.assertEqual(stamp_names(second.document.path)[0], [])
+        self.assertEqual(second.blob.ref_count, 1)
+
+
+class BulkImportTests(SignatureTestCase):
+    csv_rows = (
+        'agreement,loan_id,name,mobile_number\n'
+        'A1,L1,Asha,9000000001\n'
+        'A1,L1,Ravi,9000000002\n'
+        'A2,L2,Meera,9000000003\n'
+        'A3,L3,,9000000004\n'
+        'A4,L4,Kiran,9000000005\n'
+    )
+
+    def test_csv_import_in_batches(self):
+        document = SimpleUploadedFile('agreement.pdf', make_agreement_pdf(1))
+        result = import_agreements(iter_rows(io.BytesIO(self.csv_rows.encode()), 'csv'), document=document, batch_size=2)
+
+        self.assertEqual((result.agreements, result.borrowers, result.error_count), (3, 4, 1))
+        self.assertEqual(result.errors[0][0], 4)
+        self.assertEqual(sorted(LoanAgreement.objects.values_list('borrower', flat=True)), ['Asha', 'Kiran', 'Meera'])
+        self.assertEqual(LoanAgreement.objects.get(borrower='Asha').borrowers().count(), 2)
+        self.assertEqual(DocumentBlob.objects.get().ref_count, 3)
+
+    def test_json_array_and_lines_stream_across_chunks(self):
+        rows = [{'loan_id': f'L{i}', 'name': f'Borrower {i}', 'mobile_number': '9000000000'} for i in range(20)]
+        with mock.patch('signature.bulk.CHUNK_SIZE', 7):
+            array = list(iter_rows(io.BytesIO(json.dumps(rows).encode()), 'json'))
+            lines = list(iter_rows(io.BytesIO('\n'.join(map(json.dumps, rows)).encode()), 'json'))
+        self.assertEqual(array, rows)
+        self.assertEqual(lines, rows)
+
+    def test_bulk_import_view(self):
+        response = self.client.post(reverse('bulk_import'), {
+            'file': SimpleUploadedFile('borrowers.csv', self.csv_rows.encode()),
+            'format': 'auto',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Imported 3 agreements with 4 borrowers')
+
+    def test_unreadable_files_are_reported(self):
+        rows = [{'loan_id': f'L{i}', 'name': f'Borrower {i}', 'mobile_number': '9000000000'} for i in range(3)]
+        valid = '\n'.join(map(json.dumps, rows))
+        cases = {
+            'malformed json': (valid + '\n{"loan_id": ', 'json', 2, 'Invalid JSON'),
+            'oversized record': (valid + '\n[' + '1, ' * 200, 'json', 2, 'longer than'),
+            'not utf-8': (self.csv_rows + 'A5,L5,K\xe9ran,9000000006\n', 'csv', 0, 'before the first record: The file is not UTF-8'),
+        }
+        for case, (text, fmt, agreements, message) in cases.items():
+            with self.subTest(case=case), mock.patch('signature.bulk.CHUNK_SIZE', 16), mock.patch('signature.bulk.MAX_RECORD_CHARS', 256):
+                LoanAgreement.objects.all().delete()
+                data = text.encode('latin-1') if fmt == 'csv' else text.encode()
+                result = import_agreements(iter_rows(io.BytesIO(data), fmt), batch_size=1000)
+                self.assertIn(message, result.file_error)
+                self.assertEqual(result.agreements, agreements)
+
+    def test_non_object_records_are_rejected(self):
+        result = import_agreements(iter_rows(io.BytesIO(b'[1, {"loan_id": "L1", "name": "Asha", "mobile_number": "9000000001"}, 2]'), 'json'))
+        self.assertEqual((result.agreements, result.error_count, result.file_error), (1, 2, ''))
+        self.assertEqual([record for record, _ in result.errors], [1, 3])
+
+        response = self.client.post(reverse('bulk_import'), {
+            'file': SimpleUploadedFile('borrowers.json', b'{"loan_id": "L2", "name": "Ravi", "mobile_number": "9000000002"} {"loan_id": "L3"} [1, 2'),
+            'format': 'auto',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Imported 1 agreements with 1 borrowers')
+        self.assertContains(response, 'Stopped after record 1: Invalid JSON')
+
+    def test_document_is_checked_and_stored_only_when_used(self):
+        response = self.client.post(reverse('bulk_import'), {
+            'file': SimpleUploadedFile('borrowers.csv', self.csv_rows.encode()),
+            'format': 'auto',
+            'document': SimpleUploadedFile('agreement.pdf', b'not a pdf'),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LoanAgreement.objects.exists())
+
+        document = SimpleUploadedFile('agreement.pdf', make_agreement_pdf(1))
+        result = import_agreements(iter_rows(io.BytesIO(b'agreement,loan_id,name,mobile_number\nA1,L1,,1\n'), 'csv'), document=document)
+        self.assertEqual((result.agreements, result.error_count), (0, 1))
+        self.assertFalse(DocumentBlob.objects.exists())
+
+        broken = SimpleUploadedFile('agreement.pdf', b'%PDF-1.4\nbroken\n%%EOF\n')
+        result = import_agreements(iter_rows(io.BytesIO(self.csv_rows.encode()), 'csv'), document=broken)
+        self.assertIn('cannot be used', result.file_error)
+        self.assertFalse(LoanAgreement.objects.exists())
+
+
+class ExportLinksTests(SignatureTestCase):
+    def test_streams_every_borrower_including_duplicate_names(self):
+        agreement = create_agreement(0)
+        for mobile_number in ('9000000001', '9000000002'):
+            BorrowerSignature.objects.create(agreement=agreement, loan_id='L1', name='Asha', mobile_number=mobile_number)
+        other = create_agreement(1)
+
+        response = self.client.get(reverse('export_links'), {'format': 'csv', 'agreement_id': agreement.id})
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(sorted(row['mobile_number'] for row in rows), ['9000000001', '9000000002'])
+        for row in rows:
+            borrower = BorrowerSignature.objects.get(mobile_number=row['mobile_number'])
+            self.assertTrue(row['link'].endswith(reverse('view_original_document', args=[agreement.id, borrower.id])))
+
+        response = self.client.get(reverse('export_links'), {'format': 'jsonl'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual({json.loads(line)['agreement'] for line in lines}, {str(agreement.id), str(other.id)})
+
+
+@override_settings(SIGNATURE_STAMPING_MODE='deferred')
+class SigningQueryCountTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(2)
+        self.borrower = self.agreement.borrowers().first()
+        self.args = [self.agreement.id, self.borrower.id]
+
+    def test_signing_views(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('view_original_document', args=self.args))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('sign_agreement', args=self.args))
+        with self.assertNumQueries(7):
+            self.client.post(reverse('sign_agreement', args=self.args), {'signature': make_signature_data_url()})
+        with self.assertNumQueries(1):
+            self.client.get(reverse('sign_agreement_success', args=self.args))
+        self.client.get(reverse('view_signed_agreement', args=self.args))
+        with self.assertNumQueries(1):
+            self.client.get(reverse('view_signed_agreement', args=self.args))
+
+    def test_signature_lookups_use_composite_index(self):
+        plan = BorrowerSignature.objects.filter(agreement=self.agreement, borrower_name=self.borrower.name).explain()
+        self.assertIn('sig_agreement_borrower_idx', plan)
+
+
+@override_settings(SIGNATURE_STAMPING_MODE='queued')
+class QueuedStampingTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(2)
+        self.borrower = self.agreement.borrowers().first()
+        self.args = [self.agreement.id, self.borrower.id]
+        self.client.post(reverse('sign_agreement', args=self.args), {'signature': make_signature_data_url()})
+
+    def drain(self, *args):
+        stdout = io.StringIO()
+        call_command('process_stamping_jobs', '--once', '--workers', '1', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_worker_publishes_the_signed_copy(self):
+        job = StampingJob.objects.get()
+        self.assertEqual(job.status, StampingJob.PENDING)
+        self.assertFalse(LoanAgreement.objects.get(pk=self.agreement.id).signed_document)
+        self.assertContains(self.client.get(reverse('sign_agreement_success', args=self.args)), 'Signed document status: pending')
+        response = self.client.get(reverse('view_signed_agreement', args=self.args))
+        self.assertContains(response, 'being prepared (pending)', status_code=202)
+
+        self.assertIn('1 job(s) done', self.drain())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (StampingJob.DONE, ''))
+        agreement = LoanAgreement.objects.get(pk=self.agreement.id)
+        self.assertTrue(agreement.signed_document)
+        self.assertEqual(stamp_names(agreement.signed_document.path), [['/DSStamp0']] * 3)
+        self.assertEqual(stamp_names(agreement.document.path)[0], [])
+        self.assertContains(self.client.get(reverse('sign_agreement_success', args=self.args)), 'Signed document status: done')
+        response = self.client.get(reverse('view_signed_agreement', args=self.args))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stamp_names(io.BytesIO(b''.join(response.streaming_content))), [['/DSStamp0']] * 3)
+
+    def test_stale_running_job_is_requeued(self):
+        StampingJob.objects.update(status=StampingJob.RUNNING)
+        StampingJob.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        output = self.drain('--stale-after', '60')
+        self.assertIn('Requeued 1 stale job(s)', output)
+        self.assertEqual(StampingJob.objects.get().status, StampingJob.DONE)
+        self.assertTrue(LoanAgreement.objects.get(pk=self.agreement.id).signed_document)
+
+    def test_failed_composite(self):
+        os.remove(self.agreement.document.path)
+        self.assertIn('1 job(s) failed', self.drain())
+        job = StampingJob.objects.get()
+        self.assertEqual(job.status, StampingJob.FAILED)
+        self.assertTrue(job.error.startswith('FileNotFoundError'))
+        self.assertFalse(LoanAgreement.objects.get(pk=self.agreement.id).signed_document)
+        self.assertContains(self.client.get(reverse('sign_agreement_success', args=self.args)), 'Signed document status: failed')
+        response = self.client.get(reverse('view_signed_agreement', args=self.args))
+        self.assertContains(response, 'could not prepare the signed agreement', status_code=500)
+
+
+class SignatureImageTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(1)
+        self.borrower = self.agreement.borrowers().get()
+        self.url = reverse('sign_agreement', args=[self.agreement.id, self.borrower.id])
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate')
+    def test_stores_cropped_greyscale_with_alpha(self):
+        data_url = make_signature_data_url(1200, 400)
+        self.client.post(self.url, {'signature': data_url})
+
+        signature = self.agreement.signatures().get()
+        with Image.open(signature.signature_image.path) as image:
+            self.assertEqual(image.mode, 'LA')
+            max_width, max_height = print_size(SIGNATURE_WIDTH, SIGNATURE_HEIGHT, SIGNATURE_DPI)
+            self.assertLessEqual(image.width, max_width)
+            self.assertLessEqual(image.height, max_height)
+            self.assertEqual(image.getchannel('A').getextrema()[0], 0)
+        self.assertLess(signature.signature_image.size, len(data_url) / 3)
+        self.assertEqual(len(stamp_names(self.agreement.document.path)[0]), 1)
+
+    def test_rejects_oversized_payloads(self):
+        with override_settings(SIGNATURE_MAX_IMAGE_BYTES=1000):
+            response = self.client.post(self.url, {'signature': make_signature_data_url()})
+        self.assertEqual(response.status_code, 400)
+
+        buffer = io.BytesIO()
+        Image.new('L', (5000, 5000), 255).save(buffer, format='PNG')
+        bomb = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+        with mock.patch.object(ImageFile.ImageFile, 'load') as load:
+            response = self.client.post(self.url, {'signature': bomb})
+        self.assertEqual(response.status_code, 400)
+        load.assert_not_called()
+
+        response = self.client.post(self.url, {'signature': make_signature_data_url(strokes=0)})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.agreement.signatures().exists())
+
+    def test_rejects_non_ascii_payloads(self):
+        signature = 'data:image/png;base64,\u00e9AAA'
+        response = self.client.post(self.url, {'signature': signature})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('batch_sign', args=[self.agreement.id, self.borrower.id]), {'signature': signature, 'acknowledge_checkbox': 'on'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.agreement.signatures().exists())
+
+
+class SharedStampTests(SignatureTestCase):
+    def assert_shared(self, mode):
+        num_pages = 12
+        pdf_path = f'{self.media_root}/{mode}.pdf'
+        with open(pdf_path, 'wb') as f:
+            f.write(make_agreement_pdf(num_pages))
+        stamps = [
+            SignatureStamp(prepare_signature(make_signature_data_url(seed=i)), 25 + 120 * i, 25, [f'LOAN-{i}', '10.0.0.1', '2026-01-01', '12:00:00'])
+            for i in range(2)
+        ]
+        stamp_document(pdf_path, stamps, mode=mode)
+
+        reader = PdfReader(pdf_path)
+        forms = {
+            tuple(page['/Resources']['/XObject'].raw_get(name).idnum for name in sorted(page['/Resources']['/XObject']))
+            for page in reader.pages
+        }
+        self.assertEqual(len(forms), 1)
+        images = set()
+        for form_ref in forms.pop():
+            form = reader.get_object(form_ref)
+            self.assertEqual(form['/BBox'][:2], [0, 0])
+            images.update(ref.idnum for ref in form['/Resources']['/XObject'].values())
+        self.assertEqual(len(images), 2)
+        self.assertIn(b'cm /DSStamp1 Do', reader.pages[-1]['/Contents'][-1].get_object().get_data())
+
+    def test_rewrite_shares_one_form_per_signer(self):
+        self.assert_shared('rewrite')
+
+    def test_incremental_shares_one_form_per_signer(self):
+        self.assert_shared('incremental')
+
+    def test_stamps_land_on_the_selected_pages(self):
+        writer = PdfWriter()
+        for content in (make_agreement_pdf(1), make_agreement_pdf(2, pagesize=A4)):
+            for page in PdfReader(io.BytesIO(content)).pages:
+                writer.add_page(page)
+        writer.pages[1].mediabox.lower_left = (10, 20)
+        document = io.BytesIO()
+        writer.write(document)
+        original = PdfReader(io.BytesIO(document.getvalue())).pages
+        stamps = [
+            SignatureStamp(prepare_signature(make_signature_data_url(seed=i)), 25 + 120 * i, 25, [f'LOAN-{i}', '10.0.0.1', '2026-01-01', '12:00:00'])
+            for i in range(2)
+        ]
+        for mode in ('rewrite', 'incremental'):
+            with self.subTest(mode=mode):
+                pdf_path = f'{self.media_root}/{mode}.pdf'
+                with open(pdf_path, 'wb') as f:
+                    f.write(document.getvalue())
+                stamp_document(pdf_path, stamps, mode=mode, page_indexes=[0, 1])
+
+                pages = PdfReader(pdf_path).pages
+                self.assertEqual(stamp_names(pdf_path), [['/DSStamp0', '/DSStamp1']] * 2 + [[]])
+                # Slots are measured from each page's own bottom-left corner,
+                # 30pt of text below the slot's y position.
+                self.assertIn(b'q 1 0 0 1 25 -5 cm /DSStamp0 Do Q\nq 1 0 0 1 145 -5 cm /DSStamp1 Do Q', page_content(pages[0]))
+                self.assertIn(b'q 1 0 0 1 35 15 cm /DSStamp0 Do Q\nq 1 0 0 1 155 15 cm /DSStamp1 Do Q', page_content(pages[1]))
+                for page, before in zip(pages, original):
+                    self.assertIn(page_content(before), page_content(page))
+                self.assertEqual(page_content(pages[2]), page_content(original[2]))
+
+
+class PageSelectionTests(SignatureTestCase):
+    def upload(self, agreement, policy, value=''):
+        return self.client.post(reverse('loan_process'), {
+            'step': 'upload_agreement',
+            'agreement_id': agreement.id,
+            'document': SimpleUploadedFile('agreement.pdf', make_agreement_pdf(5), content_type='application/pdf'),
+            'stamp_pages': policy,
+            'stamp_pages_value': value,
+        })
+
+    def test_policies(self):
+        document = io.BytesIO(make_agreement_pdf(5))
+
+        def select(policy, value=''):
+            document.seek(0)
+            return inspect_document(document, policy, value)[1]
+
+        self.assertIsNone(select('all'))
+        self.assertEqual(select('last'), [4])
+        self.assertEqual(select('first_last'), [0, 4])
+        self.assertEqual(select('pages', '2, 4-5'), [1, 3, 4])
+        self.assertEqual(select('anchor', 'page 3   of 5'), [2])
+        self.assertEqual(parse_page_list('3,1-2,2'), [1, 2, 3])
+        with self.assertRaises(ValueError):
+            select('pages', '6')
+        with self.assertRaises(ValueError):
+            parse_page_list('2-1')
+
+    def test_ranges_are_bounded_before_they_are_expanded(self):
+        started = time.monotonic()
+        with self.assertRaisesMessage(ValueError, 'Page 30000000000 is out of range 1-5'):
+            parse_page_list('1-30000000000', 5)
+        form = LoanAgreementForm(
+            {'stamp_pages': 'pages', 'stamp_pages_value': '1-30000000000'},
+            {'document': SimpleUploadedFile('agreement.pdf', make_agreement_pdf(1), content_type='application/pdf')},
+        )
+        self.assertEqual(form.errors['stamp_pages_value'], [f'Page 30000000000 is out of range 1-{settings.SIGNATURE_MAX_UPLOAD_PAGES}'])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_only_selected_pages_are_stamped(self):
+        for mode in ('incremental', 'rewrite'):
+            with self.subTest(mode=mode), override_settings(SIGNATURE_STAMPING_MODE='deferred', SIGNATURE_PDF_WRITE_MODE=mode):
+                agreement = create_agreement(2)
+                self.upload(agreement, 'pages', '2,4')
+                agreement.refresh_from_db()
+                self.assertEqual(agreement.stamp_page_indexes, [1, 3])
+                for i, borrower in enumerate(agreement.borrowers()):
+                    record_signature(agreement, borrower, make_signature_data_url(seed=i), '10.0.0.1')
+                agreement.refresh_from_db()
+
+                signed = PdfReader(agreement.signed_document.path)
+                original = PdfReader(agreement.document.path)
+                self.assertEqual([len(names) for names in stamp_names(agreement.signed_document.path)], [0, 2, 0, 2, 0])
+                for index in (0, 2, 4):
+                    self.assertEqual(signed.pages[index].get_contents().get_data(), original.pages[index].get_contents().get_data())
+
+    def test_rejects_unresolvable_policy(self):
+        agreement = create_agreement(1)
+        response = self.upload(agreement, 'anchor', 'Borrower Signature')
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'No page contains', status_code=400)
+        agreement.refresh_from_db()
+        self.assertEqual(agreement.document.name, 'documents/agreement.pdf')
+
+
+class PageIndexTests(SignatureTestCase):
+    def upload(self, agreement, content):
+        return self.client.post(reverse('loan_process'), {
+            'step': 'upload_agreement',
+            'agreement_id': agreement.id,
+            'document': SimpleUploadedFile('agreement.pdf', content, content_type='application/pdf'),
+        })
+
+    def test_upload_indexes_pages_and_anchors(self):
+        agreement = create_agreement(1)
+        self.upload(agreement, make_agreement_pdf(3, pagesize=A4, anchor_text='Borrower Signature:'))
+        agreement.refresh_from_db()
+
+        self.assertEqual(len(agreement.page_index), 3)
+        entry = agreement.page_index[-1]
+        self.assertEqual([round(v, 2) for v in entry['mediabox']], [0, 0, round(A4[0], 2), round(A4[1], 2)])
+        self.assertEqual(entry['rotation'], 0)
+        self.assertEqual(entry['anchors'], [[72, 200]])
+        self.assertEqual(agreement.page_index[0]['anchors'], [])
+
+    def test_stamp_matrix_is_upright_for_every_rotation(self):
+        for rotation in (0, 90, 180, 270):
+            entry = {'mediabox': [10, 20, 610, 820], 'rotation': rotation, 'anchors': []}
+            a, b, c, d, e, f = stamp_matrix(entry, 30, 40)
+            self.assertEqual(to_visual(entry, e, f), (30, 40))
+            # The stamp's x and y axes point right and up as displayed.
+            right = to_visual(entry, e + a, f + b)
+            up = to_visual(entry, e + c, f + d)
+            self.assertEqual((right[0] - 30, right[1] - 40), (1, 0))
+            self.assertEqual((up[0] - 30, up[1] - 40), (0, 1))
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_signing_places_stamps_from_the_index(self):
+        writer = PdfWriter()
+        for page in PdfReader(io.BytesIO(make_agreement_pdf(2, pagesize=A4, anchor_text='Borrower Signature'))).pages:
+            writer.add_page(page)
+        writer.pages[0].rotate(90)
+        content = io.BytesIO()
+        writer.write(content)
+
+        agreement = create_agreement(1)
+        self.upload(agreement, content.getvalue())
+        agreement.refresh_from_db()
+        with mock.patch.object(PageObject, 'extract_text', side_effect=AssertionError('document re-scanned')):
+            record_signature(agreement, agreement.borrowers().get(), make_signature_data_url(), '10.0.0.1')
+            agreement.refresh_from_db()
+            pages = PdfReader(signed_document(agreement).path).pages
+
+        draws = [page['/Contents'][-1].get_object().get_data() for page in pages]
+        x_position = agreement.signatures().get().x_position
+        # Rotated first page: stamp bottom 5pt below the displayed bottom edge
+        # (x = page width + 5), turned a quarter turn to read upright.
+        self.assertIn(f'q 0 1 -1 0 600.276 {x_position} cm /DSStamp0 Do'.encode(), draws[0])
+        # Last page: slots laid out from the anchor, first row just above it.
+        self.assertIn(f'q 1 0 0 1 {72 - 25 + x_position} 214 cm /DSStamp0 Do'.encode(), draws[1])
+
+
+class BenchmarkPipelineTests(SignatureTestCase):
+    def test_json_results_and_comparison(self):
+        results_path = f'{self.media_root}/results.json'
+        options = {'pages': [2], 'signers': [1, 2], 'mode': ['incremental', 'rewrite'], 'engine': ['pypdf2'], 'repeat': 1, 'stdout': io.StringIO()}
+        call_command('benchmark_pipeline', json_path=results_path, **options)
+        with open(results_path) as f:
+            cases = json.load(f)['cases']
+
+        self.assertEqual(len(cases), 4)
+        for case in cases:
+            self.assertEqual(set(case['stages_ms']), {'decode', 'render', 'merge', 'write'})
+            self.assertGreater(case['peak_kib'], 0)
+            self.assertGreater(case['output_bytes'], case['input_bytes'])
+
+        call_command('benchmark_pipeline', compare=results_path, **options)
+        self.assertIn('vs total', options['stdout'].getvalue())
+
+
+class MetricsTests(SignatureTestCase):
+    def test_disabled_by_default(self):
+        self.assertIs(metrics.span('decode'), metrics.span('render'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(SIGNATURE_METRICS_ENABLED=True, SIGNATURE_STAMPING_MODE='deferred', SIGNATURE_PDF_WRITE_MODE='incremental',
+                       SIGNATURE_LINEARIZE_FINISHED=False)
+    def test_signing_request_is_timed_and_exported(self):
+        metrics.reset()
+        metrics.configure(True)
+        self.addCleanup(metrics.configure, False)
+        self.addCleanup(metrics.reset)
+        agreement = create_agreement(1)
+        borrower = agreement.borrowers().get()
+
+        with self.assertLogs('signature.metrics', 'INFO') as logs:
+            self.client.post(reverse('sign_agreement', args=[agreement.id, borrower.id]), {'signature': make_signature_data_url()})
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['view'], record['status']), ('sign_agreement', 302))
+        self.assertEqual(set(record['stages_ms']), {'decode', 'render', 'merge', 'write', 'db'})
+        self.assertEqual(record['counters']['pages_stamped'], 3)
+        self.assertGreater(record['counters']['bytes_written'], 0)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('signature_stage_seconds_count{stage="decode"} 1', body)
+        self.assertIn('signature_request_seconds_count{method="POST",view="sign_agreement"} 1', body)
+        self.assertIn('signature_pages_stamped_total 3', body)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 404)
+
+
+class OriginalDocumentPagesTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(1, num_pages=5)
+        self.args = [self.agreement.id, self.agreement.borrowers().get().id]
+
+    def get_pages(self, pages, **extra):
+        return self.client.get(reverse('original_document_pages', args=self.args + [pages]), **extra)
+
+    def test_pages_are_split_once_and_cached(self):
+        response = self.get_pages('2-3')
+        self.assertEqual(response.status_code, 200)
+        reader = PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(reader.pages), 2)
+        self.assertIn('Page 2', reader.pages[0].extract_text())
+
+        with mock.patch('signature.pagecache.split_pages') as split_pages:
+            response = self.get_pages('2-3', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        split_pages.assert_not_called()
+
+    def test_changed_document_gets_new_pages(self):
+        first = self.get_pages('5')['ETag']
+        with self.agreement.document.open('wb') as f:
+            f.write(make_agreement_pdf(5, anchor_text='Borrower Signature'))
+        response = self.get_pages('5')
+        self.assertNotEqual(response['ETag'], first)
+        self.assertIn('Borrower Signature', PdfReader(io.BytesIO(b''.join(response.streaming_content))).pages[0].extract_text())
+
+    def cached_ranges(self):
+        root = os.path.join(self.media_root, 'page_cache')
+        return sorted(name for _, _, names in os.walk(root) for name in names)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate')
+    def test_cached_pages_are_discarded_with_their_document(self):
+        self.get_pages('1')
+        self.get_pages('2-3')
+        self.assertEqual(self.cached_ranges(), ['1-1.pdf', '2-3.pdf'])
+        record_signature(self.agreement, self.agreement.borrowers().get(), make_signature_data_url(), '10.0.0.1')
+        self.assertEqual(self.cached_ranges(), [])
+
+        self.get_pages('1')
+        self.agreement.refresh_from_db()
+        archive_agreement(self.agreement, move=False)
+        self.assertEqual(self.cached_ranges(), [])
+
+        self.get_pages('1')
+        self.agreement.delete()
+        self.assertEqual(self.cached_ranges(), [])
+
+    def test_shared_blob_pages_go_with_the_blob(self):
+        content = make_agreement_pdf(2)
+        agreements = [create_agreement(1) for _ in range(2)]
+        for agreement in agreements:
+            attach_document(agreement, SimpleUploadedFile('agreement.pdf', content))
+            self.client.get(reverse('original_document_pages', args=[agreement.id, agreement.borrowers().get().id, '1']))
+        self.assertEqual(self.cached_ranges(), ['1-1.pdf'])
+        agreements[0].delete()
+        self.assertEqual(self.cached_ranges(), ['1-1.pdf'])
+        agreements[1].delete()
+        self.assertEqual(self.cached_ranges(), [])
+
+    def test_invalid_ranges(self):
+        self.assertEqual(self.get_pages('6').status_code, 404)
+        self.assertEqual(self.get_pages('0').status_code, 400)
+        self.assertEqual(self.get_pages('3-2').status_code, 400)
+        self.assertEqual(self.get_pages('x').status_code, 404)
+        with override_settings(SIGNATURE_MAX_PAGES_PER_REQUEST=2):
+            self.assertEqual(self.get_pages('1-3').status_code, 400)
+
+    def test_acknowledgement_page_loads_pages_lazily(self):
+        response = self.client.get(reverse('view_original_document', args=self.args))
+        for number in range(1, 6):
+            self.assertContains(response, reverse('original_document_pages', args=self.args + [number]))
+        self.assertContains(response, 'aspect-ratio: 612.0 / 792.0')
+        self.assertNotContains(response, '<embed')
+
+
+class ChunkedUploadTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(1)
+
+    def open_session(self, content, **data):
+        response = self.client.post(reverse('upload_sessions'), dict({'agreement_id': self.agreement.id, 'size': len(content)}, **data))
+        self.assertEqual(response.status_code, 201)
+        return response.json()['url']
+
+    def put(self, url, content, start, end):
+        return self.client.put(url, content[start:end], content_type='application/octet-stream',
+                               headers={'Content-Range': f'bytes {start}-{end - 1}/{len(content)}'})
+
+    def stored_files(self, directory):
+        path = os.path.join(self.media_root, directory)
+        return [name for _, _, names in os.walk(path) for name in names]
+
+    def test_resumed_upload_becomes_the_document(self):
+        content = make_agreement_pdf(4)
+        url = self.open_session(content, stamp_pages='last', sha256=hashlib.sha256(content).hexdigest())
+        response = self.put(url, content, 0, 1000)
+        self.assertEqual(response.json()['offset'], 1000)
+
+        # A retried piece is refused with the offset to resume from, and a
+        # resume handled by another process re-hashes the partial file.
+        response = self.put(url, content, 500, 1500)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 1000)
+        uploads._digests.clear()
+        self.assertEqual(self.client.get(url).json()['offset'], 1000)
+
+        response = self.put(url, content, 1000, len(content))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.agreement.refresh_from_db()
+        self.assertEqual(self.agreement.blob_id, hashlib.sha256(content).hexdigest())
+        self.assertEqual(self.agreement.document.name, self.agreement.blob.file.name)
+        self.assertEqual(self.agreement.stamp_page_indexes, [3])
+        self.assertEqual(len(self.agreement.page_index), 4)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.stored_files('uploads'), [])
+
+    def test_non_pdf_is_rejected_on_its_first_piece(self):
+        content = b'<html>' + bytes(10 * uploads.CHUNK_SIZE)
+        url = self.open_session(content)
+        stream = io.BytesIO(content)
+        stream.read = mock.Mock(wraps=stream.read)
+        session = UploadSession.objects.get()
+        with self.assertRaises(uploads.UploadError):
+            uploads.receive(session, stream, 0, len(content))
+        stream.read.assert_called_once_with(uploads.CHUNK_SIZE)
+
+        response = self.put(url, content, 0, len(content))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.stored_files('uploads') + self.stored_files('blobs'), [])
+
+    def test_incomplete_and_oversized_documents_are_rejected(self):
+        content = make_agreement_pdf(3)
+        cases = {
+            'truncated': (content[:-200], {}),
+            'wrong hash': (content, {'sha256': hashlib.sha256(b'other').hexdigest()}),
+            'too many pages': (content, {}),
+        }
+        for case, (data, extra) in cases.items():
+            with self.subTest(case=case), override_settings(SIGNATURE_MAX_UPLOAD_PAGES=2 if case == 'too many pages' else 2000):
+                url = self.open_session(data, **extra)
+                response = self.put(url, data, 0, len(data))
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(DocumentBlob.objects.exists())
+                self.assertEqual(self.stored_files('uploads'), [])
+        self.agreement.refresh_from_db()
+        self.assertEqual(self.agreement.document.name, 'documents/agreement.pdf')
+
+    def test_form_upload_checks_the_pdf(self):
+        self.client.post(reverse('loan_process'), {
+            'step': 'upload_agreement',
+            'agreement_id': self.agreement.id,
+            'document': SimpleUploadedFile('agreement.pdf', b'%PDF-1.4\nnot really', content_type='application/pdf'),
+        })
+        self.assertFalse(DocumentBlob.objects.exists())
+
+
+@override_settings(SIGNATURE_STAMPING_MODE='deferred')
+class BatchSigningTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        # Borrower 0 of each agreement is the same person: alone on the
+        # first, with a co-borrower on the second, already signed on the
+        # third.
+        self.agreements = [create_agreement(n) for n in (1, 2, 1)]
+        for agreement in self.agreements:
+            agreement.borrowers().filter(name='Borrower 0').update(loan_id='LOAN-7')
+        third = self.agreements[2]
+        record_signature(third, third.borrowers().get(), make_signature_data_url(), '10.0.0.1')
+        create_agreement(1).borrowers().update(mobile_number='9111111111')
+        self.borrower = self.agreements[0].borrowers().get()
+
+    def wait(self, url):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            progress = self.client.get(url, {'format': 'json'}).json()
+            if progress['finished']:
+                return progress
+            time.sleep(0.05)
+        self.fail('batch did not finish')
+
+    def test_pending_agreements(self):
+        by_mobile = pending_borrowers(self.borrower)
+        self.assertEqual([row.agreement_id for row in by_mobile], [agreement.id for agreement in self.agreements[:2]])
+        self.assertEqual({row.name for row in by_mobile}, {'Borrower 0'})
+        by_loan = pending_borrowers(self.borrower, BatchSigning.MATCH_LOAN_ID)
+        self.assertEqual([row.pk for row in by_loan], [row.pk for row in by_mobile])
+
+    def test_one_drawing_signs_every_pending_agreement(self):
+        args = [self.agreements[0].id, self.borrower.id]
+        response = self.client.get(reverse('batch_sign', args=args))
+        self.assertContains(response, 'each of these 2 agreements')
+
+        self.assertEqual(self.client.post(reverse('batch_sign', args=args), {'signature': make_signature_data_url()}).status_code, 400)
+        with mock.patch('signature.batch.prepare_signature', wraps=prepare_signature) as prepare:
+            response = self.client.post(reverse('batch_sign', args=args), {'signature': make_signature_data_url(), 'acknowledge_checkbox': 'on'})
+        prepare.assert_called_once()
+        progress = self.wait(response['Location'])
+        self.assertEqual([item['status'] for item in progress['agreements']], [StampingJob.DONE] * 2)
+
+        first, second = (LoanAgreement.objects.get(pk=agreement.id) for agreement in self.agreements[:2])
+        self.assertTrue(first.is_fully_signed())
+        self.assertEqual([len(names) for names in stamp_names(first.signed_document.path)], [1, 1, 1])
+        self.assertEqual(list(second.signatures().values_list('borrower_name', flat=True)), ['Borrower 0'])
+        self.assertEqual(pending_borrowers(self.borrower), [])
+
+    def test_failures_are_reported_per_agreement(self):
+        def record(agreement, *args, **kwargs):
+            if agreement.id == self.agreements[1].id:
+                raise OSError('disk full')
+            return record_prepared_signature(agreement, *args, **kwargs)
+
+        with mock.patch('signature.batch.record_prepared_signature', side_effect=record):
+            batch, futures = start_batch(self.borrower, make_signature_data_url(), '10.0.0.1')
+            for future in futures:
+                future.exception()
+        statuses = {item.borrower.agreement_id: (item.status, item.error) for item in batch.items.select_related('borrower')}
+        self.assertEqual(statuses, {
+            self.agreements[0].id: (StampingJob.DONE, ''),
+            self.agreements[1].id: (StampingJob.FAILED, 'OSError: disk full'),
+        })
+
+    def test_items_left_by_a_dead_process_are_settled(self):
+        batch = BatchSigning.objects.create(borrower=self.borrower)
+        rows = [agreement.borrowers().get(name='Borrower 0') for agreement in self.agreements]
+        items = BatchSigningItem.objects.bulk_create(BatchSigningItem(batch=batch, borrower=row) for row in rows)
+        record_signature(self.agreements[0], rows[0], make_signature_data_url(), '10.0.0.1')
+        BatchSigningItem.objects.filter(pk=items[0].pk).update(status=StampingJob.RUNNING)
+        BatchSigningItem.objects.filter(pk__in=[items[0].pk, items[1].pk]).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+
+        stdout = io.StringIO()
+        call_command('process_stamping_jobs', '--once', '--stale-after', '60', stdout=stdout)
+        self.assertIn('Settled 2 stale batch signing item(s)', stdout.getvalue())
+        statuses = dict(BatchSigningItem.objects.values_list('pk', 'status'))
+        self.assertEqual([statuses[item.pk] for item in items], [StampingJob.DONE, StampingJob.FAILED, StampingJob.PENDING])
+        self.assertEqual([row.agreement_id for row in pending_borrowers(self.borrower)], [self.agreements[1].id])
+
+    def test_process_pool_falls_back_to_spawn(self):
+        self.assertEqual(process_context().get_start_method(), 'forkserver')
+        with mock.patch('multiprocessing.get_all_start_methods', return_value=['spawn']):
+            self.assertEqual(process_context().get_start_method(), 'spawn')
+
+
+class StorageLifecycleTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cold_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cold_root, ignore_errors=True)
+        storages = dict(settings.STORAGES, cold={'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': self.cold_root}})
+        cold = override_settings(STORAGES=storages)
+        cold.enable()
+        self.addCleanup(cold.disable)
+
+    def signed_agreement(self, days_ago=100, signers=2):
+        agreement = create_agreement(2, num_pages=4)
+        for i, borrower in enumerate(agreement.borrowers()[:signers]):
+            record_signature(agreement, borrower, make_signature_data_url(seed=i), '10.0.0.1')
+        agreement.signatures().update(timestamp=timezone.now() - datetime.timedelta(days=days_ago))
+        agreement.refresh_from_db()
+        return agreement
+
+    def page_texts(self, f):
+        return [page.extract_text() for page in PdfReader(f).pages]
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_finished_agreements_move_to_the_cold_tier(self):
+        agreement = self.signed_agreement()
+        recent = self.signed_agreement(days_ago=1)
+        unfinished = self.signed_agreement(signers=1)
+        hot_path = agreement.signed_document.path
+        hot_bytes = open(hot_path, 'rb').read()
+
+        call_command('archive_agreements', stdout=io.StringIO())
+        agreement.refresh_from_db()
+        cold_path = os.path.join(self.cold_root, agreement.archived_name)
+        self.assertFalse(os.path.exists(hot_path))
+        self.assertFalse(agreement.signed_document)
+        self.assertEqual(agreement.archived_sha256, hashlib.sha256(open(cold_path, 'rb').read()).hexdigest())
+        self.assertEqual(stamp_names(cold_path), stamp_names(io.BytesIO(hot_bytes)))
+        self.assertEqual(self.page_texts(cold_path), self.page_texts(io.BytesIO(hot_bytes)))
+        if pikepdf is not None:
+            self.assertLess(os.path.getsize(cold_path), len(hot_bytes))
+        for other in (recent, unfinished):
+            other.refresh_from_db()
+            self.assertIsNone(other.compacted_at)
+
+        args = [agreement.id, agreement.borrowers().first().id]
+        with mock.patch('signature.signing.composite_agreement') as composite_agreement:
+            response = self.client.get(reverse('view_signed_agreement', args=args))
+            partial = self.client.get(reverse('view_signed_agreement', args=args), headers={'Range': 'bytes=0-99'})
+        composite_agreement.assert_not_called()
+        self.assertEqual(b''.join(response.streaming_content), open(cold_path, 'rb').read())
+        self.assertEqual(response['ETag'], f'"{agreement.archived_sha256}"')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(len(b''.join(partial.streaming_content)), 100)
+        with override_settings(ROOT_URLCONF='signature.async_urls'):
+            response = async_to_sync(AsyncClient().get)(reverse('view_signed_agreement', args=args))
+            self.assertEqual(b''.join(async_to_sync(self.collect)(response)), open(cold_path, 'rb').read())
+
+        agreement.delete()
+        self.assertFalse(os.path.exists(cold_path))
+
+    async def collect(self, response):
+        return [chunk async for chunk in response.streaming_content]
+
+    @skipUnless(pikepdf, 'pikepdf is not installed')
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate')
+    def test_documents_stamped_in_place_are_recompressed_in_place(self):
+        agreement = self.signed_agreement()
+        before = open(agreement.document.path, 'rb').read()
+        call_command('archive_agreements', stdout=io.StringIO())
+        agreement.refresh_from_db()
+        self.assertIsNotNone(agreement.compacted_at)
+        self.assertEqual(agreement.archived_name, '')
+        self.assertLess(os.path.getsize(agreement.document.path), len(before))
+        self.assertEqual(stamp_names(agreement.document.path), stamp_names(io.BytesIO(before)))
+
+
+class AuditLogTests(SignatureTestCase):
+    def sign_all(self, agreement):
+        for i, borrower in enumerate(agreement.borrowers()):
+            record_signature(agreement, borrower, make_signature_data_url(seed=i), f'10.0.0.{i + 1}')
+        agreement.refresh_from_db()
+
+    def entries(self, agreement):
+        return list(AuditEntry.objects.filter(agreement_id=agreement.id).order_by('sequence'))
+
+    def test_signing_hashes_each_document_version_once(self):
+        for mode, hashes in (('deferred', 2), ('immediate', 4)):
+            with self.subTest(mode=mode), override_settings(SIGNATURE_STAMPING_MODE=mode):
+                agreement = create_agreement(3)
+                with mock.patch('signature.delivery.hashlib', mock.Mock(sha256=mock.Mock(wraps=hashlib.sha256))) as delivery_hashlib:
+                    self.sign_all(agreement)
+                    self.client.get(reverse('view_signed_agreement', args=[agreement.id, agreement.borrowers().first().id]))
+                # The document before the first signature, then each version
+                # written: the signed copy, or the document after each signer.
+                self.assertEqual(delivery_hashlib.sha256.call_count, hashes)
+                audit.seal()
+                self.assertEqual(audit.verify(agreement.id)['errors'], [])
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_signing_is_logged_and_verified_incrementally(self):
+        agreement = create_agreement(2)
+        self.sign_all(agreement)
+        self.assertEqual(audit.seal(), 3)
+        signed, _, composited = self.entries(agreement)
+        self.assertEqual([entry.event for entry in self.entries(agreement)], ['signed', 'signed', 'composited'])
+        self.assertEqual((signed.sequence, signed.prev_hash), (1, audit.GENESIS_HASH))
+        self.assertEqual((signed.signer, signed.ip_address), ('Borrower 0', '10.0.0.1'))
+        self.assertEqual(signed.document_before, hashlib.sha256(open(agreement.document.path, 'rb').read()).hexdigest())
+        self.assertEqual(signed.document_after, '')
+        self.assertEqual(composited.document_after, hashlib.sha256(open(agreement.signed_document.path, 'rb').read()).hexdigest())
+
+        stdout = io.StringIO()
+        call_command('verify_audit_log', agreement=str(agreement.id), stdout=stdout)
+        self.assertIn('verified 3 entries', stdout.getvalue())
+        self.assertEqual(AuditCheckpoint.objects.get().sequence, 3)
+
+        self.sign_all(create_agreement(1))
+        stdout = io.StringIO()
+        call_command('verify_audit_log', stdout=stdout)
+        self.assertIn('Sealed 2 and verified 2 entries', stdout.getvalue())
+        self.assertEqual(audit.verify(full=True)['checked'], 5)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate')
+    def test_in_place_stamping_chains_document_digests(self):
+        agreement = create_agreement(2)
+        self.sign_all(agreement)
+        audit.seal()
+        first, second = self.entries(agreement)
+        self.assertEqual(second.document_before, first.document_after)
+        self.assertEqual(second.document_after, hashlib.sha256(open(agreement.document.path, 'rb').read()).hexdigest())
+        self.assertEqual(second.prev_hash, first.entry_hash)
+        self.assertEqual(audit.verify(agreement.id)['errors'], [])
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_tampering_is_detected(self):
+        agreement = create_agreement(2)
+        self.sign_all(agreement)
+        self.sign_all(create_agreement(1))
+        audit.seal()
+        audit.add_checkpoint(audit.verify())
+
+        AuditEntry.objects.filter(sequence=2).update(ip_address='10.9.9.9')
+        self.assertEqual(audit.verify()['errors'], [])
+        self.assertEqual(audit.verify(full=True)['errors'], ['#2: contents do not match its hash'])
+        self.assertEqual(audit.verify(agreement.id)['errors'], ['#2: contents do not match its hash'])
+        self.assertEqual(audit.verify(agreement.id)['checked'], 0)
+
+        AuditEntry.objects.filter(sequence=4).delete()
+        self.assertEqual(audit.verify(full=True)['errors'], [
+            '#2: contents do not match its hash', '#4-#4: missing', '#5: does not follow the entry before it',
+        ])
+        AuditEntry.objects.filter(sequence=5).delete()
+        self.assertEqual(audit.verify()['errors'], [f'#5: does not match the checkpoint of {AuditCheckpoint.objects.get().created_at:%Y-%m-%d %H:%M}'])
+
+        with open(agreement.signed_document.path, 'ab') as f:
+            f.write(b'%%EOF\n')
+        self.assertIn(f'{agreement.id}: the signed copy does not match the digest logged in #3', audit.verify(agreement.id)['errors'])
+        with self.assertRaises(CommandError):
+            call_command('verify_audit_log', stdout=io.StringIO(), stderr=io.StringIO())
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred', SIGNATURE_AUDIT_SEAL_BATCH=2)
+    def test_entries_are_sealed_in_the_background(self):
+        agreement = create_agreement(3)
+        first, second, _ = agreement.borrowers()
+        with mock.patch.object(audit, '_unsealed', 0):
+            record_signature(agreement, first, make_signature_data_url(), '10.0.0.1')
+            self.assertEqual(AuditEntry.objects.filter(entry_hash='').count(), 1)
+            record_signature(agreement, second, make_signature_data_url(), '10.0.0.2')
+            audit.get_executor().submit(lambda: None).result()
+        self.assertEqual(list(AuditEntry.objects.order_by('sequence').values_list('sequence', flat=True)), [1, 2])
+
+
+@skipUnless(pikepdf, 'pikepdf is not installed')
+@override_settings(SIGNATURE_LINEARIZE_FINISHED=True)
+class LinearizedDocumentTests(SignatureTestCase):
+    def first_page_end(self, content):
+        # /E of the linearization dictionary: where page one's objects end.
+        with pikepdf.open(io.BytesIO(content)) as pdf:
+            self.assertTrue(pdf.is_linearized)
+            self.assertEqual(pdf.check_linearization(), True)
+        return int(re.search(rb'/E (\d+)', content[:1024]).group(1))
+
+    def sign(self, agreement, borrowers):
+        for i, borrower in enumerate(borrowers):
+            record_signature(agreement, borrower, make_signature_data_url(seed=i), '10.0.0.1')
+        agreement.refresh_from_db()
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_finished_signed_copy_is_linearized(self):
+        agreement = create_agreement(2, num_pages=40)
+        first, second = agreement.borrowers()
+        self.sign(agreement, [first])
+        with pikepdf.open(signed_document(agreement).path) as pdf:
+            self.assertFalse(pdf.is_linearized)
+
+        self.sign(agreement, [second])
+        content = open(agreement.signed_document.path, 'rb').read()
+        first_page_end = self.first_page_end(content)
+        self.assertLess(first_page_end, len(content) // 4)
+        self.assertEqual([len(names) for names in stamp_names(io.BytesIO(content))], [2] * 40)
+
+        args = [agreement.id, first.id]
+        response = self.client.get(reverse('view_signed_agreement', args=args), headers={'Range': f'bytes=0-{first_page_end - 1}'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), content[:first_page_end])
+
+    @override_settings(SIGNATURE_STAMPING_MODE='immediate', SIGNATURE_PDF_WRITE_MODE='incremental')
+    def test_document_stamped_in_place_is_linearized_after_the_last_signature(self):
+        agreement = create_agreement(2, num_pages=4)
+        first, second = agreement.borrowers()
+        self.sign(agreement, [first])
+        with pikepdf.open(agreement.document.path) as pdf:
+            self.assertFalse(pdf.is_linearized)
+        self.sign(agreement, [second])
+        self.first_page_end(open(agreement.document.path, 'rb').read())
+        self.assertEqual([len(names) for names in stamp_names(agreement.document.path)], [2] * 4)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred', SIGNATURE_LINEARIZE_FINISHED=False)
+    def test_disabled(self):
+        agreement = create_agreement(1)
+        self.sign(agreement, agreement.borrowers())
+        with pikepdf.open(agreement.signed_document.path) as pdf:
+            self.assertFalse(pdf.is_linearized)
+
+    @override_settings(SIGNATURE_STAMPING_MODE='deferred')
+    def test_warns_once_without_pikepdf(self):
+        agreement = create_agreement(2)
+        with mock.patch('signature.stamping.pikepdf', None), mock.patch('signature.stamping._warned_no_pikepdf', False), \
+                self.assertLogs('signature.stamping', 'WARNING') as logs:
+            self.sign(agreement, agreement.borrowers())
+            composite_pdf(agreement.document.path, signed_document(agreement).path, stamp_specs(agreement), linearized=True)
+        self.assertEqual(len(logs.records), 1)
+        with pikepdf.open(agreement.signed_document.path) as pdf:
+            self.assertFalse(pdf.is_linearized)
+
+
+@override_settings(ROOT_URLCONF='signature.async_urls', SIGNATURE_STAMPING_MODE='deferred')
+class AsyncSigningViewsTests(SignatureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agreement = create_agreement(2)
+        self.borrower = self.agreement.borrowers().first()
+        self.args = [self.agreement.id, self.borrower.id]
+
+    async def test_signing_flow(self):
+        client = AsyncClient()
+        response = await client.get(reverse('view_original_document', args=self.args))
+        self.assertContains(response, reverse('original_document_pages', args=self.args + [3]))
+        response = await client.get(reverse('original_document_pages', args=self.args + ['2']))
+        self.assertEqual(len(PdfReader(io.BytesIO(b''.join([chunk async for chunk in response.streaming_content]))).pages), 1)
+        self.assertEqual((await client.get(reverse('original_document_pages', args=self.args + ['4']))).status_code, 404)
+
+        response = await client.post(reverse('sign_agreement', args=self.args), {'signature': make_signature_data_url()})
+        self.assertRedirects(response, reverse('sign_agreement_success', args=self.args), fetch_redirect_response=False)
+        response = await client.get(reverse('sign_agreement', args=self.args))
+        self.assertTemplateUsed(response, 'already_signed.html')
+
+        response = await client.get(reverse('view_signed_agreement', args=self.args))
+        self.assertEqual(response['Content-Disposition'], f'inline; filename="{self.agreement.id}.pdf"')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertEqual(stamp_names(io.BytesIO(body)), [['/DSStamp0']] * 3)
+        response = await client.get(reverse('view_signed_agreement', args=self.args), headers={'Range': 'bytes=0-99'})
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), body[:100])
+
+    async def test_unknown_borrower(self):
+        response = await AsyncClient().get(reverse('sign_agreement', args=[self.agreement.id, uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_invalid_signature(self):
+        for signature in ('data:image/png;base64,AAAA', 'data:image/png;base64,\u00e9AAA'):
+            response = await AsyncClient().post(reverse('sign_agreement', args=self.args), {'signature': signature})
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(SIGNATURE_METRICS_ENABLED=True)
+    async def test_request_metrics(self):
+        metrics.configure(True)
+        self.addCleanup(metrics.configure, False)
+        self.addCleanup(metrics.reset)
+        with self.assertLogs('signature.metrics', 'INFO') as logs:
+            await AsyncClient().post(reverse('sign_agreement', args=self.args), {'signature': make_signature_data_url()})
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['view'], record['status']), ('sign_agreement', 302))
+        self.assertLessEqual({'decode', 'db'}, set(record['stages_ms']))
+
+
+class BenchmarkAsgiTests(SignatureTestCase):
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_both_servers_complete_every_flow(self):
+        stdout = io.StringIO()
+        call_command('benchmark_asgi', borrowers=4, pages=2, bandwidth=4096, current_database=True, json_path='-', stdout=stdout)
+        servers = json.loads(stdout.getvalue())['servers']
+        self.assertEqual([case['server'] for case in servers], ['wsgi', 'asgi'])
+        for case in servers:
+            self.assertEqual((case['requests'], case['errors'], case['signed']), (24, 0, 4))
+
+
+class LoadTestTests(SignatureTestCase):
+    @override_settings(ALLOWED_HOSTS=['localhost'], SIGNATURE_STAMPING_MODE='deferred')
+    def test_every_flow_completes_and_is_stamped(self):
+        stdout = io.StringIO()
+        call_command('load_test', lenders=2, agreements=2, signers=2, borrowers=3, pages=2, current_database=True, json_path='-', stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        # 7 requests per lender flow and per borrower flow.
+        self.assertEqual((results['requests'], results['errors'], results['agreements'], results['signatures']), (84, 0, 4, 8))
+        self.assertEqual(results['stamp_check'], {'checked': 4, 'problems': []})
+        self.assertEqual(results['database']['lock_errors'], 0)
+        self.assertGreater(results['database']['write_statements'], 0)
+        self.assertLessEqual({'upload_agreement', 'acknowledge', 'sign'}, {step['step'] for step in results['steps']})
+
+    @override_settings(ALLOWED_HOSTS=['localhost'], SIGNATURE_STAMPING_MODE='deferred')
+    def test_missing_stamps_fail_the_run(self):
+        with mock.patch('signature.management.commands.load_test.stamp_counts', return_value=[1, 0]):
+            with self.assertRaises(CommandError):
+                call_command('load_test', lenders=1, agreements=1, signers=1, borrowers=1, pages=2, current_database=True,
+                             stdout=io.StringIO(), stderr=io.StringIO())
+
+
+@skipUnless('pikepdf' in available_engines(), 'pikepdf is not installed')
+class EngineConformanceTests(SignatureTestCase):
+    # Every engine must stamp like the PyPDF2 reference engine: same stamp
+    # names, forms and placements on the same pages.
+    def setUp(self):
+        super().setUp()
+        self.stamps = [
+            SignatureStamp(prepare_signature(make_signature_data_url(seed=i)), 25 + 120 * i, 25, [f'LOAN-{i}', '10.0.0.1', '2026-01-01', '12:00:00'])
+            for i in range(2)
+        ]
+
+    def documents(self):
+        writer = PdfWriter()
+        for page in PdfReader(io.BytesIO(make_agreement_pdf(3, pagesize=A4))).pages:
+            writer.add_page(page)
+        writer.pages[0].rotate(90)
+        writer.pages[1].mediabox.lower_left = (10, 20)
+        rotated = io.BytesIO()
+        writer.write(rotated)
+
+        with pikepdf.open(io.BytesIO(make_agreement_pdf(3))) as pdf:
+            object_streams = io.BytesIO()
+            pdf.save(object_streams, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+        restamped = f'{self.media_root}/restamped.pdf'
+        with open(restamped, 'wb') as f:
+            f.write(make_agreement_pdf(3))
+        stamp_document(restamped, self.stamps[:1], mode='incremental')
+        with open(restamped, 'rb') as f:
+            restamped = f.read()
+
+        return {
+            'plain': make_agreement_pdf(3),
+            'rotated': rotated.getvalue(),
+            'object_streams': object_streams.getvalue(),
+            'restamped': restamped,
+            'gapped': self.gapped_pdf(),
+        }
+
+    def gapped_pdf(self):
+        # Objects 1, 2, 3 and 7 with free entries between them and /Size 8,
+        # as an edited file may have.
+        content = b'BT /F1 12 Tf 72 720 Td (Loan agreement) Tj ET'
+        font = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+        objects = {
+            1: b'<< /Type /Catalog /Pages 2 0 R >>',
+            2: b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            3: b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 7 0 R /Resources << /Font << /F1 %s >> >> >>' % font,
+            7: b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+        }
+        out = io.BytesIO()
+        out.write(b'%PDF-1.4\n')
+        offsets = {}
+        for number, body in objects.items():
+            offsets[number] = out.tell()
+            out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+        startxref = out.tell()
+        out.write(b'xref\n0 8\n')
+        for number in range(8):
+            out.write(b'%010d 00000 n\r\n' % offsets[number] if number in offsets else b'0000000000 65535 f\r\n')
+        out.write(b'trailer\n<< /Size 8 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % startxref)
+        return out.getvalue()
+
+    def stamped(self, content, engine, mode, page_indexes=None):
+        pdf_path = f'{self.media_root}/{engine}-{mode}.pdf'
+        with open(pdf_path, 'wb') as f:
+            f.write(content)
+        stamp_document(pdf_path, self.stamps, mode=mode, page_indexes=page_indexes, engine=engine)
+        with open(pdf_path, 'rb') as f:
+            return f.read()
+
+    def assert_equivalent(self, reference, other):
+        reference, other = PdfReader(io.BytesIO(reference)), PdfReader(io.BytesIO(other))
+        self.assertEqual(len(reference.pages), len(other.pages))
+        for expected, actual in zip(reference.pages, other.pages):
+            self.assertEqual(sorted(expected['/Resources'].get('/XObject', {})), sorted(actual['/Resources'].get('/XObject', {})))
+            self.assertEqual(page_content(expected), page_content(actual))
+            for name, form in expected['/Resources'].get('/XObject', {}).items():
+                form, other_form = form.get_object(), actual['/Resources']['/XObject'][name].get_object()
+                self.assertEqual(form.get_data(), other_form.get_data())
+                self.assertEqual(list(form['/BBox']), list(other_form['/BBox']))
+
+    def test_same_stamps_as_the_reference_engine(self):
+        for document, content in self.documents().items():
+            for mode in ('incremental', 'rewrite'):
+                with self.subTest(document=document, mode=mode):
+                    reference = self.stamped(content, 'pypdf2', mode)
+                    other = self.stamped(content, 'pikepdf', mode)
+                    self.assert_equivalent(reference, other)
+                    if mode == 'incremental':
+                        self.assertTrue(other.startswith(content))
+                    with pikepdf.open(io.BytesIO(other)) as pdf:
+                        self.assertEqual(pdf.check_pdf_syntax(), [])
+
+    def test_selected_pages(self):
+        content = make_agreement_pdf(4)
+        for mode in ('incremental', 'rewrite'):
+            with self.subTest(mode=mode):
+                other = self.stamped(content, 'pikepdf', mode, page_indexes=[1, 3])
+                self.assert_equivalent(self.stamped(content, 'pypdf2', mode, page_indexes=[1, 3]), other)
+                self.assertEqual([len(names) for names in stamp_names(io.BytesIO(other))], [0, 2, 0, 2])
+
+    def test_incremental_update_does_not_walk_the_document(self):
+        content = make_agreement_pdf(40)
+        with mock.patch.object(pikepdf.Pdf, 'objects', new_callable=mock.PropertyMock, side_effect=AssertionError('walked every object')):
+            other = self.stamped(content, 'pikepdf', 'incremental', page_indexes=[39])
+        self.assert_equivalent(self.stamped(content, 'pypdf2', 'incremental', page_indexes=[39]), other)
+        self.assertTrue(other.startswith(content))
+
+    @skipUnless(pymupdf, 'PyMuPDF is not installed')
+    def test_same_rendering_as_the_reference_engine(self):
+        for document, content in self.documents().items():
+            for mode in ('incremental', 'rewrite'):
+                with self.subTest(document=document, mode=mode):
+                    renders = []
+                    for engine in ('pypdf2', 'pikepdf'):
+                        with pymupdf.open(stream=self.stamped(content, engine, mode), filetype='pdf') as pdf:
+                            renders.append([page.get_pixmap(dpi=50).samples for page in pdf])
+                    self.assertEqual(renders[0], renders[1])
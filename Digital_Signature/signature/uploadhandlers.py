@@ -0,0 +1,36 @@
+# signature/uploadhandlers.py
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler # type: ignore
+import hashlib
+
+
+class HashingUploadHandlerMixin:
+    # Hashes each uploaded file as its chunks stream in and exposes the
+    # digest as `uploaded_file.sha256`.
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.handles_chunk():
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+    def handles_chunk(self):
+        return True
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    def handles_chunk(self):
+        # Large files are passed on to the temporary-file handler, which
+        # hashes them itself.
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,176 @@
+# signature/uploads.py
+#
+# Chunked, resumable uploads of agreement documents. The client opens an
+# UploadSession and sends the file in Content-Range pieces. Each piece is
+# streamed, CHUNK_SIZE bytes at a time, into a partial file under uploads/
+# and through the session's SHA-256, and the PDF header is checked as soon
+# as its bytes arrive. When the last byte is in, the trailer and page count
+# are checked and the file is moved into the blob store, so a file that is
+# not a usable PDF never reaches blobs/ or documents/. An interrupted upload
+# resumes from the session's `received` offset.
+from django.conf import settings # type: ignore
+from django.core.files.storage import default_storage # type: ignore
+from PyPDF2.errors import PdfReadError
+from . import metrics
+from .blobs import CHUNK_SIZE, acquire_blob_file, attach_blob
+from .locks import file_lock
+from .pages import inspect_document
+import hashlib
+import os
+import re
+import threading
+
+PDF_HEADER = b'%PDF-'
+# Readers look for the trailer's startxref and %%EOF this far from the end.
+TRAILER_BYTES = 1024
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# Running digests of the sessions this process is receiving, as
+# {session id: (offset, sha256)}. hashlib state cannot be stored, so a
+# session resumed in another process re-hashes its partial file once.
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadOffsetError(UploadError):
+    # A piece that does not start where the upload left off.
+    pass
+
+
+def parse_content_range(value):
+    # "bytes 0-1023/4096" -> (0, 1024, 4096): start, length and total size.
+    match = CONTENT_RANGE_RE.match(value or '')
+    if not match:
+        raise UploadError('A Content-Range header of the form "bytes start-end/size" is required.')
+    start, end, size = (int(group) for group in match.groups())
+    if end < start or end >= size:
+        raise UploadError('Invalid Content-Range.')
+    return start, end - start + 1, size
+
+
+def partial_path(session):
+    return default_storage.path(os.path.join('uploads', f'{session.id}.part'))
+
+
+def upload_lock(session):
+    return file_lock(default_storage.path(os.path.join('locks', f'upload-{session.id}.lock')))
+
+
+def check_header(head):
+    # `head` is however much of the start of the file has arrived so far.
+    if not PDF_HEADER.startswith(head[:len(PDF_HEADER)]):
+        raise UploadError('The file is not a PDF: it does not start with %PDF-.')
+
+
+def check_trailer(tail):
+    if b'%%EOF' not in tail or b'startxref' not in tail:
+        raise UploadError('The file is not a complete PDF: its trailer is missing.')
+
+
+def check_pdf_file(f):
+    # Header and trailer checks for a file that arrived in one piece.
+    f.seek(0)
+    check_header(f.read(len(PDF_HEADER)))
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - TRAILER_BYTES))
+    check_trailer(f.read())
+    f.seek(0)
+
+
+def _digest(session, f):
+    # The running digest of the first session.received bytes of `f`.
+    with _digests_lock:
+        offset, digest = _digests.pop(session.id, (None, None))
+    if offset != session.received:
+        digest = hashlib.sha256()
+        f.seek(0)
+        remaining = session.received
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def receive(session, stream, start, length):
+    # Appends `length` bytes read from `stream` at offset `start`, and
+    # returns True once the whole file has arrived. A stream that ends early
+    # leaves the session at the last byte written, for the client to resume
+    # from.
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with upload_lock(session):
+        session.refresh_from_db(fields=['received'])
+        if start != session.received:
+            raise UploadOffsetError(f'The upload continues at byte {session.received}.')
+        with open(path, 'a+b') as f:
+            digest = _digest(session, f)
+            f.truncate(session.received)
+            f.seek(session.received)
+            # The header was checked when its bytes arrived.
+            head = PDF_HEADER
+            if session.received < len(PDF_HEADER):
+                f.seek(0)
+                head = f.read()
+            try:
+                remaining = length
+                while remaining:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    if len(head) < len(PDF_HEADER):
+                        head += chunk[:len(PDF_HEADER) - len(head)]
+                        check_header(head)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    session.received += len(chunk)
+                    remaining -= len(chunk)
+            finally:
+                f.flush()
+                with _digests_lock:
+                    _digests[session.id] = (session.received, digest)
+                session.save(update_fields=['received', 'updated_at'])
+                metrics.count('upload_bytes', session.received - start)
+    return session.received == session.size
+
+
+def complete(session):
+    # Validates the finished upload and makes it the agreement's document.
+    path = partial_path(session)
+    with upload_lock(session), open(path, 'rb') as f:
+        sha256 = _digest(session, f).hexdigest()
+        if session.sha256 and session.sha256 != sha256:
+            raise UploadError('The file does not match the declared SHA-256.')
+        f.seek(max(0, session.size - TRAILER_BYTES))
+        check_trailer(f.read())
+        f.seek(0)
+        try:
+            with metrics.span('inspect'):
+                page_index, page_indexes = inspect_document(
+                    f, session.stamp_pages, session.stamp_pages_value, settings.SIGNATURE_ANCHOR_TEXT,
+                    max_pages=settings.SIGNATURE_MAX_UPLOAD_PAGES,
+                )
+        except (ValueError, PdfReadError) as e:
+            raise UploadError(str(e))
+        agreement = session.agreement
+        agreement.stamp_pages = session.stamp_pages
+        agreement.stamp_pages_value = session.stamp_pages_value
+        agreement.stamp_page_indexes = page_indexes
+        agreement.page_index = page_index
+        agreement.save(update_fields=['stamp_pages', 'stamp_pages_value', 'stamp_page_indexes', 'page_index'])
+        attach_blob(agreement, acquire_blob_file(path, sha256))
+        session.delete()
+    return agreement
+
+
+def discard(session):
+    with upload_lock(session):
+        with _digests_lock:
+            _digests.pop(session.id, None)
+        if os.path.exists(partial_path(session)):
+            os.unlink(partial_path(session))
+        session.delete()
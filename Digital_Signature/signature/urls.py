@@ -4,18 +4,40 @@ from django.conf.urls.static import static # type: ignore
 import uuid
 
 from django.urls import path
+from . import async_views, views
 from .views import (
-    LoanProcessView, ViewOriginalDocumentView, SignAgreementView,
-    SignAgreementSuccessView, ViewSignedAgreementView
+    LoanProcessView, BulkImportView, ExportLinksView, MetricsView, UploadSessionCreateView, UploadSessionView, BatchSignView,
+    BatchSignStatusView,
 )
 
+
+def signing_urlpatterns(module):
+    # The borrower-facing views, from views.py or from async_views.py.
+    return [
+        path('view_original_document/<uuid:agreement_id>/<uuid:borrower_id>/', module.ViewOriginalDocumentView.as_view(), name='view_original_document'),
+        path('original_document_pages/<uuid:agreement_id>/<uuid:borrower_id>/<str:pages>/', module.OriginalDocumentPagesView.as_view(), name='original_document_pages'),
+        path('sign_agreement/<uuid:agreement_id>/<uuid:borrower_id>/', module.SignAgreementView.as_view(), name='sign_agreement'),
+        path('sign_agreement_success/<uuid:agreement_id>/<uuid:borrower_id>/', module.SignAgreementSuccessView.as_view(), name='sign_agreement_success'),
+        path('view_signed_agreement/<uuid:agreement_id>/<uuid:borrower_id>/', module.ViewSignedAgreementView.as_view(), name='view_signed_agreement'),
+    ]
+
+
+# Linked from the signing success page, so served alongside either set of
+# signing views.
+batch_urlpatterns = [
+    path('batch_sign/<uuid:agreement_id>/<uuid:borrower_id>/', BatchSignView.as_view(), name='batch_sign'),
+    path('batch_sign/status/<uuid:batch_id>/', BatchSignStatusView.as_view(), name='batch_sign_status'),
+]
+
+
 urlpatterns = [
     path('loan_process/', LoanProcessView.as_view(), name='loan_process'),
-    path('view_original_document/<uuid:agreement_id>/<uuid:borrower_id>/', ViewOriginalDocumentView.as_view(), name='view_original_document'),
-    path('sign_agreement/<uuid:agreement_id>/<uuid:borrower_id>/', SignAgreementView.as_view(), name='sign_agreement'),
-    path('sign_agreement_success/<uuid:agreement_id>/<uuid:borrower_id>/', SignAgreementSuccessView.as_view(), name='sign_agreement_success'),
-    path('view_signed_agreement/<uuid:agreement_id>/<uuid:borrower_id>/', ViewSignedAgreementView.as_view(), name='view_signed_agreement'),
-]
+    path('uploads/', UploadSessionCreateView.as_view(), name='upload_sessions'),
+    path('uploads/<uuid:upload_id>/', UploadSessionView.as_view(), name='upload_session'),
+    path('bulk_import/', BulkImportView.as_view(), name='bulk_import'),
+    path('export_links/', ExportLinksView.as_view(), name='export_links'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+] + batch_urlpatterns + signing_urlpatterns(async_views if settings.SIGNATURE_ASYNC_VIEWS else views)
 
 
 if settings.DEBUG:
@@ -1,20 +1,36 @@
+from django.conf import settings
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.views import View
 from django.views.generic import CreateView, UpdateView, DetailView, FormView
-from django.http import HttpResponseBadRequest, HttpResponse, FileResponse
-from .forms import LoanAgreementForm, NumberOfBorrowersForm, BorrowerDetailFormSet, BorrowerDetailForm
-from .models import BorrowerSignature, LoanAgreement
+from django.http import Http404, HttpResponseBadRequest, HttpResponse, FileResponse, JsonResponse, StreamingHttpResponse
+from .forms import LoanAgreementForm, NumberOfBorrowersForm, BorrowerDetailFormSet, BorrowerDetailForm, BulkImportForm, UploadSessionForm
+from .models import BatchSigning, BorrowerSignature, LoanAgreement, StampingJob, UploadSession
+from . import metrics
+from .images import SignatureImageError
+from .signing import record_signature, signed_document, stamping_status
+from .delivery import serve_file
+from .blobs import attach_document
+from .batch import batch_progress, pending_borrowers, start_batch
+from .bulk import import_agreements, iter_rows
+from .pages import PAGE_RANGE_RE, inspect_document
+from .pagecache import page_range_path, page_sizes
+from .export import EXPORT_FORMATS, iter_signing_links
+from .lifecycle import is_final, serve_archived_document
+from .uploads import UploadError, UploadOffsetError, complete, discard, parse_content_range, receive
 from django.forms import formset_factory
 from django.utils import timezone
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-import io
-import base64
-from PIL import Image
+from PyPDF2.errors import PdfReadError
 import datetime
+import uuid
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def get_borrower(agreement_id, borrower_id):
+    # Borrower and agreement in one query.
+    return get_object_or_404(BorrowerSignature.objects.select_related('agreement'), pk=borrower_id, agreement_id=agreement_id)
+
 
 class LoanProcessView(View):
     def get(self, request, *args, **kwargs):
@@ -29,13 +45,14 @@ class LoanProcessView(View):
         elif step == 'upload_agreement':
             agreement_id = request.GET.get('agreement_id')
             upload_form = LoanAgreementForm()
-            return render(request, 'loan_process.html', {'step': step, 'upload_form': upload_form, 'agreement_id': agreement_id})
+            context = {'step': step, 'upload_form': upload_form, 'agreement_id': agreement_id, 'upload_chunk_bytes': settings.SIGNATURE_UPLOAD_CHUNK_BYTES}
+            return render(request, 'loan_process.html', context)
         
         elif step == 'generate_links':
             agreement_id = request.GET.get('agreement_id')
             agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-            borrowers = BorrowerSignature.objects.filter(agreement=agreement)
-            borrower_links = {borrower.name: request.build_absolute_uri(reverse('view_original_document', args=[agreement.id, borrower.id])) for borrower in borrowers}
+            borrowers = agreement.borrowers()
+            borrower_links = [(borrower.name, request.build_absolute_uri(reverse('view_original_document', args=[agreement.id, borrower.id]))) for borrower in borrowers]
             return render(request, 'loan_process.html', {'step': step, 'agreement': agreement, 'borrower_links': borrower_links})
         
         else:  # Default step: number_of_borrowers
@@ -74,20 +91,131 @@ class LoanProcessView(View):
             upload_form = LoanAgreementForm(request.POST, request.FILES)
             if upload_form.is_valid():
                 agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-                agreement.document = upload_form.cleaned_data['document']
-                agreement.save()
+                document = upload_form.cleaned_data['document']
+                policy = upload_form.cleaned_data['stamp_pages']
+                value = upload_form.cleaned_data['stamp_pages_value']
+                try:
+                    page_index, page_indexes = inspect_document(document, policy, value, settings.SIGNATURE_ANCHOR_TEXT, max_pages=settings.SIGNATURE_MAX_UPLOAD_PAGES)
+                except (ValueError, PdfReadError) as e:
+                    upload_form.add_error(None, str(e))
+                    return render(request, 'loan_process.html', {'step': step, 'upload_form': upload_form, 'agreement_id': agreement_id}, status=400)
+                document.seek(0)
+                agreement.stamp_pages = policy
+                agreement.stamp_pages_value = value
+                agreement.stamp_page_indexes = page_indexes
+                agreement.page_index = page_index
+                agreement.save(update_fields=['stamp_pages', 'stamp_pages_value', 'stamp_page_indexes', 'page_index'])
+                attach_document(agreement, document)
                 return redirect(reverse('loan_process') + f'?step=generate_links&agreement_id={agreement_id}')
         
         return redirect('loan_process')
 
 
+def upload_status(session, status=200):
+    return JsonResponse({
+        'id': str(session.id),
+        'url': reverse('upload_session', args=[session.id]),
+        'offset': session.received,
+        'size': session.size,
+        'complete': False,
+    }, status=status)
+
+
+class UploadSessionCreateView(View):
+    # Opens a chunked upload of an agreement's document. The file is then
+    # PUT to the returned url in pieces carrying a Content-Range header.
+    def post(self, request):
+        try:
+            agreement_id = uuid.UUID(request.POST.get('agreement_id', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid agreement id.'}, status=400)
+        agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
+        form = UploadSessionForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'error': form.errors.get_json_data()}, status=400)
+        session = form.save(commit=False)
+        session.agreement = agreement
+        session.save()
+        response = upload_status(session, status=201)
+        response['Location'] = reverse('upload_session', args=[session.id])
+        return response
+
+
+class UploadSessionView(View):
+    # GET (or HEAD) reports how much has arrived, so an interrupted client
+    # knows where to resume; PUT appends a piece; DELETE abandons the upload.
+    def get(self, request, upload_id):
+        return upload_status(get_object_or_404(UploadSession, pk=upload_id))
+
+    def put(self, request, upload_id):
+        session = get_object_or_404(UploadSession.objects.select_related('agreement'), pk=upload_id)
+        try:
+            start, length, size = parse_content_range(request.headers.get('Content-Range'))
+        except UploadError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if size != session.size or length != int(request.META.get('CONTENT_LENGTH') or 0):
+            return JsonResponse({'error': 'Content-Range does not match the upload.'}, status=400)
+        try:
+            if not receive(session, request, start, length):
+                return upload_status(session)
+            agreement = complete(session)
+        except UploadOffsetError:
+            return upload_status(session, status=409)
+        except UploadError as e:
+            discard(session)
+            return JsonResponse({'error': str(e)}, status=400)
+        next_url = reverse('loan_process') + f'?step=generate_links&agreement_id={agreement.id}'
+        response = JsonResponse({'offset': size, 'size': size, 'complete': True, 'next': next_url}, status=201)
+        response['Location'] = next_url
+        return response
+
+    def delete(self, request, upload_id):
+        discard(get_object_or_404(UploadSession, pk=upload_id))
+        return HttpResponse(status=204)
+
+
+class BulkImportView(View):
+    def get(self, request):
+        return render(request, 'bulk_import.html', {'form': BulkImportForm()})
+
+    def post(self, request):
+        form = BulkImportForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return render(request, 'bulk_import.html', {'form': form}, status=400)
+        upload = form.cleaned_data['file']
+        rows = iter_rows(upload.file, form.cleaned_data['format'], upload.name)
+        result = import_agreements(rows, document=form.cleaned_data['document'])
+        return render(request, 'bulk_import.html', {'form': BulkImportForm(), 'result': result})
+
+
+class ExportLinksView(View):
+    def get(self, request):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return HttpResponseBadRequest("Unsupported export format.")
+        try:
+            agreement_ids = [uuid.UUID(value) for value in request.GET.getlist('agreement_id')]
+        except ValueError:
+            return HttpResponseBadRequest("Invalid agreement id.")
+        rows = iter_signing_links(request, agreement_ids)
+        return StreamingHttpResponse(
+            EXPORT_FORMATS[fmt](rows),
+            content_type='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename="signing_links.{fmt}"'},
+        )
+
+
 class ViewOriginalDocumentView(View):
     def get(self, request, agreement_id, borrower_id):
-        agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-        borrower = get_object_or_404(BorrowerSignature, pk=borrower_id, agreement=agreement)
+        borrower = get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
         context = {
             'document_url': agreement.document.url,
             'borrower': borrower,
+            'pages': [
+                {'number': number, 'width': round(width, 2), 'height': round(height, 2)}
+                for number, (width, height) in enumerate(page_sizes(agreement), start=1)
+            ],
         }
         return render(request, 'original_document.html', context)
     
@@ -98,10 +226,28 @@ class ViewOriginalDocumentView(View):
             return HttpResponseBadRequest("Please acknowledge the document.")
 
 
+class OriginalDocumentPagesView(View):
+    # One page ("3") or a short range ("3-5") of the original document as a
+    # PDF of its own.
+    def get(self, request, agreement_id, borrower_id, pages):
+        borrower = get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+        match = PAGE_RANGE_RE.match(pages)
+        if not match:
+            raise Http404
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first or last - first >= settings.SIGNATURE_MAX_PAGES_PER_REQUEST:
+            return HttpResponseBadRequest("Invalid page range.")
+        if last > len(page_sizes(agreement)):
+            raise Http404
+        return serve_file(request, page_range_path(agreement, first, last), 'application/pdf')
+
+
 class SignAgreementView(View):
     def get(self, request, agreement_id, borrower_id):
-        agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-        borrower = get_object_or_404(BorrowerSignature, pk=borrower_id, agreement=agreement)
+        borrower = get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
         existing_signature = BorrowerSignature.objects.filter(agreement=agreement, borrower_name=borrower.name).exists()
         
         if existing_signature:
@@ -113,85 +259,100 @@ class SignAgreementView(View):
         return render(request, 'signature/sign_agreement.html', context)
     
     def post(self, request, agreement_id, borrower_id):
-        agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-        borrower = get_object_or_404(BorrowerSignature, pk=borrower_id, agreement=agreement)
+        borrower = get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
        
         
         signature_data_url = request.POST.get('signature')
         if signature_data_url:
-            signatures = BorrowerSignature.objects.filter(agreement=agreement).count()
-            signatures_per_row = 5
-            horizontal_spacing = 120
-            vertical_spacing = 120
-            x_offset = 25
-            y_offset = 25
-
-            x_position = x_offset + (signatures % signatures_per_row) * horizontal_spacing
-            y_position = y_offset + (signatures // signatures_per_row) * vertical_spacing 
-
-            signature_instance = BorrowerSignature(
-                agreement=agreement,
-                borrower_name=borrower.name,
-                x_position = x_position,
-                y_position = y_position,
-            )
-            signature_instance.save()
-            ip_address = request.META.get('REMOTE_ADDR')
-            timestamp = timezone.now()
-
-            add_signature(agreement.document.path, signature_data_url, borrower.loan_id, signature_instance, ip_address, timestamp)
-            
+            try:
+                record_signature(agreement, borrower, signature_data_url, request.META.get('REMOTE_ADDR'))
+            except SignatureImageError as e:
+                return HttpResponseBadRequest(str(e))
             return redirect('sign_agreement_success', agreement_id=agreement_id, borrower_id=borrower_id)
 
 
 class SignAgreementSuccessView(View):
     def get(self, request, agreement_id, borrower_id):
-        agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-        borrower = get_object_or_404(BorrowerSignature, pk=borrower_id, agreement=agreement)
-        return render(request, 'sign_agreement_success.html', {'agreement': agreement, 'borrower': borrower})
+        borrower = get_borrower(agreement_id, borrower_id)
+        agreement = borrower.agreement
+        return render(request, 'sign_agreement_success.html', {'agreement': agreement, 'borrower': borrower, 'stamping_status': stamping_status(agreement)})
 
 
 class ViewSignedAgreementView(View):
     def get(self, request, agreement_id, borrower_id):
         agreement = get_object_or_404(LoanAgreement, pk=agreement_id)
-        return FileResponse(agreement.document.open(), content_type='application/pdf')
-
-
-def add_signature(pdf_path, signature_data_url, loan_id, signature_instance, ip_address, timestamp):
-    reader = PdfReader(pdf_path)
-    writer = PdfWriter()
-
-    signature_data = base64.b64decode(signature_data_url.split(',')[1])
-    signature_image = Image.open(io.BytesIO(signature_data))
-    
-    current_date = timezone.now().date().strftime('%Y-%m-%d')
-    current_time = timezone.now().time().strftime('%H:%M:%S')
-
-    for page_num in range(len(reader.pages)):
-        page = reader.pages[page_num]
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=letter)
-        signature_image = signature_image.resize((80, 90))
-        can.drawImage(ImageReader(signature_image), signature_instance.x_position, signature_instance.y_position + 10, width=80, height=90)
-        text_y_position = signature_instance.y_position + 20
-        can.drawString(signature_instance.x_position, text_y_position - 10, f"{loan_id}")
-        can.drawString(signature_instance.x_position, text_y_position - 20, f"{ip_address}")
-        can.drawString(signature_instance.x_position, text_y_position - 30, f"{current_date}")
-        can.drawString(signature_instance.x_position, text_y_position - 40, f"{current_time}")
-        can.save()
-
-        packet.seek(0)
-        overlay_pdf = PdfReader(packet)
-        overlay_page = overlay_pdf.pages[0]
-        page.merge_page(overlay_page)
-        writer.add_page(page)
-
-    with open(pdf_path, 'wb') as output_pdf:
-        writer.write(output_pdf)
-
-
+        if agreement.archived_name:
+            return serve_archived_document(request, agreement)
+        status = stamping_status(agreement)
+        if status in (StampingJob.PENDING, StampingJob.RUNNING, StampingJob.FAILED):
+            context = {'agreement': agreement, 'borrower_id': borrower_id, 'stamping_status': status}
+            return render(request, 'stamping_status.html', context, status=500 if status == StampingJob.FAILED else 202)
+        return serve_file(request, signed_document(agreement).path, 'application/pdf', immutable=is_final(agreement))
+
+
+class BatchSignView(View):
+    # Lists every agreement still waiting for the borrower whose link this
+    # is, matched by ?match=mobile_number (the default) or loan_id, and signs
+    # them all with one drawing.
+    def get_match(self, request):
+        match = request.GET.get('match', BatchSigning.MATCH_MOBILE_NUMBER)
+        if match not in dict(BatchSigning.MATCH_CHOICES):
+            raise Http404
+        return match
 
+    def get(self, request, agreement_id, borrower_id):
+        borrower = get_borrower(agreement_id, borrower_id)
+        match = self.get_match(request)
+        context = {
+            'borrower': borrower,
+            'match': match,
+            'match_choices': BatchSigning.MATCH_CHOICES,
+            'pending': pending_borrowers(borrower, match),
+        }
+        return render(request, 'batch_sign.html', context)
 
+    def post(self, request, agreement_id, borrower_id):
+        borrower = get_borrower(agreement_id, borrower_id)
+        match = self.get_match(request)
+        if not request.POST.get('acknowledge_checkbox'):
+            return HttpResponseBadRequest("Please acknowledge the documents.")
+        signature_data_url = request.POST.get('signature')
+        if not signature_data_url:
+            return HttpResponseBadRequest("A signature is required.")
+        try:
+            batch, _ = start_batch(borrower, signature_data_url, request.META.get('REMOTE_ADDR'), match)
+        except SignatureImageError as e:
+            return HttpResponseBadRequest(str(e))
+        return redirect('batch_sign_status', batch_id=batch.id)
+
+
+class BatchSignStatusView(View):
+    # Per-agreement progress of a batch, as a page that refreshes itself
+    # until every agreement is done, or as JSON with ?format=json.
+    def get(self, request, batch_id):
+        batch = get_object_or_404(BatchSigning, pk=batch_id)
+        items, finished = batch_progress(batch)
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'finished': finished,
+                'agreements': [
+                    {'agreement_id': str(item.borrower.agreement_id), 'loan_id': item.borrower.loan_id, 'status': item.status, 'error': item.error}
+                    for item in items
+                ],
+            })
+        return render(request, 'batch_sign_status.html', {'batch': batch, 'items': items, 'finished': finished})
+
+
+
+class MetricsView(View):
+    # Prometheus scrape endpoint, answered for local and INTERNAL_IPS
+    # clients only.
+    def get(self, request):
+        remote_addr = request.META.get('REMOTE_ADDR')
+        if not settings.SIGNATURE_METRICS_ENABLED or not (remote_addr in LOCAL_ADDRESSES or remote_addr in settings.INTERNAL_IPS):
+            raise Http404
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # # signature/views.py
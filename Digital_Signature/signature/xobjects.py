@@ -0,0 +1,94 @@
+# signature/xobjects.py
+#
+# Places signer stamps on pages as shared form XObjects. Each stamp is drawn
+# once in its own coordinate space and every page positions it with a `cm`,
+# so a signature image is stored once per document however many pages carry
+# it.
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+from . import metrics
+from .placement import TEXT_DEPTH, format_matrix, page_entry, slot_origin, stamp_matrix
+
+
+def content_refs(page):
+    contents = page.raw_get('/Contents') if '/Contents' in page else None
+    if contents is None:
+        return []
+    resolved = contents.get_object()
+    if isinstance(resolved, ArrayObject):
+        return list(resolved)
+    return [contents]
+
+
+def stamp_form(stamp, import_object):
+    overlay = stamp.overlay
+    content = DecodedStreamObject()
+    content.set_data(overlay.get_contents().get_data())
+    # flate_encode() returns a bare stream, so the form keys go on afterwards.
+    form = content.flate_encode()
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject([NumberObject(0), NumberObject(0), NumberObject(stamp.width), NumberObject(stamp.height)]),
+        NameObject('/Resources'): import_object(overlay['/Resources']),
+    })
+    return form
+
+
+class PageStamper:
+    # add(obj) stores an object in the output and returns its reference;
+    # import_object(obj) copies an object graph from the overlay documents.
+    def __init__(self, stamps, add, import_object):
+        self.stamps = stamps
+        self.add = add
+        self.import_object = import_object
+        self._forms = {}
+        self._draws = {}
+        self._push = None
+
+    def _form(self, index):
+        if index not in self._forms:
+            self._forms[index] = self.add(stamp_form(self.stamps[index], self.import_object))
+        return self._forms[index]
+
+    def _draw(self, placements):
+        if placements not in self._draws:
+            draw = DecodedStreamObject()
+            operators = ['Q\n']
+            for name, matrix in placements:
+                operators.append(f'q {format_matrix(matrix)} cm {name} Do Q\n')
+            draw.set_data(''.join(operators).encode('ascii'))
+            self._draws[placements] = self.add(draw)
+        return self._draws[placements]
+
+    def _push_ref(self):
+        # Wraps the original content in q/Q so its graphics state cannot
+        # leak into the stamps.
+        if self._push is None:
+            push = DecodedStreamObject()
+            push.set_data(b'q\n')
+            self._push = self.add(push)
+        return self._push
+
+    def stamp(self, page, entry=None):
+        # Returns the /Resources and /Contents the stamped page should have.
+        # entry is the page's page-index entry; without one only the page's
+        # own mediabox and rotation are used.
+        if entry is None:
+            entry = page_entry(page)
+        resources = DictionaryObject(page['/Resources'].get_object()) if '/Resources' in page else DictionaryObject()
+        xobjects = DictionaryObject(resources['/XObject'].get_object()) if '/XObject' in resources else DictionaryObject()
+
+        placements = []
+        suffix = 0
+        for index, stamp in enumerate(self.stamps):
+            while f'/DSStamp{suffix}' in xobjects:
+                suffix += 1
+            name = f'/DSStamp{suffix}'
+            xobjects[NameObject(name)] = self._form(index)
+            origin_x, origin_y = slot_origin(entry)
+            placements.append((name, stamp_matrix(entry, origin_x + stamp.x_position, origin_y + stamp.y_position - TEXT_DEPTH)))
+        resources[NameObject('/XObject')] = xobjects
+
+        contents = ArrayObject([self._push_ref()] + content_refs(page) + [self._draw(tuple(placements))])
+        metrics.count('pages_stamped')
+        return resources, contents